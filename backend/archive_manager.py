@@ -0,0 +1,444 @@
+# archive_manager.py
+"""
+Arquivamento de campanhas finalizadas.
+
+Os registros do dispatch_log de campanhas finalizadas (ARCHIVE_CAMPAIGN_STATUSES) sem envios há mais
+de ARCHIVE_AFTER_DAYS dias são movidos para um banco de arquivo por mês de criação da campanha
+(ARCHIVE_FOLDER/storebot_archive_AAAA_MM.db). A mensagem personalizada e a resposta da API, que são
+a maior parte de cada registro, ficam comprimidas (zlib) em uma única coluna `payload`, junto com as
+colunas do resultado do envio (id da mensagem, ack e código de erro). Como cada
+registro é curto, a compressão usa um dicionário por campanha (montado com os primeiros registros),
+que leva o payload de ~180 para ~30 bytes; sem ele o zlib quase não reduz textos desse tamanho.
+
+No banco principal ficam a linha da campanha (com archived_at/archive_file) e os contadores por status
+em campaign_stats, então listagem, monitor e totais continuam iguais. O log da campanha continua
+disponível pela mesma API (database_manager.get_dispatch_log_page), que lê do arquivo.
+
+O espaço liberado no banco principal é devolvido ao sistema de arquivos com `PRAGMA incremental_vacuum`
+em passos curtos, sem o bloqueio longo de um VACUUM completo (bancos antigos precisam de um VACUUM
+único para passar a auto_vacuum=INCREMENTAL: --enable-incremental-vacuum).
+
+Uso:
+    python -m backend.archive_manager [--older-than-days 30] [--campaign ID] [--dry-run]
+    python -m backend.archive_manager --vacuum-only
+    python -m backend.archive_manager --enable-incremental-vacuum
+"""
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import zlib
+
+from backend import database_manager
+from backend import dispatch_log_format
+from backend.config import (
+    ARCHIVE_FOLDER,
+    ARCHIVE_CAMPAIGN_STATUSES,
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_COMPRESSION_LEVEL,
+    ARCHIVE_VACUUM_PAGES_PER_STEP,
+    DB_BUSY_TIMEOUT_MS,
+    DISPATCH_LOG_PAGE_SIZE,
+)
+
+ARCHIVE_COLUMNS = "log_id, campaign_id, contact_phone, contact_name, status, sent_at, retry_count, next_attempt_at"
+# Campos do registro guardados no payload (arquivos antigos têm só os dois primeiros)
+ARCHIVE_PAYLOAD_FIELDS = ("personalized_message_text", "api_response", "api_message_id", "api_ack", "api_error_code")
+ARCHIVE_DICTIONARY_SAMPLES = 16 # Registros usados para montar o dicionário de compressão da campanha
+ARCHIVE_DICTIONARY_MAX_BYTES = 32 * 1024 # Limite do zlib para dicionários
+
+
+def archive_folder():
+    """Pasta dos bancos de arquivo, ao lado do banco principal."""
+    return os.path.join(os.path.dirname(os.path.abspath(database_manager.DATABASE_NAME)), ARCHIVE_FOLDER)
+
+
+def archive_file_for(campaign):
+    """Nome do banco de arquivo da campanha (mês de criação)."""
+    created_at = campaign['created_at'] or datetime.datetime.now().strftime("%Y-%m")
+    return f"storebot_archive_{created_at[:4]}_{created_at[5:7]}.db"
+
+
+def _open_archive(archive_file, create=False):
+    """Abre um banco de arquivo. Sem `create`, abre somente leitura e falha se ele não existir."""
+    path = os.path.join(archive_folder(), archive_file)
+    if create:
+        os.makedirs(archive_folder(), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    else:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    conn.row_factory = sqlite3.Row
+    if create:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS archived_dispatch_log (
+            log_id INTEGER PRIMARY KEY, /* Mesmo log_id do dispatch_log */
+            campaign_id TEXT NOT NULL,
+            contact_phone TEXT NOT NULL,
+            contact_name TEXT,
+            status TEXT NOT NULL,
+            sent_at DATETIME,
+            retry_count INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at DATETIME,
+            payload BLOB /* zlib(JSON) com ARCHIVE_PAYLOAD_FIELDS, com o dicionário da campanha */
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS archive_dictionaries (
+            campaign_id TEXT PRIMARY KEY,
+            zdict BLOB NOT NULL /* Dicionário zlib dos payloads da campanha */
+        )
+        """)
+        # Mesmos índices da paginação do log no banco principal
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_archived_dispatch_log_campaign_log
+        ON archived_dispatch_log (campaign_id, log_id)
+        """)
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_archived_dispatch_log_campaign_status
+        ON archived_dispatch_log (campaign_id, status, log_id)
+        """)
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_archived_dispatch_log_phone_campaign
+        ON archived_dispatch_log (contact_phone, campaign_id)
+        """)
+        conn.commit()
+    return conn
+
+
+def payload_fields(row):
+    """Valores de ARCHIVE_PAYLOAD_FIELDS de uma linha do dispatch_log (resposta da API em texto)."""
+    api_response = dispatch_log_format.api_response_text(row['api_response'], row['api_response_compressed'])
+    return [row['personalized_message_text'], api_response, row['api_message_id'], row['api_ack'], row['api_error_code']]
+
+
+def _payload_json(fields):
+    if all(value is None for value in fields):
+        return None
+    return json.dumps(fields, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def build_dictionary(rows):
+    """Dicionário zlib a partir dos payloads de alguns registros da campanha (b"" se não houver nenhum)."""
+    samples = [_payload_json(payload_fields(row)) for row in rows[:ARCHIVE_DICTIONARY_SAMPLES]]
+    return b"".join(sample for sample in samples if sample)[-ARCHIVE_DICTIONARY_MAX_BYTES:]
+
+
+def pack_payload(fields, zdict=b""):
+    data = _payload_json(fields)
+    if data is None:
+        return None
+    compressor = zlib.compressobj(ARCHIVE_COMPRESSION_LEVEL, zdict=zdict) if zdict else zlib.compressobj(ARCHIVE_COMPRESSION_LEVEL)
+    return compressor.compress(data) + compressor.flush()
+
+
+def unpack_payload(payload, zdict=b""):
+    """Retorna um dict com os ARCHIVE_PAYLOAD_FIELDS (None nos que não foram guardados)."""
+    if payload is None:
+        return dict.fromkeys(ARCHIVE_PAYLOAD_FIELDS)
+    decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+    data = decompressor.decompress(payload) + decompressor.flush()
+    values = json.loads(data.decode("utf-8"))
+    return {field: values[i] if i < len(values) else None for i, field in enumerate(ARCHIVE_PAYLOAD_FIELDS)}
+
+
+def _campaign_dictionary(archive, campaign_id):
+    row = archive.execute("SELECT zdict FROM archive_dictionaries WHERE campaign_id = ?", (campaign_id,)).fetchone()
+    return row['zdict'] if row else None
+
+
+def get_archivable_campaigns(older_than_days=ARCHIVE_AFTER_DAYS, now=None):
+    """
+    Campanhas finalizadas, ainda não arquivadas, cujo último envio (ou a criação, se nunca enviaram)
+    é anterior a `older_than_days` dias. O MAX(sent_at) por campanha usa o índice (campaign_id, sent_at).
+    """
+    cutoff = (now or datetime.datetime.now()) - datetime.timedelta(days=older_than_days)
+    placeholders = ", ".join("?" for _ in ARCHIVE_CAMPAIGN_STATUSES)
+    conn = database_manager.get_db_connection()
+    try:
+        return conn.execute(f"""
+        SELECT c.* FROM campaigns c
+        WHERE c.status IN ({placeholders}) AND c.archived_at IS NULL
+          AND COALESCE((SELECT MAX(d.sent_at) FROM dispatch_log d WHERE d.campaign_id = c.campaign_id), c.created_at) < ?
+        ORDER BY c.created_at
+        """, (*ARCHIVE_CAMPAIGN_STATUSES, cutoff)).fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao buscar campanhas para arquivar: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+def _copy_to_archive(campaign_id, archive, batch_size):
+    """Copia os registros da campanha para o arquivo, em lotes por log_id. Retorna quantos foram copiados."""
+    conn = database_manager.get_db_connection()
+    copied = 0
+    last_log_id = 0
+    zdict = _campaign_dictionary(archive, campaign_id) # Já existe se uma cópia anterior foi interrompida
+    try:
+        while True:
+            rows = conn.execute(f"""
+            SELECT {ARCHIVE_COLUMNS}, personalized_message_text, {database_manager.DISPATCH_RESULT_COLUMNS} FROM dispatch_log
+            WHERE campaign_id = ? AND log_id > ?
+            ORDER BY log_id
+            LIMIT ?
+            """, (campaign_id, last_log_id, batch_size)).fetchall()
+            if not rows:
+                return copied
+            with archive: # Uma transação por lote; INSERT OR REPLACE torna a cópia repetível
+                if zdict is None:
+                    zdict = build_dictionary(rows)
+                    archive.execute("INSERT INTO archive_dictionaries (campaign_id, zdict) VALUES (?, ?)", (campaign_id, zdict))
+                archive.executemany(f"""
+                INSERT OR REPLACE INTO archived_dispatch_log ({ARCHIVE_COLUMNS}, payload)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, [
+                    (row['log_id'], row['campaign_id'], row['contact_phone'], row['contact_name'], row['status'],
+                     row['sent_at'], row['retry_count'] or 0, row['next_attempt_at'],
+                     pack_payload(payload_fields(row), zdict))
+                    for row in rows
+                ])
+            copied += len(rows)
+            last_log_id = rows[-1]['log_id']
+    finally:
+        conn.close()
+
+
+def _mark_archived(campaign_id, archive_file, archived_count):
+    """
+    Marca a campanha como arquivada, desde que continue finalizada e com os mesmos `archived_count`
+    registros que foram copiados (checado na mesma transação). Retorna True se marcou.
+    """
+    placeholders = ", ".join("?" for _ in ARCHIVE_CAMPAIGN_STATUSES)
+    conn = database_manager.get_db_connection()
+    conn.isolation_level = None # Controle manual da transação
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT COUNT(*) FROM dispatch_log WHERE campaign_id = ?", (campaign_id,))
+        if cursor.fetchone()[0] != archived_count:
+            cursor.execute("ROLLBACK")
+            return False
+        cursor.execute(f"""
+        UPDATE campaigns SET archived_at = ?, archive_file = ?
+        WHERE campaign_id = ? AND archived_at IS NULL AND status IN ({placeholders})
+        """, (datetime.datetime.now(), archive_file, campaign_id, *ARCHIVE_CAMPAIGN_STATUSES))
+        marked = cursor.rowcount == 1
+        cursor.execute("COMMIT" if marked else "ROLLBACK")
+        return marked
+    except sqlite3.Error as e:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        print(f"Erro ao marcar a campanha '{campaign_id}' como arquivada: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def _delete_archived_rows(campaign_id, batch_size):
+    """
+    Apaga do dispatch_log os registros de uma campanha já marcada como arquivada, em transações curtas.
+    O trigger de exclusão ignora campanhas arquivadas, então os contadores em campaign_stats ficam.
+    """
+    conn = database_manager.get_db_connection()
+    deleted = 0
+    try:
+        while True:
+            cursor = conn.execute("""
+            DELETE FROM dispatch_log WHERE log_id IN (
+                SELECT log_id FROM dispatch_log WHERE campaign_id = ? ORDER BY log_id LIMIT ?
+            )
+            """, (campaign_id, batch_size))
+            conn.commit()
+            if cursor.rowcount <= 0:
+                return deleted
+            deleted += cursor.rowcount
+    finally:
+        conn.close()
+
+
+def archive_campaign(campaign_id, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Move os registros da campanha para o banco de arquivo do mês de criação.
+
+    Ordem: copia tudo para o arquivo -> confere e marca a campanha (archived_at) -> apaga do banco
+    principal. Se o processo parar no meio, rodar de novo retoma de onde parou sem perder registros
+    (antes da marcação a cópia é refeita; depois dela, só falta apagar).
+    Retorna a quantidade de registros removidos do banco principal ou None se a campanha não pôde ser arquivada.
+    """
+    campaign = database_manager.get_campaign_details(campaign_id)
+    if campaign is None:
+        print(f"Campanha '{campaign_id}' não encontrada.")
+        return None
+    archive_file = campaign['archive_file'] or archive_file_for(campaign)
+
+    try:
+        if not campaign['archived_at']:
+            if campaign['status'] not in ARCHIVE_CAMPAIGN_STATUSES:
+                print(f"Campanha '{campaign_id}' não está finalizada (status {campaign['status']}); não será arquivada.")
+                return None
+            archive = _open_archive(archive_file, create=True)
+            try:
+                copied = _copy_to_archive(campaign_id, archive, batch_size)
+                archived_count = archive.execute(
+                    "SELECT COUNT(*) FROM archived_dispatch_log WHERE campaign_id = ?", (campaign_id,)
+                ).fetchone()[0]
+            finally:
+                archive.close()
+            if archived_count != copied or not _mark_archived(campaign_id, archive_file, copied):
+                print(f"Campanha '{campaign_id}' mudou durante o arquivamento; nada foi removido. Tente novamente.")
+                return None
+        return _delete_archived_rows(campaign_id, batch_size)
+    except sqlite3.Error as e:
+        print(f"Erro ao arquivar a campanha '{campaign_id}': {e}")
+        return None
+
+
+def archive_finished_campaigns(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """Arquiva todas as campanhas elegíveis. Retorna [(campaign_id, archive_file, registros arquivados)]."""
+    archived = []
+    for campaign in get_archivable_campaigns(older_than_days):
+        moved = archive_campaign(campaign['campaign_id'], batch_size)
+        if moved is not None:
+            archived.append((campaign['campaign_id'], archive_file_for(campaign), moved))
+    return archived
+
+
+def incremental_vacuum(pages_per_step=ARCHIVE_VACUUM_PAGES_PER_STEP, max_steps=None):
+    """
+    Devolve ao sistema de arquivos as páginas livres do banco principal, `pages_per_step` por transação
+    (cada passo segura a escrita só por alguns milissegundos). Retorna quantas páginas foram liberadas.
+    Só tem efeito com auto_vacuum=INCREMENTAL (veja enable_incremental_vacuum).
+    """
+    conn = database_manager.get_db_connection()
+    freed = 0
+    steps = 0
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            print("AVISO: O banco não usa auto_vacuum=INCREMENTAL; rode com --enable-incremental-vacuum uma vez.")
+            return 0
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while free_pages > 0 and (max_steps is None or steps < max_steps):
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages_per_step)})").fetchall()
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            freed += free_pages - remaining
+            free_pages = remaining
+            steps += 1
+        return freed
+    except sqlite3.Error as e:
+        print(f"Erro no vacuum incremental: {e}")
+        return freed
+    finally:
+        conn.close()
+
+
+def enable_incremental_vacuum():
+    """
+    Passa um banco existente para auto_vacuum=INCREMENTAL (bancos novos já são criados assim).
+    Exige um VACUUM completo, que bloqueia o banco enquanto roda: use com o worker parado.
+    Retorna True se o modo foi alterado.
+    """
+    conn = database_manager.get_db_connection()
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    except sqlite3.Error as e:
+        print(f"Erro ao ativar o vacuum incremental: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def get_archived_dispatch_log_page(archive_file, campaign_id, after_log_id=None, before_log_id=None,
+                                   limit=DISPATCH_LOG_PAGE_SIZE, status=None, contact_phone=None, message_template=None):
+    """
+    Mesma página de database_manager.get_dispatch_log_page, lida do banco de arquivo da campanha.
+    Com `message_template`, reconstrói o texto personalizado dos registros que não o gravaram.
+    """
+    page_sql, params, descending = database_manager.dispatch_log_page_filters(
+        campaign_id, after_log_id, before_log_id, limit, status, contact_phone
+    )
+    try:
+        archive = _open_archive(archive_file)
+    except sqlite3.Error as e:
+        print(f"Erro ao abrir o arquivo '{archive_file}' da campanha '{campaign_id}': {e}")
+        return [], False
+    try:
+        rows = archive.execute(f"""
+        SELECT log_id, contact_phone, contact_name, status, sent_at, retry_count, next_attempt_at, payload
+        FROM archived_dispatch_log {page_sql}
+        """, params).fetchall()
+        zdict = _campaign_dictionary(archive, campaign_id) or b""
+    except sqlite3.Error as e:
+        print(f"Erro ao buscar o log arquivado da campanha '{campaign_id}': {e}")
+        return [], False
+    finally:
+        archive.close()
+    has_more = len(rows) > limit
+    page = []
+    for row in rows[:limit]:
+        dispatch = dict(row)
+        dispatch.update(unpack_payload(dispatch.pop('payload'), zdict))
+        page.append(database_manager.dispatch_result_dict(dispatch, message_template))
+    if descending:
+        page.reverse()
+    return page, has_more
+
+
+def _database_size():
+    """Tamanho do arquivo do banco principal, depois de consolidar o WAL."""
+    database_manager.checkpoint_database()
+    return os.path.getsize(database_manager.DATABASE_NAME)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Arquiva o log de disparos de campanhas finalizadas.")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="Arquiva campanhas finalizadas sem envios há mais de N dias.")
+    parser.add_argument("--campaign", metavar="CAMPAIGN_ID",
+                        help="Arquiva só esta campanha (precisa estar finalizada), independente da idade.")
+    parser.add_argument("--dry-run", action="store_true", help="Apenas lista as campanhas que seriam arquivadas.")
+    parser.add_argument("--vacuum-only", action="store_true", help="Só executa o vacuum incremental.")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="Converte o banco para auto_vacuum=INCREMENTAL (VACUUM completo; pare o worker antes).")
+    args = parser.parse_args()
+
+    database_manager.create_tables()
+    if args.enable_incremental_vacuum:
+        changed = enable_incremental_vacuum()
+        print("Vacuum incremental ativado." if changed else "O banco já usa vacuum incremental (ou houve erro).")
+        return
+
+    size_before = _database_size()
+    if not args.vacuum_only:
+        if args.dry_run:
+            campaigns = [database_manager.get_campaign_details(args.campaign)] if args.campaign \
+                else get_archivable_campaigns(args.older_than_days)
+            for campaign in campaigns:
+                if campaign is not None:
+                    print(f"Seria arquivada: '{campaign['campaign_id']}' ({campaign['status']}) -> {archive_file_for(campaign)}")
+            return
+        if args.campaign:
+            moved = archive_campaign(args.campaign)
+            if moved is None:
+                sys.exit(1)
+            print(f"Campanha '{args.campaign}': {moved} registro(s) arquivado(s).")
+        else:
+            archived = archive_finished_campaigns(args.older_than_days)
+            for campaign_id, archive_file, moved in archived:
+                print(f"Campanha '{campaign_id}': {moved} registro(s) arquivado(s) em {archive_file}.")
+            print(f"{len(archived)} campanha(s) arquivada(s).")
+
+    database_manager.checkpoint_database() # Páginas livres do WAL voltam ao banco antes do vacuum
+    freed = incremental_vacuum()
+    print(f"Vacuum incremental: {freed} página(s) liberada(s). "
+          f"Tamanho do banco: {size_before / 1_048_576:.1f} MB -> {_database_size() / 1_048_576:.1f} MB.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,150 @@
 # Exemplo em um auth_manager.py ou wpp_connector.py
+import base64
+import json
+import threading
+import time
+
 import requests
-from backend.config import WPPCONNECT_SERVER_URL, WPPCONNECT_SESSION_NAME, WPPCONNECT_SECRET_KEY
+from backend.config import (
+    WPPCONNECT_SERVER_URL,
+    WPPCONNECT_SESSION_NAME,
+    WPPCONNECT_SECRET_KEY,
+    JWT_DEFAULT_TTL_SECONDS,
+    JWT_REFRESH_MARGIN_SECONDS,
+    JWT_REFRESH_FAILURE_BACKOFF_SECONDS,
+)
+
+
+def _token_expiry(token, issued_at):
+    """
+    Momento (time.time()) em que o token expira: usa o claim 'exp' se o token for um JWT
+    decodificável; caso contrário (ex: token bcrypt do wppconnect-server) assume JWT_DEFAULT_TTL_SECONDS.
+    """
+    try:
+        payload_segment = token.split('.')[1]
+        payload_segment += '=' * (-len(payload_segment) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload_segment))
+        if isinstance(claims, dict) and isinstance(claims.get('exp'), (int, float)):
+            return float(claims['exp'])
+    except (IndexError, ValueError):
+        pass
+    return issued_at + JWT_DEFAULT_TTL_SECONDS
+
+
+class _SessionTokenState:
+    __slots__ = ("token", "expires_at", "last_failure_at", "lock")
+
+    def __init__(self):
+        self.token = None
+        self.expires_at = 0.0
+        self.last_failure_at = 0.0
+        self.lock = threading.Lock() # Serializa a renovação do token desta sessão
+
+
+class TokenManager:
+    """
+    Ciclo de vida dos tokens JWT, um por sessão WPPConnect.
+
+    - Renova o token antes de expirar (JWT_REFRESH_MARGIN_SECONDS de antecedência).
+    - Renovações são "single-flight": se várias threads precisam de um token novo ao mesmo
+      tempo, apenas uma chama o /generate-token e as demais esperam e usam o resultado.
+    - Um 401 de qualquer chamada invalida o token recusado (handle_unauthorized) e provoca
+      uma única renovação, mesmo que vários envios recebam 401 juntos.
+    - Após uma falha de renovação, novas tentativas esperam JWT_REFRESH_FAILURE_BACKOFF_SECONDS
+      para não inundar o servidor.
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._states_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'refreshes': 0,
+            'proactive_refreshes': 0,
+            'refresh_failures': 0,
+            'unauthorized_responses': 0,
+        }
+
+    def _state(self, session_name):
+        with self._states_lock:
+            state = self._states.get(session_name)
+            if state is None:
+                state = _SessionTokenState()
+                self._states[session_name] = state
+            return state
 
-current_jwt_token = None
+    def _count(self, metric):
+        with self._metrics_lock:
+            self._metrics[metric] += 1
 
-def generate_jwt_token():
-    global current_jwt_token
-    url = f"{WPPCONNECT_SERVER_URL}/api/{WPPCONNECT_SESSION_NAME}/{WPPCONNECT_SECRET_KEY}/generate-token"
+    @staticmethod
+    def _is_fresh(state, now):
+        return state.token is not None and now < state.expires_at - JWT_REFRESH_MARGIN_SECONDS
+
+    def get_token(self, session_name=WPPCONNECT_SESSION_NAME):
+        """Token válido da sessão, renovando-o se estiver ausente ou perto de expirar. None se indisponível."""
+        state = self._state(session_name)
+        if self._is_fresh(state, time.time()):
+            return state.token
+        return self.refresh(session_name, stale_token=state.token)
+
+    def refresh(self, session_name=WPPCONNECT_SESSION_NAME, stale_token=None, force=False):
+        """
+        Renova o token da sessão. Quem chega enquanto outra thread renova espera no lock e,
+        se o token já foi trocado (diferente de `stale_token`), apenas usa o novo.
+        """
+        state = self._state(session_name)
+        with state.lock:
+            now = time.time()
+            if not force and state.token is not None and state.token != stale_token and self._is_fresh(state, now):
+                return state.token # Outra thread já renovou
+            if now - state.last_failure_at < JWT_REFRESH_FAILURE_BACKOFF_SECONDS:
+                return state.token if self._is_fresh(state, now) else None
+            was_proactive = state.token is not None and state.token == stale_token and now < state.expires_at
+
+            token = _request_new_token(session_name)
+            if not token:
+                state.last_failure_at = time.time()
+                self._count('refresh_failures')
+                return state.token if self._is_fresh(state, time.time()) else None
+
+            issued_at = time.time()
+            state.token = token
+            state.expires_at = _token_expiry(token, issued_at)
+            state.last_failure_at = 0.0
+            self._count('refreshes')
+            if was_proactive:
+                self._count('proactive_refreshes')
+            return token
+
+    def handle_unauthorized(self, session_name, rejected_token):
+        """Chamado quando o servidor responde 401: renova (uma vez) o token recusado. Retorna o token novo ou None."""
+        self._count('unauthorized_responses')
+        state = self._state(session_name)
+        with state.lock:
+            if state.token == rejected_token:
+                state.expires_at = 0.0 # Força a renovação, mesmo que o token parecesse válido
+        return self.refresh(session_name, stale_token=rejected_token)
+
+    def metrics(self):
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        now = time.time()
+        with self._states_lock:
+            states = dict(self._states)
+        metrics['sessions'] = {
+            name: {
+                'has_token': state.token is not None,
+                'expires_in_seconds': round(state.expires_at - now) if state.token else None,
+            }
+            for name, state in states.items()
+        }
+        return metrics
+
+
+def _request_new_token(session_name):
+    """Chama o /generate-token do servidor e retorna o token (ou None em caso de erro)."""
+    url = f"{WPPCONNECT_SERVER_URL}/api/{session_name}/{WPPCONNECT_SECRET_KEY}/generate-token"
     try:
         response = requests.post(url, timeout=10)
         response.raise_for_status() # Levanta exceção para erros HTTP
@@ -14,27 +152,26 @@ def generate_jwt_token():
         # Ou pode estar em um header específico. Verifique a resposta real.
         token_data = response.json() # Ajuste isso conforme a resposta real
         if "token" in token_data:
-             current_jwt_token = token_data["token"]
-             print("Token JWT gerado com sucesso.")
-             return True
-        # Se a resposta for diretamente o token como string:
-        # current_jwt_token = response.text 
-        # print("Token JWT gerado com sucesso.")
-        # return True
-        else:
-            print(f"Erro ao gerar token JWT: 'token' não encontrado na resposta - {token_data}")
-            return False
+            print(f"Token JWT gerado com sucesso para a sessão '{session_name}'.")
+            return token_data["token"]
+        print(f"Erro ao gerar token JWT da sessão '{session_name}': 'token' não encontrado na resposta - {token_data}")
+        return None
     except requests.exceptions.RequestException as e:
-        print(f"Falha ao gerar token JWT: {e}")
-        return False
+        print(f"Falha ao gerar token JWT da sessão '{session_name}': {e}")
+        return None
     except ValueError: # Erro ao decodificar JSON
         print(f"Falha ao decodificar JSON da resposta do token: {response.text}")
-        return False
+        return None
+
+
+token_manager = TokenManager()
+
+
+def generate_jwt_token(session_name=WPPCONNECT_SESSION_NAME):
+    """Força a geração de um novo token para a sessão. Retorna True em caso de sucesso."""
+    return token_manager.refresh(session_name, force=True) is not None
 
 
-def get_current_jwt_token():
-    # Poderia adicionar lógica para verificar se o token expirou e gerar um novo se necessário.
-    # Por enquanto, apenas retorna o token atual ou tenta gerar um novo se não existir.
-    if not current_jwt_token:
-        generate_jwt_token()
-    return current_jwt_token
\ No newline at end of file
+def get_current_jwt_token(session_name=WPPCONNECT_SESSION_NAME):
+    """Token atual da sessão, gerado ou renovado automaticamente quando necessário."""
+    return token_manager.get_token(session_name)
@@ -0,0 +1,98 @@
+# benchmark_db.py
+"""
+Compara a latência por operação do database_manager com conexões persistentes (WAL, pragmas
+de config.py) contra o padrão antigo de abrir uma conexão nova a cada chamada.
+
+Usa bancos temporários; o storebot.db não é alterado.
+
+Uso:
+    python -m backend.benchmark_db [--operations 2000]
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from backend import database_manager
+
+
+def legacy_connection():
+    """Padrão anterior: uma conexão nova (journal padrão, synchronous FULL) por chamada."""
+    conn = sqlite3.connect(database_manager.DATABASE_NAME)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def measure(label, operation, count):
+    """Executa `operation(i)` `count` vezes e retorna as latências em microssegundos."""
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        operation(i)
+        latencies.append((time.perf_counter() - started) * 1_000_000)
+    latencies.sort()
+    return {
+        'label': label,
+        'mean': statistics.mean(latencies),
+        'p50': latencies[len(latencies) // 2],
+        'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+
+
+def run_scenario(db_path, operations):
+    """Mede escrita, atualização e leitura típicas do worker/painel no banco `db_path`."""
+    database_manager.DATABASE_NAME = db_path
+    database_manager.create_tables()
+    campaign_id = "bench_campaign"
+    database_manager.add_campaign(campaign_id, "bench.csv", "Olá {{nome}}")
+    log_ids = []
+
+    def add_contact(i):
+        log_ids.append(database_manager.add_dispatch_contact(campaign_id, f"5562{i:08d}", f"Contato {i}"))
+
+    def update_contact(i):
+        database_manager.update_dispatch_log(log_ids[i], "SENT_SUCCESS", "Olá", '{"status": "success"}')
+
+    def read_campaign(i):
+        database_manager.get_campaign_details(campaign_id)
+        database_manager.count_open_dispatches(campaign_id)
+
+    return [
+        measure("add_dispatch_contact", add_contact, operations),
+        measure("update_dispatch_log", update_contact, operations),
+        measure("get_campaign_details + count_open_dispatches", read_campaign, operations),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da camada de conexões do SQLite.")
+    parser.add_argument("--operations", type=int, default=2000, help="Operações medidas por cenário.")
+    args = parser.parse_args()
+
+    original_database_name = database_manager.DATABASE_NAME
+    original_get_db_connection = database_manager.get_db_connection
+    with tempfile.TemporaryDirectory() as temp_dir:
+        try:
+            database_manager.get_db_connection = legacy_connection
+            legacy = run_scenario(os.path.join(temp_dir, "legacy.db"), args.operations)
+        finally:
+            database_manager.get_db_connection = original_get_db_connection
+        try:
+            persistent = run_scenario(os.path.join(temp_dir, "persistent.db"), args.operations)
+        finally:
+            database_manager.close_db_connections()
+            database_manager.DATABASE_NAME = original_database_name
+
+    print(f"\nLatência por operação ({args.operations} operações, microssegundos):")
+    print(f"{'operação':<48}{'conexão por chamada':>24}{'persistente (WAL)':>24}{'ganho':>8}")
+    for old, new in zip(legacy, persistent):
+        print(f"{old['label']:<48}"
+              f"{old['mean']:>10.0f} (p99 {old['p99']:>7.0f})"
+              f"{new['mean']:>10.0f} (p99 {new['p99']:>7.0f})"
+              f"{old['mean'] / new['mean']:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# benchmark_phones.py
+"""
+Mede a vazão (números por segundo) do phone_normalizer em números sintéticos nos formatos
+encontrados nas listas (com máscara, com/sem 55, com 0 + operadora, sem o nono dígito, fixos,
+DDD inválido, lixo), comparando com a limpeza antiga (re.sub por número, sem validação).
+
+Uso:
+    python -m backend.benchmark_phones [--count 1000000] [--batch-size 5000]
+"""
+import argparse
+import random
+import re
+import time
+
+from backend import phone_normalizer
+
+FORMATS = [
+    lambda ddd, number: f"({ddd}) {number[:5]}-{number[5:]}",
+    lambda ddd, number: f"+55 {ddd} {number[:5]} {number[5:]}",
+    lambda ddd, number: f"55{ddd}{number}",
+    lambda ddd, number: f"0{ddd}{number}",
+    lambda ddd, number: f"0 41 {ddd} {number}",
+    lambda ddd, number: f"{ddd} 9{number[2:5]}-{number[5:]}", # Sem o nono dígito
+    lambda ddd, number: f"{ddd} 3{number[2:5]}-{number[5:]}", # Fixo
+    lambda ddd, number: f"20 {number}", # DDD inexistente
+    lambda ddd, number: f"{number[:4]}", # Incompleto
+]
+
+
+def synthetic_phones(count, seed=42):
+    rng = random.Random(seed)
+    ddds = sorted(phone_normalizer.BRAZIL_DDDS)
+    return [
+        rng.choice(FORMATS)(rng.choice(ddds), f"9{rng.randrange(10 ** 8):08d}")
+        for _ in range(count)
+    ]
+
+
+def legacy_clean(phones):
+    """Limpeza anterior do csv_processor: só remove o que não é dígito."""
+    return [re.sub(r'\D', '', phone) for phone in phones]
+
+
+def measure(label, function, phones, batch_size):
+    started = time.perf_counter()
+    results = []
+    for start in range(0, len(phones), batch_size):
+        results.extend(function(phones[start:start + batch_size]))
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40}{elapsed:>8.2f} s{len(phones) / elapsed:>14,.0f} números/s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da normalização de telefones.")
+    parser.add_argument("--count", type=int, default=1_000_000, help="Quantidade de números sintéticos.")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Números por lote (como no csv_processor).")
+    args = parser.parse_args()
+
+    phones = synthetic_phones(args.count)
+    print(f"\n{args.count:,} números sintéticos, lotes de {args.batch_size}:")
+    measure("re.sub (antigo, sem validação)", legacy_clean, phones, args.batch_size)
+    results = measure("phone_normalizer.normalize_phones", phone_normalizer.normalize_phones, phones, args.batch_size)
+
+    notes = {}
+    for _, note in results:
+        notes[note or 'ok'] = notes.get(note or 'ok', 0) + 1
+    print("\nResultado:")
+    for note, count in sorted(notes.items(), key=lambda item: -item[1]):
+        print(f"  {note:<24}{count:>10,}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+# campaign_scheduler.py
+import datetime
+from collections import deque
+
+from backend import database_manager
+from backend.config import (
+    CAMPAIGN_DEFAULT_PRIORITY,
+    CAMPAIGN_MAX_PRIORITY,
+    SCHEDULER_ETA_STEP_SECONDS,
+    SCHEDULER_ETA_HORIZON_HOURS,
+    RATE_INITIAL_SENDS_PER_SECOND,
+    WPPCONNECT_SESSION_NAMES,
+)
+
+
+# --- Janelas de envio ---
+
+def parse_time_of_day(value):
+    """Converte 'HH:MM' em datetime.time. Vazio/None retorna None; formato inválido levanta ValueError."""
+    if value is None or not str(value).strip():
+        return None
+    return datetime.datetime.strptime(str(value).strip(), "%H:%M").time()
+
+
+def normalize_priority(priority):
+    """Prioridade (peso) válida da campanha, entre 1 e CAMPAIGN_MAX_PRIORITY."""
+    try:
+        priority = int(priority)
+    except (TypeError, ValueError):
+        return CAMPAIGN_DEFAULT_PRIORITY
+    return max(1, min(CAMPAIGN_MAX_PRIORITY, priority))
+
+
+def in_send_window(window_start, window_end, moment):
+    """
+    Indica se `moment` está dentro da janela [início, fim) do dia.
+    Sem janela configurada, qualquer horário é permitido; início > fim atravessa a meia-noite (ex: 22:00-06:00).
+    """
+    if window_start is None or window_end is None or window_start == window_end:
+        return True
+    current = moment.time()
+    if window_start < window_end:
+        return window_start <= current < window_end
+    return current >= window_start or current < window_end
+
+
+def next_window_open(window_start, window_end, moment):
+    """Próximo momento (a partir de `moment`) em que a janela de envio está aberta."""
+    if in_send_window(window_start, window_end, moment):
+        return moment
+    opening = datetime.datetime.combine(moment.date(), window_start)
+    if opening <= moment:
+        opening += datetime.timedelta(days=1)
+    return opening
+
+
+# --- Escalonamento justo (stride scheduling) ---
+
+class ScheduledCampaign:
+    """Estado de uma campanha IN_PROGRESS dentro do CampaignScheduler de um worker."""
+
+    __slots__ = ("campaign_id", "message_template", "image_path", "priority", "window_start", "window_end",
+                 "pass_value", "queue", "idle_until", "summary")
+
+    def __init__(self, campaign_row, image_path, pass_value):
+        self.campaign_id = campaign_row['campaign_id']
+        self.queue = deque() # Contatos já reservados (lease) por este worker e ainda não enviados
+        self.idle_until = None # Sem contato disponível antes deste horário (reenvios futuros, reservas de outros)
+        self.pass_value = pass_value
+        self.summary = {'campaign_id': self.campaign_id, 'processed': 0, 'success': 0, 'failed': 0,
+                        'dead_letter': 0, 'retries_scheduled': 0, 'suppressed': 0}
+        self.image_path = image_path
+        self.update(campaign_row)
+
+    def update(self, campaign_row):
+        """Aplica alterações feitas no BD (template, prioridade, janela) com a campanha em andamento."""
+        self.message_template = campaign_row['message_template']
+        self.priority = normalize_priority(campaign_row['priority'])
+        try:
+            self.window_start = parse_time_of_day(campaign_row['send_window_start'])
+            self.window_end = parse_time_of_day(campaign_row['send_window_end'])
+        except ValueError:
+            print(f"Aviso: Janela de envio inválida na campanha '{self.campaign_id}'. Enviando sem restrição de horário.")
+            self.window_start = self.window_end = None
+
+    def in_window(self, moment):
+        return in_send_window(self.window_start, self.window_end, moment)
+
+
+class CampaignScheduler:
+    """
+    Divide o orçamento de envios das sessões entre as campanhas IN_PROGRESS.
+
+    Usa stride scheduling: cada envio "custa" 1/prioridade ao passe da campanha e o próximo
+    envio vai para a campanha elegível de menor passe. Com prioridades 3 e 1, a primeira
+    recebe 3 de cada 4 envios, e uma campanha urgente que entra no meio de outra longa passa a
+    dividir a taxa imediatamente. Campanhas que entram (ou voltam a ter contatos/janela aberta)
+    começam no passe atual, sem "compensar" o tempo em que ficaram fora.
+
+    Campanhas fora da janela de envio (send_window_start/end) ficam paradas até a janela abrir.
+    """
+
+    def __init__(self, resolve_image=None):
+        self.campaigns = {} # campaign_id -> ScheduledCampaign
+        self.virtual_time = 0.0
+        self.resolve_image = resolve_image or (lambda image_filename: None)
+
+    def sync(self, campaign_rows):
+        """
+        Atualiza o conjunto de campanhas a partir das linhas IN_PROGRESS do BD.
+        Retorna as ScheduledCampaign removidas (ex: campanha pausada), para que o chamador
+        devolva os contatos que elas ainda tinham na fila.
+        """
+        current_ids = set()
+        for campaign_row in campaign_rows:
+            campaign_id = campaign_row['campaign_id']
+            current_ids.add(campaign_id)
+            if campaign_id in self.campaigns:
+                self.campaigns[campaign_id].update(campaign_row)
+            else:
+                image_path = self.resolve_image(campaign_row['image_filename']) if campaign_row['image_filename'] else None
+                self.campaigns[campaign_id] = ScheduledCampaign(campaign_row, image_path, self.virtual_time)
+        removed = [campaign for campaign_id, campaign in self.campaigns.items() if campaign_id not in current_ids]
+        for campaign in removed:
+            del self.campaigns[campaign.campaign_id]
+        return removed
+
+    def eligible(self, now=None):
+        now = now or datetime.datetime.now()
+        return [
+            campaign for campaign in self.campaigns.values()
+            if campaign.in_window(now) and (campaign.queue or campaign.idle_until is None or campaign.idle_until <= now)
+        ]
+
+    def pick(self, now=None):
+        """Campanha que deve receber o próximo envio (menor passe; empate favorece a maior prioridade), ou None."""
+        candidates = self.eligible(now)
+        if not candidates:
+            return None
+        for campaign in candidates:
+            if campaign.pass_value < self.virtual_time: # Voltou a ficar elegível: não acumula crédito
+                campaign.pass_value = self.virtual_time
+        return min(candidates, key=lambda campaign: (campaign.pass_value, -campaign.priority))
+
+    def charge(self, campaign):
+        """Contabiliza um envio para a campanha escolhida por pick()."""
+        self.virtual_time = max(self.virtual_time, campaign.pass_value)
+        campaign.pass_value += 1.0 / campaign.priority
+
+    def mark_idle(self, campaign, until):
+        """A campanha não tem contato disponível para este worker antes de `until`."""
+        campaign.idle_until = until
+        campaign.pass_value = max(campaign.pass_value, self.virtual_time)
+
+    def outside_window(self, now=None):
+        """Campanhas com contatos na fila cuja janela de envio fechou."""
+        now = now or datetime.datetime.now()
+        return [campaign for campaign in self.campaigns.values() if campaign.queue and not campaign.in_window(now)]
+
+    def next_wakeup(self, now=None):
+        """Próximo horário em que alguma campanha parada volta a ser elegível (ou None)."""
+        now = now or datetime.datetime.now()
+        moments = []
+        for campaign in self.campaigns.values():
+            available_at = campaign.idle_until or now
+            moments.append(next_window_open(campaign.window_start, campaign.window_end, max(available_at, now)))
+        return min(moments) if moments else None
+
+
+# --- Estimativas de início e término ---
+
+def estimate_schedule(campaigns, open_counts, sends_per_second, now=None,
+                      step_seconds=SCHEDULER_ETA_STEP_SECONDS, horizon_hours=SCHEDULER_ETA_HORIZON_HOURS):
+    """
+    Simula a divisão justa do orçamento `sends_per_second` entre as campanhas (por prioridade
+    e respeitando as janelas de envio) e estima quando cada uma começa e termina.
+
+    `campaigns` são linhas/dicts com campaign_id, priority, send_window_start e send_window_end;
+    `open_counts` mapeia campaign_id -> contatos ainda em aberto.
+    Retorna {campaign_id: {'open', 'priority', 'in_window', 'start_at', 'finish_at'}}; start_at/finish_at
+    ficam None se passarem do horizonte da simulação.
+    """
+    now = now or datetime.datetime.now()
+    plans = {}
+    for campaign in campaigns:
+        try:
+            window = (parse_time_of_day(campaign['send_window_start']), parse_time_of_day(campaign['send_window_end']))
+        except ValueError:
+            window = (None, None)
+        plans[campaign['campaign_id']] = {
+            'priority': normalize_priority(campaign['priority']),
+            'window': window,
+            'remaining': float(open_counts.get(campaign['campaign_id'], 0)),
+            'open': open_counts.get(campaign['campaign_id'], 0),
+            'in_window': in_send_window(window[0], window[1], now),
+            'start_at': None,
+            'finish_at': None,
+        }
+    for plan in plans.values():
+        if plan['remaining'] <= 0:
+            plan['start_at'] = plan['finish_at'] = now
+
+    step = datetime.timedelta(seconds=step_seconds)
+    moment = now
+    deadline = now + datetime.timedelta(hours=horizon_hours)
+    while sends_per_second > 0 and moment < deadline:
+        active = [plan for plan in plans.values()
+                  if plan['remaining'] > 0 and in_send_window(plan['window'][0], plan['window'][1], moment)]
+        if not any(plan['remaining'] > 0 for plan in plans.values()):
+            break
+        for plan in active:
+            if plan['start_at'] is None:
+                plan['start_at'] = moment
+        capacity = sends_per_second * step_seconds
+        # Divisão proporcional às prioridades; a sobra de quem termina no passo vai para as demais
+        while capacity > 1e-9 and active:
+            total_weight = sum(plan['priority'] for plan in active)
+            finishing = [plan for plan in active if plan['remaining'] <= capacity * plan['priority'] / total_weight]
+            if not finishing:
+                for plan in active:
+                    plan['remaining'] -= capacity * plan['priority'] / total_weight
+                break
+            for plan in finishing:
+                capacity -= plan['remaining']
+                seconds_used = step_seconds * (1 - capacity / (sends_per_second * step_seconds))
+                plan['remaining'] = 0
+                plan['finish_at'] = moment + datetime.timedelta(seconds=seconds_used)
+                active.remove(plan)
+        moment += step
+
+    return {
+        campaign_id: {key: plan[key] for key in ('open', 'priority', 'in_window', 'start_at', 'finish_at')}
+        for campaign_id, plan in plans.items()
+    }
+
+
+def current_send_budget(now=None):
+    """
+    Envios por segundo disponíveis para as campanhas: soma das taxas do controle adaptativo das
+    sessões conectadas, publicadas pelos workers em session_rates (sem o aquecimento, que só dura
+    alguns minutos), ou a taxa inicial das sessões se nenhum worker publicou recentemente.
+    """
+    session_rates = database_manager.get_session_rates(now=now)
+    budget = sum(session_rate['rate'] for session_rate in session_rates if session_rate['connected'])
+    if budget > 0:
+        return budget
+    return RATE_INITIAL_SENDS_PER_SECOND * len(WPPCONNECT_SESSION_NAMES)
+
+
+def get_schedule_estimates(now=None):
+    """Estimativas de início/término das campanhas IN_PROGRESS, com o orçamento atual de envios."""
+    now = now or datetime.datetime.now()
+    campaigns = database_manager.get_campaigns_with_status(['IN_PROGRESS'])
+    open_counts = {c['campaign_id']: database_manager.count_open_dispatches(c['campaign_id']) for c in campaigns}
+    return estimate_schedule(campaigns, open_counts, current_send_budget(now), now)
@@ -1,4 +1,6 @@
 # config.py
+import os
+
 WPPCONNECT_SERVER_URL = "http://localhost:21465"  # URL base do seu wppconnect-server
 WPPCONNECT_SESSION_NAME = "Principal"         # Nome da sessão que você configurou no servidor
 WPPCONNECT_SECRET_KEY = "zz91j6i" # Se o seu servidor usa uma chave de API/Token
@@ -10,6 +12,110 @@ WPPCONNECT_API_ENDPOINT_SEND_IMAGE = f"/api/{WPPCONNECT_SESSION_NAME}/send-image
 WPPCONNECT_API_ENDPOINT_SEND_TEXT = f"/api/{WPPCONNECT_SESSION_NAME}/send-message"
 # Configurações do Banco de Dados
 DATABASE_NAME = "storebot.db"
+# Conexões persistentes (uma por thread) em backend/database_manager.py
+DB_AUTO_VACUUM = "INCREMENTAL" # Bancos novos; bancos antigos passam a usar com python -m backend.archive_manager --enable-incremental-vacuum
+DB_JOURNAL_MODE = "WAL" # Leitores (painel web) não bloqueiam o escritor (worker de disparos) e vice-versa
+DB_SYNCHRONOUS = "NORMAL" # Com WAL, é seguro contra corrupção; só os últimos commits podem se perder em queda de energia
+DB_CACHE_SIZE_KIB = 16 * 1024 # Cache de páginas por conexão
+DB_BUSY_TIMEOUT_MS = 10 * 1000 # Espera pelo lock de escrita de outro processo antes de "database is locked"
+DB_CACHED_STATEMENTS = 256 # Consultas preparadas reaproveitadas por conexão
 
 # Outras configurações
-DEFAULT_MESSAGE_DELAY_SECONDS = 5 # Delay entre mensagens
\ No newline at end of file
+DEFAULT_MESSAGE_DELAY_SECONDS = 5 # Delay entre mensagens
+
+# Motor de disparo (backend/dispatch_engine.py)
+DISPATCH_CONCURRENCY = 4 # Quantidade de envios simultâneos em andamento por sessão
+DISPATCH_CLAIM_BATCH_SIZE = 50 # Contatos reservados (lease) por vez no dispatch_log
+DISPATCH_LEASE_SECONDS = 5 * 60 # Validade da reserva; expirada (ex: processo caiu), outro worker pode assumir os contatos
+DISPATCH_ENQUEUE_CHUNK_SIZE = 1000 # Contatos por executemany ao enfileirar uma campanha (tudo em uma única transação)
+DISPATCH_PAGE_SIZE = 500 # Contatos por página em database_manager.iter_pending_dispatches (paginação keyset)
+DISPATCH_LOG_PAGE_SIZE = 50 # Registros por página nos detalhes da campanha (web)
+DISPATCH_LOG_MAX_PAGE_SIZE = 500 # Limite do parâmetro 'limit' da API de detalhes
+DISPATCH_STATUS_FLUSH_BATCH_SIZE = 100 # Resultados de envio gravados por transação (backend/dispatch_status_writer.py)
+DISPATCH_STATUS_FLUSH_INTERVAL_SECONDS = 0.5 # Espera máxima de um resultado antes de ser gravado
+DISPATCH_STATUS_FLUSH_MAX_ATTEMPTS = 5 # Tentativas de gravar um lote (ex: banco bloqueado) antes de desistir
+DISPATCH_API_RESPONSE_STORAGE = "failures" # Resposta completa do wppconnect no dispatch_log: "compressed" (todas), "failures" (só falhas) ou "none" (ver backend/dispatch_log_format.py)
+DISPATCH_API_RESPONSE_COMPRESSION_LEVEL = 6 # zlib (1 = mais rápido, 9 = menor)
+
+# Controle adaptativo da taxa de envios de cada sessão (backend/rate_controller.py)
+RATE_INITIAL_SENDS_PER_SECOND = 1 / DEFAULT_MESSAGE_DELAY_SECONDS # Taxa inicial (equivale ao delay acima)
+RATE_MIN_SENDS_PER_SECOND = 1 / 20 # Nunca menos que 1 envio a cada 20s
+RATE_MAX_SENDS_PER_SECOND = 1.0 # Teto de segurança por número de WhatsApp
+RATE_BURST = 1 # Envios que podem sair em rajada após um período ocioso
+RATE_ADDITIVE_INCREASE = 0.002 # Envios/s somados a cada segundo de envios saudáveis
+RATE_MULTIPLICATIVE_DECREASE = 0.5 # Fator aplicado à taxa em caso de erro/lentidão
+RATE_LATENCY_TARGET_SECONDS = 8 # Envios mais lentos que isso contam como sobrecarga
+RATE_DECREASE_COOLDOWN_SECONDS = 15 # Intervalo mínimo entre duas reduções
+RATE_WARMUP_SECONDS = 15 * 60 # Rampa de aquecimento de números recém-conectados
+RATE_JITTER_FRACTION = 0.3 # Atraso aleatório de até 30% do intervalo entre envios
+
+# Agendador de campanhas simultâneas (backend/campaign_scheduler.py)
+CAMPAIGN_DEFAULT_PRIORITY = 1 # Peso da campanha na divisão dos envios (prioridade 3 recebe 3x mais envios que 1)
+CAMPAIGN_MAX_PRIORITY = 10
+SCHEDULER_ETA_STEP_SECONDS = 60 # Resolução da simulação de início/término das campanhas
+SCHEDULER_ETA_HORIZON_HOURS = 7 * 24 # Além disso, a estimativa fica em aberto
+
+# Reenvio de falhas transitórias (backend/retry_policy.py)
+RETRY_MAX_ATTEMPTS = 3 # Reenvios antes de mover o contato para DEAD_LETTER
+RETRY_BASE_DELAY_SECONDS = 60 # Espera antes do 1º reenvio; dobra a cada nova falha
+RETRY_MAX_DELAY_SECONDS = 30 * 60
+RETRY_POLL_SECONDS = 5 # Frequência com que o motor procura reenvios vencidos
+
+# Pool de sessões (números de WhatsApp) que dividem os disparos de uma campanha.
+# Cada sessão precisa estar criada e conectada no wppconnect-server.
+WPPCONNECT_SESSION_NAMES = [WPPCONNECT_SESSION_NAME]
+
+# Worker de disparos separado do servidor web (backend/dispatch_worker.py)
+DISPATCH_WORKER_PROCESSES = len(WPPCONNECT_SESSION_NAMES) # Cada processo cuida de um subconjunto das sessões
+DISPATCH_WORKER_POLL_SECONDS = 5 # Intervalo entre as buscas por campanhas IN_PROGRESS
+WORKER_STATS_PUBLISH_SECONDS = 5 # Frequência com que cada worker grava no BD a taxa das suas sessões (lida pela interface web)
+WORKER_STATS_MAX_AGE_SECONDS = 60 # Sessões sem atualização há mais tempo (worker parado) deixam de aparecer na interface
+# Pasta onde a interface web salva as imagens das campanhas (lida também pelo worker)
+CAMPAIGN_IMAGES_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "frontend", "uploaded_campaign_images")
+WEB_PROGRESS_POLL_SECONDS = 2 # Intervalo com que a interface web lê o progresso das campanhas no BD
+
+# Cliente HTTP persistente (backend/wpp_connector.py)
+WPPCONNECT_HTTP_POOL_CONNECTIONS = 2 # Pools por host (normalmente só o wppconnect-server)
+WPPCONNECT_HTTP_POOL_MAXSIZE = DISPATCH_CONCURRENCY * len(WPPCONNECT_SESSION_NAMES) # Conexões keep-alive mantidas abertas
+WPPCONNECT_CONNECT_TIMEOUT = 5 # Segundos para estabelecer a conexão TCP
+WPPCONNECT_ENDPOINT_TIMEOUTS = { # Segundos de leitura por endpoint
+    "send-message": 30,
+    "send-image": 60,
+    "status-session": 15,
+}
+WPPCONNECT_DEFAULT_READ_TIMEOUT = 30
+
+# Cache das imagens de campanha já codificadas em base64 (backend/wpp_connector.py)
+MEDIA_CACHE_MAX_ENTRIES = 8
+MEDIA_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Ciclo de vida dos tokens JWT (backend/auth_manager.py)
+JWT_DEFAULT_TTL_SECONDS = 6 * 60 * 60 # Validade assumida quando o token não traz o claim 'exp'
+JWT_REFRESH_MARGIN_SECONDS = 5 * 60 # Renova o token esta quantidade de segundos antes de expirar
+JWT_REFRESH_FAILURE_BACKOFF_SECONDS = 5 # Espera mínima entre tentativas de renovação que falharam
+
+# Arquivamento de campanhas finalizadas (backend/archive_manager.py)
+ARCHIVE_FOLDER = "storebot_archive" # Pasta ao lado do DATABASE_NAME; um banco por mês (storebot_archive_AAAA_MM.db)
+ARCHIVE_CAMPAIGN_STATUSES = ("COMPLETED", "COMPLETED_WITH_ERRORS", "FAILED")
+ARCHIVE_AFTER_DAYS = 30 # Arquiva campanhas finalizadas sem envios há mais tempo que isso
+ARCHIVE_BATCH_SIZE = 2000 # Registros movidos por transação (transações curtas não travam o worker)
+ARCHIVE_COMPRESSION_LEVEL = 6 # zlib (1 = mais rápido, 9 = menor)
+ARCHIVE_VACUUM_PAGES_PER_STEP = 1000 # Páginas liberadas por passo de incremental_vacuum
+
+# Leitura de listas CSV (backend/csv_processor.py)
+CSV_INGEST_BATCH_SIZE = 5000 # Linhas normalizadas/validadas por lote
+CSV_PROGRESS_EVERY_ROWS = 50000 # Intervalo (linhas lidas) entre os avisos de progresso
+CSV_WARNING_SAMPLE_SIZE = 10 # Linhas problemáticas guardadas como exemplo no resumo da leitura
+
+# Normalização de telefones (backend/phone_normalizer.py)
+PHONE_DEFAULT_COUNTRY_CODE = "55" # Código do país para números sem '+'/00
+PHONE_ADD_MISSING_NINTH_DIGIT = True # Completa celulares antigos de 8 dígitos com o 9 (False = rejeita)
+PHONE_ACCEPT_LANDLINES = False # Números fixos raramente têm WhatsApp; rejeitados para não gastar envios
+
+# Deduplicação de contatos ao enfileirar (backend/contact_deduplicator.py)
+DEDUP_MEMORY_MAX_CONTACTS = 500000 # Até aqui os telefones já vistos ficam em um set na memória (~35 MB)
+DEDUP_BLOOM_CAPACITY = 10000000 # Acima disso: filtro de Bloom dimensionado para esta quantidade (~18 MB) + consulta ao banco
+DEDUP_BLOOM_ERROR_RATE = 0.001 # Falsos positivos do filtro (cada um custa só uma consulta ao índice)
+
+# Lista de supressão (opt-out) - backend/suppression_index.py
+SUPPRESSION_REFRESH_SECONDS = 5 # Intervalo máximo para uma inclusão na lista chegar aos workers (releitura incremental)
+SUPPRESSION_CHANGES_PAGE_SIZE = 10000 # Alterações lidas por consulta ao atualizar o índice
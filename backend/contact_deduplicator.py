@@ -0,0 +1,110 @@
+# contact_deduplicator.py
+"""
+Remoção de telefones repetidos ao enfileirar contatos (database_manager.add_dispatch_contacts_bulk).
+
+Até DEDUP_MEMORY_MAX_CONTACTS números, os já vistos ficam em um set de inteiros (~70 bytes por número).
+Acima disso, o set é trocado por um filtro de Bloom de tamanho fixo (DEDUP_BLOOM_CAPACITY números com
+DEDUP_BLOOM_ERROR_RATE de falso positivo, ~18 MB com os valores padrão) e cada "talvez já visto" do
+filtro é confirmado no banco (`db_check`), onde os contatos anteriores já foram gravados. Assim a memória
+fica limitada para listas de qualquer tamanho e nenhum contato único é descartado por engano.
+Sem `db_check` (ex: só contar os contatos únicos de um arquivo no upload) o filtro é usado sozinho
+acima do limite, e a contagem passa a ser aproximada (cerca de DEDUP_BLOOM_ERROR_RATE dos únicos
+contados como repetidos).
+"""
+import hashlib
+import math
+
+from backend.config import (
+    DEDUP_MEMORY_MAX_CONTACTS,
+    DEDUP_BLOOM_CAPACITY,
+    DEDUP_BLOOM_ERROR_RATE,
+)
+
+
+class BloomFilter:
+    """Filtro de Bloom em um bytearray, com k posições por item derivadas de um único blake2b (hash duplo)."""
+    __slots__ = ('size', 'hash_count', 'bits')
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, key):
+        """Adiciona `key` (str). Retorna True se ele talvez já estivesse no filtro (todas as posições marcadas)."""
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        bits, size = self.bits, self.size
+        present = True
+        for i in range(self.hash_count):
+            position = (first + i * second) % size
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                present = False
+                bits[position >> 3] |= mask
+        return present
+
+
+class ContactDeduplicator:
+    """
+    Diz se um telefone (já normalizado) é repetido. Com `db_check(telefone)`, que deve retornar True se o
+    telefone já foi gravado, quem usa chama mark_flushed() depois de gravar cada lote de aceitos.
+    """
+    __slots__ = ('db_check', 'memory_limit', 'bloom_capacity', 'error_rate', 'duplicates', '_seen', '_bloom', '_pending')
+
+    def __init__(self, db_check=None, memory_limit=DEDUP_MEMORY_MAX_CONTACTS, bloom_capacity=DEDUP_BLOOM_CAPACITY,
+                 error_rate=DEDUP_BLOOM_ERROR_RATE):
+        self.db_check = db_check
+        self.memory_limit = memory_limit
+        self.bloom_capacity = bloom_capacity
+        self.error_rate = error_rate
+        self.duplicates = 0
+        self._seen = set()
+        self._bloom = None # Criado quando o set passa de memory_limit
+        self._pending = set() # Aceitos desde o último mark_flushed, que o db_check ainda não encontra
+
+    @property
+    def uses_bloom_filter(self):
+        return self._bloom is not None
+
+    def preload(self, phone):
+        """Registra um telefone que já está gravado (ex: contatos que a campanha já tinha), sem contar repetição."""
+        if self._bloom is None:
+            self._seen.add(int(phone) if phone.isdigit() and phone[0] != "0" else phone)
+            if len(self._seen) > self.memory_limit:
+                self._switch_to_bloom_filter()
+        else:
+            self._bloom.add(phone)
+
+    def add(self, phone):
+        """Registra `phone`. Retorna True se ele é novo e False se é repetido (contado em `duplicates`)."""
+        if self._bloom is None:
+            key = int(phone) if phone.isdigit() and phone[0] != "0" else phone # Inteiro ocupa menos memória
+            if key in self._seen:
+                self.duplicates += 1
+                return False
+            self._seen.add(key)
+            if self.db_check is not None:
+                self._pending.add(phone)
+            if len(self._seen) > self.memory_limit:
+                self._switch_to_bloom_filter()
+            return True
+        if self._bloom.add(phone) and (self.db_check is None or phone in self._pending or self.db_check(phone)):
+            self.duplicates += 1
+            return False
+        if self.db_check is not None:
+            self._pending.add(phone)
+        return True
+
+    def mark_flushed(self):
+        """Os telefones aceitos até aqui já foram gravados (o db_check passa a encontrá-los)."""
+        self._pending.clear()
+
+    def _switch_to_bloom_filter(self):
+        print(f"Deduplicação: mais de {self.memory_limit:,} contatos; usando filtro de Bloom"
+              + (" + consulta ao banco." if self.db_check is not None else " (contagem aproximada)."))
+        self._bloom = BloomFilter(max(self.bloom_capacity, len(self._seen) * 2), self.error_rate)
+        for key in self._seen:
+            self._bloom.add(str(key))
+        self._seen = set()
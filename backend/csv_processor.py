@@ -1,86 +1,266 @@
 # csv_processor.py
 import csv
-import re # Para limpeza de números de telefone
+import hashlib
+import itertools
+from backend import phone_normalizer
+from backend.config import (
+    CSV_INGEST_BATCH_SIZE,
+    CSV_PROGRESS_EVERY_ROWS,
+    CSV_WARNING_SAMPLE_SIZE,
+)
+
+CSV_DELIMITERS = [',', ';'] # Ordem de preferência na detecção do delimitador
+CONTENT_HASH_CHUNK_BYTES = 1024 * 1024
 
 def clean_phone_number(phone_str):
-    """Remove caracteres não numéricos de um número de telefone."""
+    """Remove caracteres não numéricos de um número de telefone (sem validar; veja phone_normalizer)."""
     if not phone_str:
         return None
-    return re.sub(r'\D', '', phone_str)
+    return phone_normalizer.phone_digits(phone_str)
+
+def file_content_hash(filepath):
+    """SHA-256 (hex) do conteúdo do arquivo, lido em blocos. Identifica um CSV já importado (contact_lists)."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as source:
+        for block in iter(lambda: source.read(CONTENT_HASH_CHUNK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-def load_contacts_from_csv(filepath):
+def contact_row_hash(phone_val, name_val):
     """
-    Carrega contatos de um arquivo CSV com colunas 'telefone' e 'nome'.
-    Tenta detectar automaticamente se o delimitador é ',' ou ';'.
-    Retorna uma lista de dicionários.
+    Hash de uma linha de contato (telefone e nome como estão no arquivo, sem espaços nas pontas) como
+    inteiro de 64 bits com sinal, que cabe em um INTEGER do SQLite (contacts.row_hash). Calculado antes
+    da normalização, para que as linhas que não mudaram entre duas versões da mesma lista nem passem
+    pelo phone_normalizer.
+    """
+    digest = hashlib.blake2b(f"{phone_val.strip()}\x1f{name_val.strip()}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+class IngestReport:
+    """
+    Resumo da leitura de um CSV de contatos: contagens de linhas lidas, aceitas e rejeitadas (por
+    motivo), avisos agregados e uma amostra limitada das linhas problemáticas. Substitui o print por
+    linha, que deixava lenta a leitura de listas grandes e sujas.
+    """
+    __slots__ = ('filepath', 'delimiter', 'rows_read', 'accepted', 'duplicates', 'unchanged', 'rejected', 'warnings',
+                 'samples', 'sample_size', 'error')
+
+    def __init__(self, filepath=None, sample_size=CSV_WARNING_SAMPLE_SIZE):
+        self.filepath = filepath
+        self.delimiter = None
+        self.rows_read = 0
+        self.accepted = 0
+        self.duplicates = 0 # Telefones repetidos descartados (só com deduplicator)
+        self.unchanged = 0 # Linhas iguais às já gravadas na lista, puladas (só com known_row_hashes)
+        self.rejected = {} # motivo -> quantidade
+        self.warnings = {} # aviso -> quantidade (a linha é aceita)
+        self.samples = {} # motivo -> [(linha, conteúdo)], no máximo sample_size por motivo
+        self.sample_size = sample_size
+        self.error = None # Erro que impediu a leitura do arquivo (não encontrado, sem cabeçalho...)
+
+    def reject(self, line_number, reason, content=None):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        self._sample(line_number, reason, content)
+
+    def warn(self, line_number, reason, content=None):
+        self.warnings[reason] = self.warnings.get(reason, 0) + 1
+        self._sample(line_number, reason, content)
+
+    def _sample(self, line_number, reason, content):
+        samples = self.samples.setdefault(reason, [])
+        if len(samples) < self.sample_size:
+            samples.append((line_number, content))
+
+    @property
+    def rejected_total(self):
+        return sum(self.rejected.values())
+
+    def summary(self):
+        """Resumo em texto (várias linhas) para o console/log."""
+        if self.error:
+            return f"Erro: {self.error}"
+        lines = [f"CSV '{self.filepath}': {self.rows_read} linha(s) lida(s), {self.accepted} contato(s) aceito(s), "
+                 f"{self.rejected_total} rejeitado(s)." + (f" {self.unchanged} sem alteração." if self.unchanged else "")]
+        for label, counts in (("Rejeitados", self.rejected), ("Avisos", self.warnings)):
+            for reason, count in sorted(counts.items()):
+                lines.append(f"  {label} ({reason}): {count}. Ex: " +
+                             "; ".join(f"linha {line_number}: {content}" for line_number, content in self.samples.get(reason, [])))
+        return "\n".join(lines)
+
+def _open_contacts_reader(csvfile, filepath, report, required_columns=('telefone', 'nome')):
+    """
+    Detecta o delimitador pelo cabeçalho (sem ler o resto do arquivo) e retorna um csv.reader
+    posicionado na primeira linha de dados e os índices das colunas (telefone, nome), ou None.
+    O índice de 'nome' é None se a coluna não existir e não estiver em `required_columns`.
+    """
+    header_line = csvfile.readline()
+    for delimiter_char in CSV_DELIMITERS:
+        header = [column.strip() for column in next(csv.reader([header_line], delimiter=delimiter_char), [])]
+        if all(column in header for column in required_columns):
+            report.delimiter = delimiter_char
+            print(f"Info: Lendo CSV '{filepath}' com delimitador: '{delimiter_char}'")
+            name_index = header.index('nome') if 'nome' in header else None
+            return csv.reader(csvfile, delimiter=delimiter_char), header.index('telefone'), name_index
+    columns_text = " e ".join(f"'{column}'" for column in required_columns)
+    report.error = (f"As colunas {columns_text} não foram encontradas no arquivo CSV '{filepath}' "
+                    f"utilizando os delimitadores {CSV_DELIMITERS}.")
+    print(f"Erro: {report.error}")
+    print("Verifique se o arquivo CSV usa um desses delimitadores e se os nomes das colunas estão corretos no cabeçalho.")
+    return None
+
+def _read_rows(reader, phone_index, name_index, report):
+    """Estágio 1: linhas do arquivo -> (linha, telefone bruto, nome bruto). Linhas malformadas são contadas e puladas."""
+    required_columns = max(phone_index, name_index) + 1
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            report.rows_read += 1
+            report.reject(reader.line_num + 1, 'linha_malformada', str(e))
+            continue
+        line_number = reader.line_num + 1 # +1 pelo cabeçalho, lido antes do reader
+        if not row: # Linha em branco
+            continue
+        report.rows_read += 1
+        if len(row) < required_columns:
+            report.reject(line_number, 'colunas_ausentes', row)
+            continue
+        yield line_number, row[phone_index], row[name_index]
+
+def normalize_contacts_batch(batch, report, row_hashes=None):
+    """
+    Estágio 2: normaliza e valida um lote de (linha, telefone, nome). Os telefones do lote passam
+    juntos pelo phone_normalizer (E.164, DDD, nono dígito). Retorna os contatos aceitos no formato do
+    database_manager ({'telefone', 'nome'}) e registra rejeições/avisos no `report`. Com `row_hashes`
+    (um por linha do lote), cada contato leva também o seu em 'row_hash'.
     """
     contacts = []
-    delimiters_to_try = [',', ';'] # Ordem de preferência para tentativa
+    normalized_phones = phone_normalizer.normalize_phones([phone_val for _, phone_val, _ in batch])
+    for index, ((line_number, phone_val, name_val), (phone, note)) in enumerate(zip(batch, normalized_phones)):
+        if not phone:
+            report.reject(line_number, note, phone_val)
+            continue
+        if note: # Número corrigido (ex: nono dígito adicionado)
+            report.warn(line_number, note, phone_val)
+        name = name_val.strip() # Remove espaços extras do nome
+        if not name:
+            report.warn(line_number, 'sem_nome', phone)
+        contact = {'telefone': phone, 'nome': name}
+        if row_hashes is not None:
+            contact['row_hash'] = row_hashes[index]
+        contacts.append(contact)
+    return contacts
+
+def iter_contacts_from_csv(filepath, report=None, batch_size=CSV_INGEST_BATCH_SIZE, progress=None,
+                           progress_every=CSV_PROGRESS_EVERY_ROWS, deduplicator=None, with_row_hashes=False,
+                           known_row_hashes=None):
+    """
+    Lê um CSV de contatos (colunas 'telefone' e 'nome', delimitador ',' ou ';') como um gerador:
+    as linhas passam pela normalização em lotes de `batch_size` e saem uma a uma, sem carregar o
+    arquivo na memória. Use com database_manager.add_dispatch_contacts_bulk para enfileirar uma
+    lista de qualquer tamanho com memória constante.
+
+    Rejeições e avisos vão para `report` (IngestReport). `progress(report)` é chamado a cada
+    `progress_every` linhas lidas. Se o arquivo não puder ser lido, nada é gerado e report.error é preenchido.
+    Com `deduplicator` (contact_deduplicator.ContactDeduplicator), telefones repetidos (já normalizados)
+    são descartados e contados em report.duplicates.
 
+    Com `with_row_hashes`, cada contato leva o contact_row_hash da sua linha em 'row_hash'. Com
+    `known_row_hashes` (dict row_hash -> contact_id da versão gravada da lista, ex:
+    database_manager.get_contact_row_hashes), as linhas cujo hash já está no dict não são normalizadas
+    nem geradas: o valor vira None (linha encontrada) e elas contam em report.unchanged. Assim só as
+    linhas novas ou alteradas saem do gerador (veja database_manager.reimport_contact_list).
+    """
+    report = report if report is not None else IngestReport(filepath)
+    report.filepath = report.filepath or filepath
+    next_progress = progress_every
     try:
-        with open(filepath, mode='r', encoding='utf-8', newline='') as csvfile:
-            # newline='' é importante para lidar corretamente com diferentes finais de linha
-            
-            reader = None
-            used_delimiter = None
-
-            for delimiter_char in delimiters_to_try:
-                csvfile.seek(0) # Retorna ao início do arquivo para cada tentativa de delimitador
-                try:
-                    # Tenta criar um DictReader e verifica se as colunas esperadas estão presentes
-                    # O DictReader usa a primeira linha como cabeçalho por padrão.
-                    temp_reader_check = csv.DictReader(csvfile, delimiter=delimiter_char)
-                    
-                    # Verifica se as colunas obrigatórias existem nos fieldnames
-                    if 'telefone' in temp_reader_check.fieldnames and 'nome' in temp_reader_check.fieldnames:
-                        # Delimitador correto encontrado, configurar o reader final
-                        csvfile.seek(0) # Retorna ao início para o reader definitivo
-                        reader = csv.DictReader(csvfile, delimiter=delimiter_char)
-                        used_delimiter = delimiter_char
-                        print(f"Info: Lendo CSV '{filepath}' com delimitador: '{used_delimiter}'")
-                        break # Sai do loop de tentativas de delimitador
-                except Exception:
-                    # Se houver erro ao tentar com este delimitador (ex: formato inconsistente para ele),
-                    # simplesmente continua para o próximo delimitador na lista.
-                    continue 
-            
-            if not reader:
-                print(f"Erro: As colunas 'telefone' e 'nome' não foram encontradas no arquivo CSV '{filepath}' utilizando os delimitadores {delimiters_to_try}.")
-                print("Verifique se o arquivo CSV usa um desses delimitadores e se os nomes das colunas estão corretos no cabeçalho.")
-                return []
-
-            for i, row in enumerate(reader):
-                line_number = i + 1 + 1 # +1 para index 0, +1 para pular cabeçalho
-                
-                # É uma boa prática verificar se as chaves existem na linha,
-                # pois arquivos CSV podem ter linhas inconsistentes.
-                phone_val = row.get('telefone')
-                name_val = row.get('nome')
-
-                if phone_val is None or name_val is None:
-                    print(f"Aviso: Linha {line_number} no CSV (conteúdo: {row}) não contém as chaves 'telefone' ou 'nome' esperadas. Ignorando.")
-                    continue
-
-                phone = clean_phone_number(phone_val)
-                name = name_val.strip() # Remove espaços extras do nome
-
-                if phone: # Telefone é obrigatório
-                    contacts.append({'telefone': phone, 'nome': name if name else ''})
-                    if not name:
-                         print(f"Aviso: Contato na linha {line_number} (telefone: {phone}) não possui nome.")
-                else:
-                    print(f"Aviso: Linha {line_number} (conteúdo: {row}) ignorada por falta de número de telefone válido após limpeza.")
-            
-            if not contacts:
-                print(f"Aviso: Nenhum contato válido foi carregado do arquivo '{filepath}' após o processamento.")
-            return contacts
+        # utf-8-sig ignora o BOM de CSVs exportados pelo Excel; bytes inválidos viram '\ufffd' em vez de abortar a leitura
+        with open(filepath, mode='r', encoding='utf-8-sig', errors='replace', newline='') as csvfile:
+            opened = _open_contacts_reader(csvfile, filepath, report)
+            if opened is None:
+                return
+            rows = _read_rows(*opened, report)
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                row_hashes = None
+                if with_row_hashes or known_row_hashes is not None:
+                    row_hashes = [contact_row_hash(phone_val, name_val) for _, phone_val, name_val in batch]
+                if known_row_hashes is not None:
+                    changed = []
+                    for index, row_hash in enumerate(row_hashes):
+                        if row_hash in known_row_hashes:
+                            known_row_hashes[row_hash] = None # Linha igual à gravada: nada a fazer
+                        else:
+                            changed.append(index)
+                    report.unchanged += len(batch) - len(changed)
+                    batch = [batch[index] for index in changed]
+                    row_hashes = [row_hashes[index] for index in changed]
+                contacts = normalize_contacts_batch(batch, report, row_hashes)
+                if deduplicator is not None:
+                    unique_contacts = [contact for contact in contacts if deduplicator.add(contact['telefone'])]
+                    report.duplicates += len(contacts) - len(unique_contacts)
+                    contacts = unique_contacts
+                report.accepted += len(contacts)
+                yield from contacts
+                if progress is not None and report.rows_read >= next_progress:
+                    progress(report)
+                    next_progress = report.rows_read + progress_every
+    except FileNotFoundError:
+        report.error = f"Arquivo CSV não encontrado em '{filepath}'."
+        print(f"Erro: {report.error}")
 
+def iter_phones_from_csv(filepath, report=None, batch_size=CSV_INGEST_BATCH_SIZE):
+    """
+    Lê só a coluna 'telefone' de um CSV (ex: lista de supressão exportada de outro sistema; 'nome' é
+    opcional) como um gerador de telefones normalizados, com as mesmas regras e o mesmo IngestReport
+    de iter_contacts_from_csv.
+    """
+    report = report if report is not None else IngestReport(filepath)
+    report.filepath = report.filepath or filepath
+    try:
+        with open(filepath, mode='r', encoding='utf-8-sig', errors='replace', newline='') as csvfile:
+            opened = _open_contacts_reader(csvfile, filepath, report, required_columns=('telefone',))
+            if opened is None:
+                return
+            reader, phone_index, _ = opened
+            rows = _read_rows(reader, phone_index, phone_index, report)
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                normalized_phones = phone_normalizer.normalize_phones([phone_val for _, phone_val, _ in batch])
+                for (line_number, phone_val, _), (phone, note) in zip(batch, normalized_phones):
+                    if not phone:
+                        report.reject(line_number, note, phone_val)
+                        continue
+                    report.accepted += 1
+                    yield phone
     except FileNotFoundError:
-        print(f"Erro: Arquivo CSV não encontrado em '{filepath}'.")
-        return []
+        report.error = f"Arquivo CSV não encontrado em '{filepath}'."
+        print(f"Erro: {report.error}")
+
+def load_contacts_from_csv(filepath, report=None):
+    """
+    Carrega contatos de um arquivo CSV com colunas 'telefone' e 'nome'.
+    Tenta detectar automaticamente se o delimitador é ',' ou ';'.
+    Retorna uma lista de dicionários (para listas grandes, prefira iter_contacts_from_csv).
+    """
+    report = report if report is not None else IngestReport(filepath)
+    try:
+        contacts = list(iter_contacts_from_csv(filepath, report))
     except Exception as e:
         print(f"Erro inesperado ao processar o arquivo CSV '{filepath}': {e}")
         return []
+    if not report.error:
+        print(report.summary())
+        if not contacts:
+            print(f"Aviso: Nenhum contato válido foi carregado do arquivo '{filepath}' após o processamento.")
+    return contacts
 
 if __name__ == '__main__':
     # Para testar, crie os seguintes arquivos na pasta 'contacts/':
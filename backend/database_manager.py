@@ -4,21 +4,102 @@ sys.path.insert(0, 'C:\\Users\\Gestão MX\\Documents\\StoreBot')
 import sqlite3
 import os
 import datetime # Para timestamps
-from backend.config import DATABASE_NAME
+import itertools
+import json
+import threading
+from backend import dispatch_log_format
+from backend.contact_deduplicator import ContactDeduplicator
+from backend.suppression_index import SuppressionIndex
+from backend.config import (
+    DATABASE_NAME,
+    DISPATCH_ENQUEUE_CHUNK_SIZE,
+    DISPATCH_PAGE_SIZE,
+    DISPATCH_LOG_PAGE_SIZE,
+    DB_AUTO_VACUUM,
+    DB_JOURNAL_MODE,
+    DB_SYNCHRONOUS,
+    DB_CACHE_SIZE_KIB,
+    DB_BUSY_TIMEOUT_MS,
+    DB_CACHED_STATEMENTS,
+    SUPPRESSION_REFRESH_SECONDS,
+    SUPPRESSION_CHANGES_PAGE_SIZE,
+    WORKER_STATS_MAX_AGE_SECONDS,
+)
 
-# get_db_connection() e create_tables() permanecem como antes
+class PersistentConnection(sqlite3.Connection):
+    """
+    Conexão reaproveitada por todas as funções deste módulo na mesma thread.
 
-def get_db_connection():
-    """Cria e retorna uma conexão com o banco de dados."""
-    conn = sqlite3.connect(DATABASE_NAME)
+    close() apenas desfaz o que não foi confirmado e restaura o modo de transação, deixando a
+    conexão (e seu cache de consultas preparadas) pronta para a próxima chamada. Para fechar de
+    verdade, use close_db_connections().
+    """
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+        self.isolation_level = ""
+
+    def close_for_real(self):
+        super().close()
+
+
+_thread_connections = threading.local()
+_inherited_connections = [] # Conexões herdadas via fork: não podem ser usadas nem fechadas no processo filho
+
+def _open_connection():
+    conn = sqlite3.connect(DATABASE_NAME, factory=PersistentConnection,
+                           timeout=DB_BUSY_TIMEOUT_MS / 1000, cached_statements=DB_CACHED_STATEMENTS)
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA auto_vacuum={DB_AUTO_VACUUM}") # Só vale para bancos novos (antes da primeira tabela)
+    conn.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size=-{int(DB_CACHE_SIZE_KIB)}")
+    conn.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT_MS)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
-def create_tables():
-    """Cria as tabelas no banco de dados se elas não existirem."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def get_db_connection():
+    """
+    Retorna a conexão persistente da thread atual com o banco de dados (criada na primeira chamada,
+    já com WAL e os pragmas de config.py). Chamar close() nela não a fecha, só encerra a transação.
+    """
+    conn = getattr(_thread_connections, 'conn', None)
+    if conn is not None and _thread_connections.pid != os.getpid():
+        # Processo filho (fork) herdou a conexão do pai: abre outra e mantém a herdada intocada
+        _inherited_connections.append(conn)
+        conn = None
+    if conn is None:
+        conn = _open_connection()
+        _thread_connections.conn = conn
+        _thread_connections.pid = os.getpid()
+    return conn
+
+def close_db_connections():
+    """Fecha a conexão persistente da thread atual (ex: antes de remover o arquivo do BD ou ao encerrar)."""
+    conn = getattr(_thread_connections, 'conn', None)
+    _thread_connections.conn = None
+    if conn is not None and _thread_connections.pid == os.getpid():
+        try:
+            conn.close_for_real()
+        except sqlite3.Error as e:
+            print(f"Erro ao fechar a conexão com o banco de dados: {e}")
+
+def _add_missing_columns(cursor, table_name, columns):
+    """Adiciona (ALTER TABLE) as colunas que ainda não existem em uma tabela já criada."""
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    existing_columns = {row['name'] for row in cursor.fetchall()}
+    for column_name, column_definition in columns:
+        if column_name not in existing_columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_definition}")
 
+# --- Migrações do schema ---
+# Cada passo (versão, descrição, função) roda uma única vez, em ordem, e a versão aplicada fica
+# gravada em PRAGMA user_version. Para alterar o schema, acrescente um passo no fim da lista;
+# nunca edite um passo já publicado.
+
+def _migration_1_base_schema(cursor):
+    """Tabelas campaigns e dispatch_log (schema existente antes do versionamento)."""
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS campaigns (
         campaign_id TEXT PRIMARY KEY,
@@ -26,10 +107,20 @@ def create_tables():
         message_template TEXT,
         image_filename TEXT, /* Apenas o nome do arquivo, não o caminho completo */
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-        status TEXT DEFAULT 'PENDING' /* PENDING, IN_PROGRESS, COMPLETED, COMPLETED_WITH_ERRORS, PAUSED */
+        status TEXT DEFAULT 'PENDING', /* PENDING, IN_PROGRESS, COMPLETED, COMPLETED_WITH_ERRORS, PAUSED */
+        priority INTEGER NOT NULL DEFAULT 1, /* Peso da campanha na divisão dos envios entre campanhas */
+        send_window_start TEXT, /* 'HH:MM' - início do horário permitido para envios (NULL = sem restrição) */
+        send_window_end TEXT /* 'HH:MM' - fim do horário permitido */
     )
     """)
 
+    # Bancos criados antes das colunas de agendamento
+    _add_missing_columns(cursor, "campaigns", [
+        ("priority", "INTEGER NOT NULL DEFAULT 1"),
+        ("send_window_start", "TEXT"),
+        ("send_window_end", "TEXT"),
+    ])
+
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS dispatch_log (
         log_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -38,28 +129,341 @@ def create_tables():
         contact_name TEXT,
         personalized_message_text TEXT, /* Mensagem após substituir {{nome}} */
         sent_at DATETIME,
-        status TEXT NOT NULL, /* PENDING, SENT_SUCCESS, SENT_FAILED */
+        status TEXT NOT NULL, /* PENDING, SENT_SUCCESS, SENT_FAILED, RETRY_SCHEDULED, DEAD_LETTER, SUPPRESSED */
         api_response TEXT,
+        retry_count INTEGER NOT NULL DEFAULT 0, /* Quantas vezes o envio falhou de forma transitória */
+        next_attempt_at DATETIME, /* Quando um RETRY_SCHEDULED pode ser reenviado */
+        lease_owner TEXT, /* Worker que reservou o contato para envio */
+        lease_expires_at DATETIME, /* Depois disso a reserva pode ser assumida por outro worker */
         FOREIGN KEY (campaign_id) REFERENCES campaigns (campaign_id)
     )
     """)
 
-    conn.commit()
-    conn.close()
-    # Comentado para não poluir o console toda vez que for importado
-    # print(f"Banco de dados '{DATABASE_NAME}' e tabelas verificados/criados.")
+    # Bancos criados antes das colunas de retry e de reserva
+    _add_missing_columns(cursor, "dispatch_log", [
+        ("retry_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("next_attempt_at", "DATETIME"),
+        ("lease_owner", "TEXT"),
+        ("lease_expires_at", "DATETIME"),
+    ])
+
+def _migration_2_hot_path_indexes(cursor):
+    """Índices das consultas mais frequentes do worker de disparos e do painel."""
+    # Reserva de contatos, contagens por status e contatos em aberto (WHERE campaign_id = ? AND status ... ORDER BY log_id)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_dispatch_log_campaign_status
+    ON dispatch_log (campaign_id, status, log_id)
+    """)
+    # Busca de um telefone (histórico do contato, duplicidade na campanha)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_dispatch_log_phone_campaign
+    ON dispatch_log (contact_phone, campaign_id)
+    """)
+    # Progresso em tempo real do painel (WHERE campaign_id = ? AND sent_at > ?)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_dispatch_log_campaign_sent_at
+    ON dispatch_log (campaign_id, sent_at)
+    """)
+    # Listagem de campanhas (WHERE status IN (...) ORDER BY created_at)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_campaigns_status_created_at
+    ON campaigns (status, created_at)
+    """)
+
+def _fill_campaign_stats(cursor, campaign_id=None, keep_archived=False):
+    """
+    Recalcula campaign_stats a partir do dispatch_log (todas as campanhas ou só `campaign_id`).
+    Com `keep_archived`, preserva os contadores das campanhas arquivadas (cujos registros já saíram do dispatch_log).
+    """
+    scope = "campaign_id IS NOT NULL" if campaign_id is None else "campaign_id = ?"
+    params = () if campaign_id is None else (campaign_id,)
+    if keep_archived:
+        scope += " AND campaign_id NOT IN (SELECT campaign_id FROM campaigns WHERE archived_at IS NOT NULL)"
+    cursor.execute(f"DELETE FROM campaign_stats WHERE {scope}", params)
+    cursor.execute(f"""
+    INSERT INTO campaign_stats (campaign_id, status, total)
+    SELECT campaign_id, status, COUNT(*) FROM dispatch_log
+    WHERE {scope}
+    GROUP BY campaign_id, status
+    """, params)
+
+def _migration_3_campaign_stats(cursor):
+    """Contadores por campanha e status, mantidos por triggers na mesma transação de cada alteração do dispatch_log."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS campaign_stats (
+        campaign_id TEXT NOT NULL,
+        status TEXT NOT NULL, /* Mesmo status do dispatch_log: PENDING, SENT_SUCCESS, ... */
+        total INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (campaign_id, status)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_dispatch_log_stats_insert
+    AFTER INSERT ON dispatch_log
+    WHEN NEW.campaign_id IS NOT NULL
+    BEGIN
+        INSERT INTO campaign_stats (campaign_id, status, total) VALUES (NEW.campaign_id, NEW.status, 1)
+        ON CONFLICT (campaign_id, status) DO UPDATE SET total = total + 1;
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_dispatch_log_stats_update
+    AFTER UPDATE OF status, campaign_id ON dispatch_log
+    WHEN OLD.status IS NOT NEW.status OR OLD.campaign_id IS NOT NEW.campaign_id
+    BEGIN
+        UPDATE campaign_stats SET total = total - 1
+        WHERE campaign_id = OLD.campaign_id AND status = OLD.status;
+        INSERT INTO campaign_stats (campaign_id, status, total)
+        SELECT NEW.campaign_id, NEW.status, 1 WHERE NEW.campaign_id IS NOT NULL
+        ON CONFLICT (campaign_id, status) DO UPDATE SET total = total + 1;
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_dispatch_log_stats_delete
+    AFTER DELETE ON dispatch_log
+    BEGIN
+        UPDATE campaign_stats SET total = total - 1
+        WHERE campaign_id = OLD.campaign_id AND status = OLD.status;
+    END
+    """)
+    _fill_campaign_stats(cursor)
+
+def _migration_4_dispatch_log_page_index(cursor):
+    """Índice da página de detalhes da campanha (WHERE campaign_id = ? AND log_id > ? ORDER BY log_id, sem filtro de status)."""
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_dispatch_log_campaign_log
+    ON dispatch_log (campaign_id, log_id)
+    """)
+
+def _migration_5_campaign_archive(cursor):
+    """Arquivamento de campanhas finalizadas (backend/archive_manager.py)."""
+    _add_missing_columns(cursor, "campaigns", [
+        ("archived_at", "DATETIME"), # Registros movidos para o arquivo mensal; contadores ficam em campaign_stats
+        ("archive_file", "TEXT"), # Nome do banco de arquivo (na pasta de arquivos) com os registros da campanha
+    ])
+    # Registros apagados por terem sido arquivados não descontam dos contadores da campanha
+    cursor.execute("DROP TRIGGER IF EXISTS trg_dispatch_log_stats_delete")
+    cursor.execute("""
+    CREATE TRIGGER trg_dispatch_log_stats_delete
+    AFTER DELETE ON dispatch_log
+    WHEN NOT EXISTS (SELECT 1 FROM campaigns WHERE campaign_id = OLD.campaign_id AND archived_at IS NOT NULL)
+    BEGIN
+        UPDATE campaign_stats SET total = total - 1
+        WHERE campaign_id = OLD.campaign_id AND status = OLD.status;
+    END
+    """)
+
+def _migration_6_compact_dispatch_results(cursor):
+    """Colunas do formato compacto dos resultados de envio (backend/dispatch_log_format.py)."""
+    _add_missing_columns(cursor, "dispatch_log", [
+        ("api_message_id", "TEXT"), # Id da mensagem no WhatsApp
+        ("api_ack", "INTEGER"), # Ack devolvido no envio
+        ("api_error_code", "INTEGER"), # Código HTTP da falha
+        ("api_response_compressed", "BLOB"), # Resposta completa (zlib), conforme DISPATCH_API_RESPONSE_STORAGE
+    ])
+
+def _migration_7_suppression_list(cursor):
+    """Lista de supressão (opt-out) e o registro de alterações lido pelo índice em memória (suppression_index)."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS suppressed_phones (
+        phone TEXT PRIMARY KEY, /* Telefone normalizado (phone_normalizer) */
+        reason TEXT, /* Ex: 'SAIR', 'pedido do cliente' */
+        source TEXT, /* De onde veio: arquivo importado, atendente... */
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS suppression_changes (
+        change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone TEXT NOT NULL,
+        action TEXT NOT NULL, /* ADD ou REMOVE */
+        changed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    # Alterações registradas na mesma transação da inclusão/remoção (INSERT OR IGNORE de um número já suprimido não registra nada)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_suppressed_phones_insert
+    AFTER INSERT ON suppressed_phones
+    BEGIN
+        INSERT INTO suppression_changes (phone, action) VALUES (NEW.phone, 'ADD');
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_suppressed_phones_delete
+    AFTER DELETE ON suppressed_phones
+    BEGIN
+        INSERT INTO suppression_changes (phone, action) VALUES (OLD.phone, 'REMOVE');
+    END
+    """)
+
+def _migration_8_contact_lists(cursor):
+    """Listas de contatos importadas uma única vez para o banco (contact_lists/contacts) e a lista de cada campanha."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS contact_lists (
+        list_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        source_filename TEXT, /* Arquivo CSV de origem */
+        content_hash TEXT, /* SHA-256 do arquivo: o mesmo arquivo enviado de novo reaproveita a lista */
+        contact_count INTEGER NOT NULL DEFAULT 0,
+        duplicate_count INTEGER NOT NULL DEFAULT 0, /* Telefones repetidos no arquivo (guardados uma vez) */
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_contact_lists_content_hash ON contact_lists (content_hash)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS contacts (
+        contact_id INTEGER PRIMARY KEY, /* Ordem do arquivo */
+        list_id INTEGER NOT NULL REFERENCES contact_lists (list_id),
+        phone TEXT NOT NULL, /* Normalizado (phone_normalizer) */
+        name TEXT
+    )
+    """)
+    # Um telefone por lista (INSERT OR IGNORE descarta os repetidos) e leitura da lista na ordem do arquivo
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_contacts_list_phone ON contacts (list_id, phone)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_contacts_list ON contacts (list_id, contact_id)")
+    _add_missing_columns(cursor, "campaigns", [
+        ("list_id", "INTEGER"), # Lista de contatos (contact_lists) usada ao criar a campanha
+    ])
+
+def _migration_9_incremental_list_imports(cursor):
+    """Histórico de importações de cada lista e o hash de cada linha, para atualizar uma lista só com o que mudou."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS contact_list_imports (
+        import_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        list_id INTEGER NOT NULL REFERENCES contact_lists (list_id),
+        source_filename TEXT,
+        content_hash TEXT, /* SHA-256 do arquivo importado */
+        inserted_count INTEGER NOT NULL DEFAULT 0,
+        updated_count INTEGER NOT NULL DEFAULT 0, /* Mesmo telefone, nome alterado */
+        deleted_count INTEGER NOT NULL DEFAULT 0, /* Telefones que não estavam mais no arquivo */
+        unchanged_count INTEGER NOT NULL DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_contact_list_imports_list ON contact_list_imports (list_id, import_id)")
+    _add_missing_columns(cursor, "contacts", [
+        ("row_hash", "INTEGER"), # csv_processor.contact_row_hash da linha de origem (NULL: importada antes da versão 9)
+        ("import_id", "INTEGER"), # Importação que incluiu o contato na lista
+    ])
+    # Contatos incluídos depois de uma importação (campanha só para os novos)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_contacts_list_import ON contacts (list_id, import_id)")
+    # Listas já existentes: uma importação inicial para cada uma, dona de todos os seus contatos
+    cursor.execute("""
+    INSERT INTO contact_list_imports (list_id, source_filename, content_hash, inserted_count, created_at)
+    SELECT list_id, source_filename, content_hash, contact_count, created_at FROM contact_lists ORDER BY list_id
+    """)
+    cursor.execute("""
+    UPDATE contacts SET import_id = (SELECT MIN(i.import_id) FROM contact_list_imports i WHERE i.list_id = contacts.list_id)
+    WHERE import_id IS NULL
+    """)
+
+def _migration_10_session_rates(cursor):
+    """Taxa de envios de cada sessão, gravada pelos workers de disparo e lida pela interface web (outro processo)."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS session_rates (
+        session_name TEXT PRIMARY KEY,
+        worker_id TEXT NOT NULL, /* Processo que usa a sessão (dispatch_engine.new_worker_id) */
+        rate REAL, /* Envios/s do controle adaptativo (rate_controller) */
+        effective_rate REAL, /* Taxa já limitada pelo aquecimento */
+        sends_per_minute REAL,
+        warmup_progress REAL,
+        connected INTEGER NOT NULL DEFAULT 0,
+        successes INTEGER NOT NULL DEFAULT 0,
+        failures INTEGER NOT NULL DEFAULT 0,
+        decreases INTEGER NOT NULL DEFAULT 0,
+        updated_at DATETIME NOT NULL
+    ) WITHOUT ROWID
+    """)
+
+def _migration_11_worker_stats(cursor):
+    """Uso do cliente HTTP do wppconnect e do cache de imagens de cada worker de disparo, lido pela interface web."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS worker_stats (
+        worker_id TEXT PRIMARY KEY, /* dispatch_engine.new_worker_id */
+        client_stats TEXT NOT NULL, /* JSON de wpp_connector.WppClient.stats() */
+        media_cache_stats TEXT NOT NULL, /* JSON de wpp_connector.MediaPayloadCache.stats() */
+        updated_at DATETIME NOT NULL
+    ) WITHOUT ROWID
+    """)
+
+MIGRATIONS = [
+    (1, "Schema base de campanhas e disparos", _migration_1_base_schema),
+    (2, "Índices de disparos pendentes, telefones e listagem de campanhas", _migration_2_hot_path_indexes),
+    (3, "Contadores por campanha (campaign_stats)", _migration_3_campaign_stats),
+    (4, "Índice da paginação do log de disparos por campanha", _migration_4_dispatch_log_page_index),
+    (5, "Arquivamento de campanhas finalizadas", _migration_5_campaign_archive),
+    (6, "Resultados de envio em formato compacto", _migration_6_compact_dispatch_results),
+    (7, "Lista de supressão (opt-out)", _migration_7_suppression_list),
+    (8, "Listas de contatos no banco (contact_lists/contacts)", _migration_8_contact_lists),
+    (9, "Importação incremental de listas de contatos (hash por linha)", _migration_9_incremental_list_imports),
+    (10, "Taxa de envios das sessões publicada pelos workers (session_rates)", _migration_10_session_rates),
+    (11, "Estatísticas do cliente HTTP e do cache de imagens dos workers (worker_stats)", _migration_11_worker_stats),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version():
+    """Versão do schema gravada no banco (0 = banco novo ou anterior ao versionamento)."""
+    conn = get_db_connection()
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+def migrate_database(target_version=SCHEMA_VERSION):
+    """
+    Aplica, em ordem, os passos de MIGRATIONS ainda não aplicados até `target_version`.
+    Cada passo roda em sua própria transação (BEGIN IMMEDIATE) junto com a atualização de
+    user_version, então um passo com erro não deixa o schema pela metade e processos iniciando
+    ao mesmo tempo não aplicam o mesmo passo duas vezes. Retorna a versão final do schema.
+    """
+    conn = get_db_connection()
+    conn.isolation_level = None # Controle manual da transação
+    cursor = conn.cursor()
+    try:
+        for version, description, migration in MIGRATIONS:
+            if version > target_version:
+                break
+            cursor.execute("BEGIN IMMEDIATE")
+            current_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if current_version >= version:
+                cursor.execute("COMMIT")
+                continue
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {int(version)}")
+            cursor.execute("COMMIT")
+            print(f"Banco de dados '{DATABASE_NAME}' migrado para a versão {version}: {description}.")
+        return cursor.execute("PRAGMA user_version").fetchone()[0]
+    except sqlite3.Error as e:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        print(f"Erro ao migrar o banco de dados '{DATABASE_NAME}': {e}")
+        raise
+    finally:
+        conn.close()
+
+def create_tables():
+    """Cria as tabelas no banco de dados, ou atualiza um banco existente para a versão atual do schema."""
+    migrate_database()
 
 # --- Novas Funções ---
 
-def add_campaign(campaign_id, csv_filename, message_template, image_filename=None, status='PENDING'):
-    """Adiciona uma nova campanha ao banco de dados."""
+def add_campaign(campaign_id, csv_filename, message_template, image_filename=None, status='PENDING',
+                 priority=1, send_window_start=None, send_window_end=None, list_id=None):
+    """
+    Adiciona uma nova campanha ao banco de dados. `list_id` é a lista de contatos (contact_lists)
+    de onde os contatos são enfileirados (enqueue_contact_list); `csv_filename` guarda o nome exibido da lista.
+    `priority` é o peso da campanha na divisão dos envios com as demais campanhas em andamento e
+    `send_window_start`/`send_window_end` ('HH:MM') limitam os envios a um horário do dia.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
         cursor.execute("""
-        INSERT INTO campaigns (campaign_id, csv_filename, message_template, image_filename, status, created_at)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """, (campaign_id, csv_filename, message_template, image_filename, status, datetime.datetime.now()))
+        INSERT INTO campaigns (campaign_id, csv_filename, message_template, image_filename, status, created_at,
+                               priority, send_window_start, send_window_end, list_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (campaign_id, csv_filename, message_template, image_filename, status, datetime.datetime.now(),
+              priority, send_window_start, send_window_end, list_id))
         conn.commit()
         print(f"Campanha '{campaign_id}' adicionada ao banco de dados.")
         return True
@@ -84,6 +488,23 @@ def update_campaign_status(campaign_id, status):
     finally:
         conn.close()
 
+def update_campaign_schedule(campaign_id, priority, send_window_start=None, send_window_end=None):
+    """Altera a prioridade e a janela de envio de uma campanha (vale também para campanhas em andamento)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+        UPDATE campaigns SET priority = ?, send_window_start = ?, send_window_end = ?
+        WHERE campaign_id = ?
+        """, (priority, send_window_start, send_window_end, campaign_id))
+        conn.commit()
+        return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        print(f"Erro ao atualizar agendamento da campanha '{campaign_id}': {e}")
+        return False
+    finally:
+        conn.close()
+
 def get_campaign_details(campaign_id):
     """Recupera os detalhes de uma campanha específica."""
     conn = get_db_connection()
@@ -115,25 +536,400 @@ def add_dispatch_contact(campaign_id, contact_phone, contact_name, status='PENDI
     finally:
         conn.close()
 
-def update_dispatch_log(log_id, status, personalized_message_text=None, api_response=None):
-    """Atualiza um registro no log de disparos."""
+def add_dispatch_contacts_bulk(campaign_id, contacts, chunk_size=DISPATCH_ENQUEUE_CHUNK_SIZE, status='PENDING',
+                               deduplicate=True):
+    """
+    Enfileira todos os contatos de uma campanha em uma única transação (executemany em blocos
+    de `chunk_size`), em vez de uma conexão e um commit por contato.
+
+    `contacts` é qualquer iterável de dicts com 'telefone' e 'nome' (formato do csv_processor).
+    Contatos sem telefone são rejeitados e os da lista de supressão (opt-out) são descartados. Com
+    `deduplicate`, telefones repetidos na lista ou já enfileirados na campanha (ex: uma segunda lista
+    somada à mesma campanha) também são descartados (contact_deduplicator; acima de
+    DEDUP_MEMORY_MAX_CONTACTS a checagem passa a consultar o banco).
+    Retorna (inseridos, rejeitados, repetidos, suprimidos); em caso de erro no BD nada é gravado e
+    todos os contatos lidos contam como rejeitados.
+    """
+    inserted = 0
+    rejected = 0
+    suppressed = 0
+    suppression_index = get_suppression_index() # Antes de abrir a transação (a atualização usa a mesma conexão)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    check_cursor = conn.cursor() # Vê também as linhas inseridas nesta transação, ainda não confirmadas
+    deduplicator = None
+    if deduplicate:
+        deduplicator = ContactDeduplicator(db_check=lambda phone: check_cursor.execute(
+            "SELECT 1 FROM dispatch_log WHERE contact_phone = ? AND campaign_id = ? LIMIT 1", (phone, campaign_id)
+        ).fetchone() is not None)
+
+    def dispatch_rows():
+        nonlocal rejected, suppressed
+        for contact in contacts:
+            phone = (contact.get('telefone') or '').strip()
+            if not phone:
+                rejected += 1
+                continue
+            if phone in suppression_index:
+                suppressed += 1
+                continue
+            if deduplicator is not None and not deduplicator.add(phone):
+                continue
+            yield (campaign_id, phone, contact.get('nome') or '', status)
+
+    rows = dispatch_rows()
+    chunk = []
+    try:
+        if deduplicator is not None:
+            for (phone,) in conn.execute("SELECT contact_phone FROM dispatch_log WHERE campaign_id = ?", (campaign_id,)):
+                deduplicator.preload(phone) # Contatos que a campanha já tinha
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            cursor.executemany("""
+            INSERT INTO dispatch_log (campaign_id, contact_phone, contact_name, status)
+            VALUES (?, ?, ?, ?)
+            """, chunk)
+            inserted += len(chunk)
+            chunk = []
+            if deduplicator is not None:
+                deduplicator.mark_flushed()
+        conn.commit()
+        return inserted, rejected, (deduplicator.duplicates if deduplicator is not None else 0), suppressed
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Erro ao enfileirar os contatos da campanha '{campaign_id}': {e}. Nenhum contato foi adicionado.")
+        return 0, inserted + len(chunk) + sum(1 for _ in rows) + rejected, 0, 0
+    finally:
+        conn.close()
+
+# --- Listas de contatos (contact_lists/contacts) ---
+# O CSV é lido e normalizado uma única vez, no upload; as campanhas enfileiram a partir da lista
+# gravada (enqueue_contact_list), sem depender do arquivo nem do seu tamanho.
+
+def import_contact_list(name, contacts, source_filename=None, content_hash=None, chunk_size=DISPATCH_ENQUEUE_CHUNK_SIZE):
+    """
+    Grava uma nova lista com os `contacts` (iterável de dicts {'telefone', 'nome'} já normalizados,
+    ex: csv_processor.iter_contacts_from_csv) em uma única transação. Telefones repetidos são
+    guardados uma vez e contatos sem telefone são rejeitados. O 'row_hash' de cada contato, se houver
+    (with_row_hashes=True), é guardado para as próximas versões da lista (reimport_contact_list).
+    Retorna (list_id, inseridos, rejeitados, repetidos); em caso de erro nada é gravado e list_id é None.
+    """
+    rejected = 0
+    read = 0
+
+    def contact_rows(list_id, import_id):
+        nonlocal rejected, read
+        for contact in contacts:
+            read += 1
+            phone = (contact.get('telefone') or '').strip()
+            if not phone:
+                rejected += 1
+                continue
+            yield (list_id, phone, contact.get('nome') or '', contact.get('row_hash'), import_id)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    inserted = 0
+    try:
+        cursor.execute("""
+        INSERT INTO contact_lists (name, source_filename, content_hash, created_at) VALUES (?, ?, ?, ?)
+        """, (name, source_filename, content_hash, datetime.datetime.now()))
+        list_id = cursor.lastrowid
+        cursor.execute("""
+        INSERT INTO contact_list_imports (list_id, source_filename, content_hash, created_at) VALUES (?, ?, ?, ?)
+        """, (list_id, source_filename, content_hash, datetime.datetime.now()))
+        import_id = cursor.lastrowid
+        rows = contact_rows(list_id, import_id)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            cursor.executemany("""
+            INSERT OR IGNORE INTO contacts (list_id, phone, name, row_hash, import_id) VALUES (?, ?, ?, ?, ?)
+            """, chunk)
+            inserted += cursor.rowcount
+        duplicates = read - rejected - inserted
+        cursor.execute("UPDATE contact_lists SET contact_count = ?, duplicate_count = ? WHERE list_id = ?",
+                       (inserted, duplicates, list_id))
+        cursor.execute("UPDATE contact_list_imports SET inserted_count = ? WHERE import_id = ?", (inserted, import_id))
+        conn.commit()
+        return list_id, inserted, rejected, duplicates
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Erro ao importar a lista de contatos '{name}': {e}. Nada foi gravado.")
+        return None, 0, read, 0
+    finally:
+        conn.close()
+
+def get_contact_lists():
+    """
+    Listas de contatos importadas, da mais recente para a mais antiga, com os números da última
+    importação (last_import_id, last_inserted_count... updated_at).
+    """
+    conn = get_db_connection()
+    try:
+        return conn.execute("""
+        SELECT l.*, i.import_id AS last_import_id, i.inserted_count AS last_inserted_count,
+               i.updated_count AS last_updated_count, i.deleted_count AS last_deleted_count,
+               i.created_at AS updated_at,
+               (SELECT COUNT(*) FROM contact_list_imports c WHERE c.list_id = l.list_id) AS import_count
+        FROM contact_lists l
+        LEFT JOIN contact_list_imports i
+               ON i.import_id = (SELECT MAX(import_id) FROM contact_list_imports m WHERE m.list_id = l.list_id)
+        ORDER BY l.created_at DESC, l.list_id DESC
+        """).fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao listar as listas de contatos: {e}")
+        return []
+    finally:
+        conn.close()
+
+def get_contact_list(list_id):
+    """Uma lista de contatos (contact_lists) pelo id, ou None."""
+    conn = get_db_connection()
+    try:
+        return conn.execute("SELECT * FROM contact_lists WHERE list_id = ?", (list_id,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"Erro ao buscar a lista de contatos {list_id}: {e}")
+        return None
+    finally:
+        conn.close()
+
+def find_contact_list_by_hash(content_hash):
+    """A lista importada de um arquivo com o mesmo conteúdo (SHA-256), ou None."""
+    conn = get_db_connection()
+    try:
+        return conn.execute("""
+        SELECT * FROM contact_lists WHERE content_hash = ? ORDER BY list_id DESC LIMIT 1
+        """, (content_hash,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"Erro ao buscar lista de contatos pelo conteúdo: {e}")
+        return None
+    finally:
+        conn.close()
+
+def delete_contact_list(list_id):
+    """
+    Apaga uma lista e seus contatos. Campanhas já criadas com ela não são afetadas (os contatos
+    foram copiados para o dispatch_log ao criar a campanha). Retorna True se a lista existia.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        timestamp = datetime.datetime.now()
-        if personalized_message_text:
-            cursor.execute("""
-            UPDATE dispatch_log 
-            SET status = ?, personalized_message_text = ?, sent_at = ?, api_response = ?
-            WHERE log_id = ?
-            """, (status, personalized_message_text, timestamp, api_response, log_id))
-        else: # Não atualiza a mensagem se não for fornecida (ex: ao marcar como PENDING inicialmente)
-            cursor.execute("""
-            UPDATE dispatch_log 
-            SET status = ?, sent_at = ?, api_response = ?
-            WHERE log_id = ?
-            """, (status, timestamp, api_response, log_id))
+        cursor.execute("DELETE FROM contacts WHERE list_id = ?", (list_id,))
+        cursor.execute("DELETE FROM contact_list_imports WHERE list_id = ?", (list_id,))
+        cursor.execute("DELETE FROM contact_lists WHERE list_id = ?", (list_id,))
+        deleted = cursor.rowcount > 0
         conn.commit()
+        return deleted
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Erro ao apagar a lista de contatos {list_id}: {e}")
+        return False
+    finally:
+        conn.close()
+
+def enqueue_contact_list(campaign_id, list_id, status='PENDING', since_import_id=None):
+    """
+    Enfileira os contatos de uma lista importada na campanha com um único INSERT ... SELECT, na ordem
+    do arquivo, sem passar os contatos pelo Python. Como em add_dispatch_contacts_bulk, telefones já
+    enfileirados na campanha e os da lista de supressão ficam de fora (aqui a checagem é feita pelo
+    próprio SQL, nos índices de dispatch_log e suppressed_phones).
+    Com `since_import_id`, só os contatos incluídos na lista pelas importações posteriores a ela (ex:
+    os clientes novos da semana, veja reimport_contact_list).
+    Retorna (inseridos, rejeitados, repetidos, suprimidos), no mesmo formato de add_dispatch_contacts_bulk;
+    em caso de erro nada é gravado e todos os contatos da lista contam como rejeitados.
+    """
+    contacts_filter = "c.list_id = ?"
+    filter_params = (list_id,)
+    if since_import_id is not None:
+        contacts_filter += " AND c.import_id > ?"
+        filter_params += (since_import_id,)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    total = 0
+    try:
+        total = cursor.execute(f"SELECT COUNT(*) FROM contacts c WHERE {contacts_filter}", filter_params).fetchone()[0]
+        suppressed = cursor.execute(f"""
+        SELECT COUNT(*) FROM contacts c JOIN suppressed_phones s ON s.phone = c.phone WHERE {contacts_filter}
+        """, filter_params).fetchone()[0]
+        cursor.execute(f"""
+        INSERT INTO dispatch_log (campaign_id, contact_phone, contact_name, status)
+        SELECT ?, c.phone, c.name, ? FROM contacts c
+        WHERE {contacts_filter}
+          AND NOT EXISTS (SELECT 1 FROM suppressed_phones s WHERE s.phone = c.phone)
+          AND NOT EXISTS (SELECT 1 FROM dispatch_log d WHERE d.contact_phone = c.phone AND d.campaign_id = ?)
+        ORDER BY c.contact_id
+        """, (campaign_id, status) + filter_params + (campaign_id,))
+        inserted = cursor.rowcount
+        conn.commit()
+        return inserted, 0, total - inserted - suppressed, suppressed
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Erro ao enfileirar a lista {list_id} na campanha '{campaign_id}': {e}. Nenhum contato foi adicionado.")
+        return 0, total, 0, 0
+    finally:
+        conn.close()
+
+def get_contact_list_imports(list_id):
+    """Importações de uma lista (a inicial e as atualizações), da mais recente para a mais antiga."""
+    conn = get_db_connection()
+    try:
+        return conn.execute("""
+        SELECT * FROM contact_list_imports WHERE list_id = ? ORDER BY import_id DESC
+        """, (list_id,)).fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao listar as importações da lista de contatos {list_id}: {e}")
+        return []
+    finally:
+        conn.close()
+
+def _stored_row_key(contact_id, row_hash):
+    """Chave de um contato gravado em get_contact_row_hashes (os importados antes da versão 9 não têm row_hash)."""
+    return row_hash if row_hash is not None else ('contact', contact_id)
+
+def get_contact_row_hashes(list_id):
+    """
+    Hash da linha de origem de cada contato da lista: dict row_hash -> contact_id, usado como
+    `known_row_hashes` em csv_processor.iter_contacts_from_csv e reimport_contact_list.
+    """
+    conn = get_db_connection()
+    try:
+        return {_stored_row_key(contact_id, row_hash): contact_id for contact_id, row_hash in conn.execute(
+            "SELECT contact_id, row_hash FROM contacts WHERE list_id = ?", (list_id,))}
+    except sqlite3.Error as e:
+        print(f"Erro ao ler os contatos da lista {list_id}: {e}")
+        return None
+    finally:
+        conn.close()
+
+def reimport_contact_list(list_id, contacts, known_row_hashes, source_filename=None, content_hash=None,
+                          delete_missing=True, chunk_size=DISPATCH_ENQUEUE_CHUNK_SIZE):
+    """
+    Atualiza uma lista com uma nova versão do mesmo arquivo (ex: a base de clientes exportada de novo
+    toda semana), gravando só o que mudou.
+
+    `known_row_hashes` é o dict de get_contact_row_hashes depois da leitura do arquivo por
+    csv_processor.iter_contacts_from_csv(..., known_row_hashes=...): as linhas iguais às gravadas já
+    estão marcadas com None e `contacts` traz só as linhas novas ou alteradas. Cada uma é procurada pelo
+    telefone normalizado: telefone novo é incluído (com o import_id desta importação), telefone existente
+    tem o nome e o row_hash atualizados. Com `delete_missing`, os contatos cuja linha não apareceu no
+    arquivo são apagados. Leitura e escrita dependem do número de alterações, não do tamanho da lista.
+
+    Retorna um dict com import_id, inserted, updated, deleted, unchanged, rejected e duplicates; em caso
+    de erro nada é gravado e import_id é None.
+    """
+    summary = {'import_id': None, 'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'rejected': 0,
+               'duplicates': 0}
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+        INSERT INTO contact_list_imports (list_id, source_filename, content_hash, created_at) VALUES (?, ?, ?, ?)
+        """, (list_id, source_filename, content_hash, datetime.datetime.now()))
+        import_id = cursor.lastrowid
+        inserts = []
+        updates = []
+        seen_phones = set() # Telefones das linhas alteradas já tratados nesta importação
+        for contact in contacts:
+            phone = (contact.get('telefone') or '').strip()
+            if not phone:
+                summary['rejected'] += 1
+                continue
+            if phone in seen_phones:
+                summary['duplicates'] += 1
+                continue
+            seen_phones.add(phone)
+            name = contact.get('nome') or ''
+            stored = cursor.execute("SELECT contact_id, name, row_hash FROM contacts WHERE list_id = ? AND phone = ?",
+                                    (list_id, phone)).fetchone()
+            if stored is None:
+                inserts.append((list_id, phone, name, contact.get('row_hash'), import_id))
+                continue
+            stored_key = _stored_row_key(stored['contact_id'], stored['row_hash'])
+            if stored_key in known_row_hashes and known_row_hashes[stored_key] is None:
+                summary['duplicates'] += 1 # A linha gravada deste telefone continua no arquivo
+                continue
+            known_row_hashes[stored_key] = None
+            updates.append((name, contact.get('row_hash'), stored['contact_id']))
+            if name != stored['name']:
+                summary['updated'] += 1
+        for start in range(0, len(inserts), chunk_size):
+            cursor.executemany("""
+            INSERT INTO contacts (list_id, phone, name, row_hash, import_id) VALUES (?, ?, ?, ?, ?)
+            """, inserts[start:start + chunk_size])
+        # Mesmo com o nome igual o row_hash é atualizado (ex: telefone em outro formato), para casar na próxima vez
+        cursor.executemany("UPDATE contacts SET name = ?, row_hash = ? WHERE contact_id = ?", updates)
+        missing = [(contact_id,) for contact_id in known_row_hashes.values() if contact_id is not None]
+        if delete_missing:
+            cursor.executemany("DELETE FROM contacts WHERE contact_id = ?", missing)
+            summary['deleted'] = len(missing)
+        summary['inserted'] = len(inserts)
+        summary['unchanged'] = len(known_row_hashes) - len(missing) - summary['updated']
+        cursor.execute("""
+        UPDATE contact_list_imports
+        SET inserted_count = ?, updated_count = ?, deleted_count = ?, unchanged_count = ?
+        WHERE import_id = ?
+        """, (summary['inserted'], summary['updated'], summary['deleted'], summary['unchanged'], import_id))
+        cursor.execute("""
+        UPDATE contact_lists SET contact_count = contact_count + ?, source_filename = ?, content_hash = ? WHERE list_id = ?
+        """, (summary['inserted'] - summary['deleted'], source_filename, content_hash, list_id))
+        conn.commit()
+        summary['import_id'] = import_id
+        return summary
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Erro ao atualizar a lista de contatos {list_id}: {e}. Nada foi alterado.")
+        return dict(summary, inserted=0, updated=0, deleted=0, unchanged=0)
+    finally:
+        conn.close()
+
+def _dispatch_update_query(log_id, status, personalized_message_text=None, api_response=None,
+                           retry_count=None, next_attempt_at=None, lease_owner=None, sent_at=None):
+    """
+    Monta o UPDATE (query, params) usado por update_dispatch_log e update_dispatch_logs_batch.
+    `api_response` (dict do wpp_connector ou texto JSON) é gravado no formato compacto (dispatch_log_format).
+    """
+    assignments = ["status = ?", "sent_at = ?", "api_response = NULL", "api_message_id = ?", "api_ack = ?",
+                   "api_error_code = ?", "api_response_compressed = ?", "next_attempt_at = ?",
+                   "lease_owner = NULL", "lease_expires_at = NULL"]
+    params = [status, sent_at or datetime.datetime.now(),
+              *dispatch_log_format.encode_api_response(api_response, status), next_attempt_at]
+    if personalized_message_text: # Só para quem ainda grava o texto; o dispatch_engine deixa para reconstruir na leitura
+        assignments.append("personalized_message_text = ?")
+        params.append(personalized_message_text)
+    if retry_count is not None:
+        assignments.append("retry_count = ?")
+        params.append(retry_count)
+    query = f"UPDATE dispatch_log SET {', '.join(assignments)} WHERE log_id = ?"
+    params.append(log_id)
+    if lease_owner is not None:
+        query += " AND lease_owner = ?"
+        params.append(lease_owner)
+    return query, params
+
+def update_dispatch_log(log_id, status, personalized_message_text=None, api_response=None,
+                        retry_count=None, next_attempt_at=None, lease_owner=None):
+    """
+    Atualiza um registro no log de disparos e libera a reserva (lease) do contato.
+    `retry_count` (se informado) registra quantas falhas transitórias o contato já teve e
+    `next_attempt_at` agenda o reenvio de um RETRY_SCHEDULED (None limpa o agendamento).
+    Com `lease_owner`, só atualiza se o contato ainda estiver reservado para esse worker
+    (retorna False se a reserva expirou e foi assumida por outro).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        query, params = _dispatch_update_query(
+            log_id, status, personalized_message_text, api_response, retry_count, next_attempt_at, lease_owner
+        )
+        cursor.execute(query, params)
+        conn.commit()
+        if cursor.rowcount == 0:
+            print(f"Aviso: Log de disparo ID {log_id} não atualizado (reserva de '{lease_owner}' perdida ou registro inexistente).")
+            return False
         # print(f"Log de disparo ID {log_id} atualizado para status '{status}'.")
         return True
     except sqlite3.Error as e:
@@ -142,19 +938,777 @@ def update_dispatch_log(log_id, status, personalized_message_text=None, api_resp
     finally:
         conn.close()
 
+def update_dispatch_logs_batch(updates):
+    """
+    Grava vários resultados de envio em uma única transação (um commit para o lote todo).
+    `updates` é uma lista de dicts com os argumentos de update_dispatch_log (log_id, status, ...)
+    e, opcionalmente, 'sent_at' (momento do envio; padrão: agora).
+    Retorna uma lista de booleanos na mesma ordem (False = reserva perdida ou registro inexistente),
+    ou None se a transação falhar (nada é gravado).
+    """
+    if not updates:
+        return []
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        recorded = []
+        for update in updates:
+            query, params = _dispatch_update_query(**update)
+            cursor.execute(query, params)
+            if cursor.rowcount == 0:
+                print(f"Aviso: Log de disparo ID {update['log_id']} não atualizado "
+                      f"(reserva de '{update.get('lease_owner')}' perdida ou registro inexistente).")
+            recorded.append(cursor.rowcount > 0)
+        conn.commit()
+        return recorded
+    except sqlite3.Error as e:
+        print(f"Erro ao gravar lote de {len(updates)} resultados de disparo: {e}")
+        return None
+    finally:
+        conn.close()
+
+def checkpoint_database():
+    """Transfere o WAL para o arquivo do banco (fsync), tornando duráveis os últimos commits feitos com synchronous=NORMAL."""
+    conn = get_db_connection()
+    try:
+        conn.execute("PRAGMA wal_checkpoint(FULL)")
+        return True
+    except sqlite3.Error as e:
+        print(f"Erro ao consolidar o WAL do banco de dados: {e}")
+        return False
+    finally:
+        conn.close()
+
+class DispatchRecord:
+    """
+    Contato da fila de disparos com apenas as colunas usadas no envio (sem o texto enviado nem a
+    resposta da API), bem menor que um sqlite3.Row. Aceita acesso como o sqlite3.Row
+    (record['contact_phone'], dict(record)) para não mudar quem já usava as linhas.
+    """
+
+    __slots__ = ("log_id", "campaign_id", "contact_phone", "contact_name", "status", "retry_count",
+                 "next_attempt_at", "lease_owner")
+
+    def __init__(self, log_id, campaign_id, contact_phone, contact_name, status, retry_count,
+                 next_attempt_at, lease_owner):
+        self.log_id = log_id
+        self.campaign_id = campaign_id
+        self.contact_phone = contact_phone
+        self.contact_name = contact_name
+        self.status = status
+        self.retry_count = retry_count
+        self.next_attempt_at = next_attempt_at
+        self.lease_owner = lease_owner
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def keys(self):
+        return self.__slots__
+
+    def __repr__(self):
+        return f"DispatchRecord(log_id={self.log_id}, contact_phone={self.contact_phone!r}, status={self.status!r})"
+
+DISPATCH_RECORD_COLUMNS = ", ".join(DispatchRecord.__slots__)
+
+def iter_pending_dispatches(campaign_id, page_size=DISPATCH_PAGE_SIZE, status='PENDING'):
+    """
+    Percorre os contatos de uma campanha com o status indicado (padrão PENDING) em páginas de
+    `page_size`, por paginação keyset (log_id > último visto) sobre idx_dispatch_log_campaign_status.
+    Gera DispatchRecord; só uma página fica em memória e nenhuma transação de leitura fica aberta
+    entre as páginas. Apenas consulta: para enviar, use claim_dispatch_batch.
+    """
+    last_log_id = 0
+    while True:
+        conn = get_db_connection()
+        try:
+            page = conn.execute(f"""
+            SELECT {DISPATCH_RECORD_COLUMNS} FROM dispatch_log
+            WHERE campaign_id = ? AND status = ? AND log_id > ?
+            ORDER BY log_id
+            LIMIT ?
+            """, (campaign_id, status, last_log_id, page_size)).fetchall()
+        except sqlite3.Error as e:
+            print(f"Erro ao buscar disparos '{status}' da campanha '{campaign_id}' (após log_id {last_log_id}): {e}")
+            return
+        finally:
+            conn.close()
+        for row in page:
+            yield DispatchRecord(*row)
+        if len(page) < page_size:
+            return
+        last_log_id = page[-1]['log_id']
+
+def count_pending_dispatches(campaign_id, status='PENDING'):
+    """Quantidade de contatos da campanha com o status indicado (contagem só no índice, sem ler as linhas)."""
+    conn = get_db_connection()
+    try:
+        return conn.execute(
+            "SELECT COUNT(*) FROM dispatch_log WHERE campaign_id = ? AND status = ?", (campaign_id, status)
+        ).fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"Erro ao contar disparos '{status}' da campanha '{campaign_id}': {e}")
+        return 0
+    finally:
+        conn.close()
+
 def get_pending_dispatches_for_campaign(campaign_id):
-    """Retorna todos os contatos com status 'PENDING' para uma campanha."""
+    """
+    Retorna todos os contatos com status 'PENDING' para uma campanha (apenas consulta), como lista
+    de DispatchRecord. Para campanhas grandes, prefira iter_pending_dispatches (uma página por vez)
+    e count_pending_dispatches; para enviar, use claim_dispatch_batch, que reserva os contatos e evita envio duplicado.
+    """
+    return list(iter_pending_dispatches(campaign_id))
+
+DISPATCH_LOG_PAGE_COLUMNS = ("log_id, contact_phone, contact_name, status, sent_at, retry_count, next_attempt_at, "
+                             "personalized_message_text, api_response, api_message_id, api_ack, api_error_code")
+DISPATCH_RESULT_COLUMNS = "api_response, api_response_compressed, api_message_id, api_ack, api_error_code"
+
+def dispatch_result_dict(row, message_template=None):
+    """
+    Converte uma linha do dispatch_log (com DISPATCH_RESULT_COLUMNS) em dict, com 'api_response' em texto
+    e, se `message_template` for informado, 'personalized_message_text' reconstruído quando não foi gravado.
+    """
+    dispatch = dict(row)
+    dispatch['api_response'] = dispatch_log_format.api_response_text(
+        dispatch['api_response'], dispatch.pop('api_response_compressed', None),
+        dispatch.get('api_message_id'), dispatch.get('api_ack'), dispatch.get('api_error_code')
+    )
+    if message_template is not None and not dispatch.get('personalized_message_text'):
+        dispatch['personalized_message_text'] = dispatch_log_format.personalize_message(message_template, dispatch['contact_name'])
+    return dispatch
+
+def dispatch_log_page_filters(campaign_id, after_log_id=None, before_log_id=None, limit=DISPATCH_LOG_PAGE_SIZE,
+                              status=None, contact_phone=None):
+    """
+    Monta o WHERE/ORDER BY/LIMIT de uma página keyset do log de disparos (usado também pelo archive_manager,
+    cujas tabelas de arquivo têm as mesmas colunas e índices). Retorna (sql, params, descending).
+    """
+    conditions = ["campaign_id = ?"]
+    params = [campaign_id]
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    if contact_phone:
+        conditions.append("contact_phone = ?")
+        params.append(contact_phone)
+    if before_log_id is not None:
+        conditions.append("log_id < ?")
+        params.append(before_log_id)
+        order = "DESC"
+    else:
+        conditions.append("log_id > ?")
+        params.append(after_log_id or 0)
+        order = "ASC"
+    params.append(limit + 1) # Um a mais para saber se existe outra página
+    return f"WHERE {' AND '.join(conditions)} ORDER BY log_id {order} LIMIT ?", params, order == "DESC"
+
+def get_dispatch_log_page(campaign_id, after_log_id=None, before_log_id=None, limit=DISPATCH_LOG_PAGE_SIZE,
+                          status=None, contact_phone=None):
+    """
+    Uma página do log de disparos da campanha, em ordem de log_id, com paginação keyset:
+    `after_log_id` traz a página seguinte e `before_log_id` a anterior (sem OFFSET, então o custo
+    por página é o mesmo no início ou no fim de uma campanha com centenas de milhares de contatos).
+    Filtros opcionais por `status` e por `contact_phone` (número exato), cada um servido por um índice.
+    Campanhas arquivadas são lidas do banco de arquivo (archive_manager), com o mesmo formato.
+    Retorna (lista de dicts, has_more) onde has_more indica se há mais registros na direção pedida;
+    em caso de erro, ([], False).
+    """
+    campaign = get_campaign_details(campaign_id)
+    if campaign is not None and campaign['archived_at']:
+        from backend import archive_manager # Import local: archive_manager depende deste módulo
+        return archive_manager.get_archived_dispatch_log_page(
+            campaign['archive_file'], campaign_id, after_log_id, before_log_id, limit, status, contact_phone,
+            message_template=campaign['message_template']
+        )
+    page_sql, params, descending = dispatch_log_page_filters(
+        campaign_id, after_log_id, before_log_id, limit, status, contact_phone
+    )
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            f"SELECT {DISPATCH_LOG_PAGE_COLUMNS}, api_response_compressed FROM dispatch_log {page_sql}", params
+        ).fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao buscar o log de disparos da campanha '{campaign_id}': {e}")
+        return [], False
+    finally:
+        conn.close()
+    has_more = len(rows) > limit
+    message_template = campaign['message_template'] if campaign is not None else None
+    page = [dispatch_result_dict(row, message_template) for row in rows[:limit]]
+    if descending:
+        page.reverse()
+    return page, has_more
+
+def get_due_retries_for_campaign(campaign_id, now=None, limit=500):
+    """Retorna os disparos RETRY_SCHEDULED cujo horário de reenvio já chegou."""
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
         cursor.execute("""
-        SELECT * FROM dispatch_log 
-        WHERE campaign_id = ? AND status = 'PENDING'
+        SELECT * FROM dispatch_log
+        WHERE campaign_id = ? AND status = 'RETRY_SCHEDULED' AND next_attempt_at <= ?
+        ORDER BY next_attempt_at
+        LIMIT ?
+        """, (campaign_id, now or datetime.datetime.now(), limit))
+        return cursor.fetchall()
+    except sqlite3.Error as e:
+        print(f"Erro ao buscar reenvios agendados para campanha '{campaign_id}': {e}")
+        return []
+    finally:
+        conn.close()
+
+def get_next_retry_time(campaign_id):
+    """Horário (datetime) do próximo reenvio agendado da campanha, ou None se não houver."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+        SELECT MIN(next_attempt_at) AS next_attempt_at FROM dispatch_log
+        WHERE campaign_id = ? AND status = 'RETRY_SCHEDULED'
         """, (campaign_id,))
-        pending_dispatches = cursor.fetchall()
-        return pending_dispatches # Lista de objetos sqlite3.Row
+        row = cursor.fetchone()
+        if not row or row['next_attempt_at'] is None:
+            return None
+        return datetime.datetime.fromisoformat(row['next_attempt_at'])
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Erro ao buscar próximo reenvio da campanha '{campaign_id}': {e}")
+        return None
+    finally:
+        conn.close()
+
+def claim_dispatch_batch(campaign_id, worker_id, batch_size, lease_seconds, now=None):
+    """
+    Reserva (lease) para `worker_id` até `batch_size` contatos prontos para envio da campanha:
+    PENDING ou RETRY_SCHEDULED já vencidos, sem reserva ou com reserva expirada.
+    A seleção e a reserva acontecem em uma transação BEGIN IMMEDIATE, então dois processos
+    nunca recebem o mesmo contato. Retorna a lista de registros reservados (DispatchRecord).
+    Contatos que entraram na lista de supressão depois de enfileirados são finalizados como
+    SUPPRESSED na mesma transação, em vez de reservados.
+    """
+    now = now or datetime.datetime.now()
+    lease_expires_at = now + datetime.timedelta(seconds=lease_seconds)
+    suppression_index = get_suppression_index() # Antes do BEGIN IMMEDIATE (a atualização usa a mesma conexão)
+    conn = get_db_connection()
+    conn.isolation_level = None # Controle manual da transação
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE") # Bloqueia outros escritores até o COMMIT
+        # Uma subconsulta por status para que cada uma percorra idx_dispatch_log_campaign_status já em ordem de log_id
+        cursor.execute("""
+        SELECT log_id FROM (
+            SELECT log_id FROM (
+                SELECT log_id FROM dispatch_log
+                WHERE campaign_id = ? AND status = 'PENDING'
+                  AND (lease_expires_at IS NULL OR lease_expires_at <= ?)
+                ORDER BY log_id LIMIT ?
+            )
+            UNION ALL
+            SELECT log_id FROM (
+                SELECT log_id FROM dispatch_log
+                WHERE campaign_id = ? AND status = 'RETRY_SCHEDULED' AND next_attempt_at <= ?
+                  AND (lease_expires_at IS NULL OR lease_expires_at <= ?)
+                ORDER BY log_id LIMIT ?
+            )
+        )
+        ORDER BY log_id
+        LIMIT ?
+        """, (campaign_id, now, batch_size, campaign_id, now, now, batch_size, batch_size))
+        log_ids = [row['log_id'] for row in cursor.fetchall()]
+        if not log_ids:
+            cursor.execute("COMMIT")
+            return []
+        placeholders = ','.join('?' for _ in log_ids)
+        cursor.execute(f"""
+        UPDATE dispatch_log SET lease_owner = ?, lease_expires_at = ?
+        WHERE log_id IN ({placeholders})
+        """, [worker_id, lease_expires_at] + log_ids)
+        cursor.execute(f"SELECT {DISPATCH_RECORD_COLUMNS} FROM dispatch_log WHERE log_id IN ({placeholders}) ORDER BY log_id", log_ids)
+        claimed_dispatches = [DispatchRecord(*row) for row in cursor.fetchall()]
+        suppressed_ids = {record.log_id for record in claimed_dispatches if record.contact_phone in suppression_index}
+        if suppressed_ids:
+            cursor.executemany("""
+            UPDATE dispatch_log SET status = 'SUPPRESSED', sent_at = ?, lease_owner = NULL, lease_expires_at = NULL
+            WHERE log_id = ?
+            """, [(now, log_id) for log_id in suppressed_ids])
+            claimed_dispatches = [record for record in claimed_dispatches if record.log_id not in suppressed_ids]
+        cursor.execute("COMMIT")
+        return claimed_dispatches
     except sqlite3.Error as e:
-        print(f"Erro ao buscar disparos pendentes para campanha '{campaign_id}': {e}")
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        print(f"Erro ao reservar disparos da campanha '{campaign_id}' para '{worker_id}': {e}")
+        return []
+    finally:
+        conn.close()
+
+def renew_dispatch_leases(worker_id, log_ids, lease_seconds, now=None):
+    """Prolonga as reservas ainda mantidas por `worker_id`. Retorna quantas foram renovadas."""
+    if not log_ids:
+        return 0
+    lease_expires_at = (now or datetime.datetime.now()) + datetime.timedelta(seconds=lease_seconds)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        placeholders = ','.join('?' for _ in log_ids)
+        cursor.execute(f"""
+        UPDATE dispatch_log SET lease_expires_at = ?
+        WHERE lease_owner = ? AND log_id IN ({placeholders})
+        """, [lease_expires_at, worker_id] + list(log_ids))
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        print(f"Erro ao renovar reservas de '{worker_id}': {e}")
+        return 0
+    finally:
+        conn.close()
+
+def release_dispatch_leases(worker_id, campaign_id=None, log_ids=None):
+    """
+    Devolve (sem alterar o status) os contatos reservados por `worker_id`, opcionalmente só de uma
+    campanha ou só os `log_ids` informados.
+    """
+    if log_ids is not None and not log_ids:
+        return 0
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        query = "UPDATE dispatch_log SET lease_owner = NULL, lease_expires_at = NULL WHERE lease_owner = ?"
+        params = [worker_id]
+        if campaign_id is not None:
+            query += " AND campaign_id = ?"
+            params.append(campaign_id)
+        if log_ids is not None:
+            query += f" AND log_id IN ({','.join('?' for _ in log_ids)})"
+            params.extend(log_ids)
+        cursor.execute(query, params)
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        print(f"Erro ao liberar reservas de '{worker_id}': {e}")
+        return 0
+    finally:
+        conn.close()
+
+def get_next_claim_time(campaign_id):
+    """
+    Próximo momento (datetime) em que algum contato em aberto da campanha poderá ser reservado:
+    o vencimento de um reenvio agendado ou a expiração da reserva de outro worker.
+    Retorna None se a campanha não tiver contatos em aberto.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+        SELECT COUNT(*) AS open_count,
+               MIN(MAX(COALESCE(lease_expires_at, ''),
+                       CASE WHEN status = 'RETRY_SCHEDULED' THEN COALESCE(next_attempt_at, '') ELSE '' END)) AS claimable_at
+        FROM dispatch_log
+        WHERE campaign_id = ? AND status IN ('PENDING', 'RETRY_SCHEDULED')
+        """, (campaign_id,))
+        row = cursor.fetchone()
+        if not row or row['open_count'] == 0:
+            return None
+        if not row['claimable_at']:
+            return datetime.datetime.now() # Já existe contato disponível
+        return datetime.datetime.fromisoformat(row['claimable_at'])
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Erro ao buscar próxima reserva possível da campanha '{campaign_id}': {e}")
+        return None
+    finally:
+        conn.close()
+
+def count_dispatches_by_status(campaign_id, sent_since=None):
+    """
+    Quantidade de disparos da campanha por status, ex: {'SENT_SUCCESS': 10, 'PENDING': 3}.
+    Sem `sent_since`, lê os contadores de campaign_stats (sem percorrer o dispatch_log).
+    Com `sent_since`, conta apenas os registros atualizados (sent_at) a partir desse momento.
+    """
+    if sent_since is None:
+        return get_campaign_stats(campaign_id)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+        SELECT status, COUNT(*) AS total FROM dispatch_log
+        WHERE campaign_id = ? AND sent_at >= ?
+        GROUP BY status
+        """, (campaign_id, sent_since))
+        return {row['status']: row['total'] for row in cursor.fetchall()}
+    except sqlite3.Error as e:
+        print(f"Erro ao contar disparos por status da campanha '{campaign_id}': {e}")
+        return {}
+    finally:
+        conn.close()
+
+def get_campaign_stats(campaign_id):
+    """Contadores da campanha por status (campaign_stats), ex: {'SENT_SUCCESS': 10, 'PENDING': 3}."""
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            "SELECT status, total FROM campaign_stats WHERE campaign_id = ? AND total > 0", (campaign_id,)
+        ).fetchall()
+        return {row['status']: row['total'] for row in rows}
+    except sqlite3.Error as e:
+        print(f"Erro ao ler os contadores da campanha '{campaign_id}': {e}")
+        return {}
+    finally:
+        conn.close()
+
+def get_all_campaign_stats():
+    """Contadores de todas as campanhas em uma consulta: {campaign_id: {status: total}}."""
+    conn = get_db_connection()
+    try:
+        stats = {}
+        for row in conn.execute("SELECT campaign_id, status, total FROM campaign_stats WHERE total > 0"):
+            stats.setdefault(row['campaign_id'], {})[row['status']] = row['total']
+        return stats
+    except sqlite3.Error as e:
+        print(f"Erro ao ler os contadores das campanhas: {e}")
+        return {}
+    finally:
+        conn.close()
+
+def rebuild_campaign_stats(campaign_id=None):
+    """
+    Reconstrói campaign_stats a partir do dispatch_log (todas as campanhas ou só `campaign_id`),
+    corrigindo contadores que tenham divergido (ex: alteração manual no banco com os triggers desativados).
+    Campanhas arquivadas mantêm os contadores gravados no arquivamento.
+    Retorna a lista de divergências corrigidas [(campaign_id, status, antes, depois)] ou None em caso de erro.
+    """
+    conn = get_db_connection()
+    conn.isolation_level = None # Controle manual da transação
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE") # Nenhum disparo muda de status durante a reconstrução
+        where, params = ("WHERE campaign_id = ?", (campaign_id,)) if campaign_id is not None else ("", ())
+        cursor.execute(f"SELECT campaign_id, status, total FROM campaign_stats {where}", params)
+        before = {(row['campaign_id'], row['status']): row['total'] for row in cursor.fetchall()}
+        _fill_campaign_stats(cursor, campaign_id, keep_archived=True)
+        cursor.execute(f"SELECT campaign_id, status, total FROM campaign_stats {where}", params)
+        after = {(row['campaign_id'], row['status']): row['total'] for row in cursor.fetchall()}
+        cursor.execute("COMMIT")
+    except sqlite3.Error as e:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        print(f"Erro ao reconstruir os contadores das campanhas: {e}")
+        return None
+    finally:
+        conn.close()
+    return [
+        (key[0], key[1], before.get(key, 0), after.get(key, 0))
+        for key in sorted(set(before) | set(after))
+        if before.get(key, 0) != after.get(key, 0)
+    ]
+
+def compact_dispatch_log(batch_size=DISPATCH_ENQUEUE_CHUNK_SIZE):
+    """
+    Converte registros gravados no formato antigo (api_response em texto, personalized_message_text)
+    para o formato compacto de dispatch_log_format, em transações de `batch_size` registros.
+    O texto personalizado só é descartado quando é igual ao reconstruído a partir do template.
+    Retorna a quantidade de registros convertidos ou None em caso de erro. O espaço liberado volta ao
+    sistema de arquivos com o vacuum incremental (python -m backend.archive_manager --vacuum-only).
+    """
+    conn = get_db_connection()
+    compacted = 0
+    last_log_id = 0
+    try:
+        while True:
+            rows = conn.execute("""
+            SELECT d.log_id, d.status, d.contact_name, d.personalized_message_text, d.api_response, c.message_template
+            FROM dispatch_log d LEFT JOIN campaigns c ON c.campaign_id = d.campaign_id
+            WHERE d.log_id > ? AND (d.api_response IS NOT NULL OR d.personalized_message_text IS NOT NULL)
+            ORDER BY d.log_id
+            LIMIT ?
+            """, (last_log_id, batch_size)).fetchall()
+            if not rows:
+                return compacted
+            updates = []
+            for row in rows:
+                personalized_message_text = row['personalized_message_text']
+                if row['message_template'] is not None and personalized_message_text == \
+                        dispatch_log_format.personalize_message(row['message_template'], row['contact_name']):
+                    personalized_message_text = None
+                updates.append((
+                    personalized_message_text, *dispatch_log_format.encode_api_response(row['api_response'], row['status']),
+                    row['log_id']
+                ))
+            conn.executemany("""
+            UPDATE dispatch_log SET personalized_message_text = ?, api_response = NULL,
+                api_message_id = ?, api_ack = ?, api_error_code = ?, api_response_compressed = ?
+            WHERE log_id = ?
+            """, updates)
+            conn.commit()
+            compacted += len(rows)
+            last_log_id = rows[-1]['log_id']
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Erro ao compactar o log de disparos: {e}")
+        return None
+    finally:
+        conn.close()
+
+def get_dispatch_updates_since(campaign_id, since, after_log_id=0, limit=200):
+    """
+    Registros da campanha atualizados depois do cursor (`since`, `after_log_id`), em ordem de (sent_at, log_id)
+    (dicts, com 'api_response' em texto). Paginação keyset: quem lê guarda o sent_at e o log_id do último
+    registro recebido, para não perder os que têm o mesmo sent_at (ex: lotes gravados juntos pelo
+    DispatchStatusWriter) quando a página termina no meio deles.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # (campaign_id, sent_at) + log_id (rowid) do índice idx_dispatch_log_campaign_sent_at já estão nessa ordem
+        cursor.execute(f"""
+        SELECT log_id, contact_phone, contact_name, status, retry_count, sent_at, {DISPATCH_RESULT_COLUMNS}
+        FROM dispatch_log
+        WHERE campaign_id = ? AND (sent_at, log_id) > (?, ?)
+        ORDER BY sent_at, log_id
+        LIMIT ?
+        """, (campaign_id, since, after_log_id, limit))
+        return [dispatch_result_dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Erro ao buscar atualizações de disparos da campanha '{campaign_id}': {e}")
+        return []
+    finally:
+        conn.close()
+
+def count_open_dispatches(campaign_id):
+    """Quantidade de disparos ainda não finalizados (PENDING ou RETRY_SCHEDULED) da campanha (via campaign_stats)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+        SELECT COALESCE(SUM(total), 0) FROM campaign_stats
+        WHERE campaign_id = ? AND status IN ('PENDING', 'RETRY_SCHEDULED')
+        """, (campaign_id,))
+        return cursor.fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"Erro ao contar disparos em aberto da campanha '{campaign_id}': {e}")
+        return 0
+    finally:
+        conn.close()
+
+# --- Lista de supressão (opt-out) ---
+# Telefones que não podem receber mensagens de nenhuma campanha. As consultas do envio usam o
+# índice em memória (get_suppression_index), atualizado a partir de suppression_changes.
+
+_suppression_index = SuppressionIndex() # Compartilhado pelas threads do processo
+
+def add_suppressed_phones(phones, reason=None, source=None, chunk_size=DISPATCH_ENQUEUE_CHUNK_SIZE):
+    """
+    Inclui telefones (já normalizados) na lista de supressão, em uma única transação.
+    Números já suprimidos são ignorados. Retorna quantos foram incluídos, ou None em caso de erro.
+    Este processo passa a ignorar os números imediatamente; os demais workers, em até SUPPRESSION_REFRESH_SECONDS.
+    """
+    now = datetime.datetime.now()
+    rows = ((phone.strip(), reason, source, now) for phone in phones if phone and phone.strip())
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    added = 0
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            cursor.executemany("""
+            INSERT OR IGNORE INTO suppressed_phones (phone, reason, source, created_at)
+            VALUES (?, ?, ?, ?)
+            """, chunk)
+            added += cursor.rowcount
+        conn.commit()
+        _suppression_index.invalidate()
+        return added
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Erro ao incluir telefones na lista de supressão: {e}. Nenhum telefone foi incluído.")
+        return None
+    finally:
+        conn.close()
+
+def remove_suppressed_phones(phones):
+    """Retira telefones da lista de supressão. Retorna quantos foram retirados, ou None em caso de erro."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("DELETE FROM suppressed_phones WHERE phone = ?",
+                           ((phone.strip(),) for phone in phones if phone and phone.strip()))
+        removed = cursor.rowcount
+        conn.commit()
+        _suppression_index.invalidate()
+        return removed
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Erro ao retirar telefones da lista de supressão: {e}")
+        return None
+    finally:
+        conn.close()
+
+def count_suppressed_phones():
+    """Quantidade de telefones na lista de supressão."""
+    conn = get_db_connection()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM suppressed_phones").fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"Erro ao contar a lista de supressão: {e}")
+        return 0
+    finally:
+        conn.close()
+
+def iter_suppressed_phones(page_size=DISPATCH_PAGE_SIZE):
+    """
+    Percorre a lista de supressão em ordem de telefone (páginas keyset de `page_size`, para exportação).
+    Gera dicts com 'phone', 'reason', 'source' e 'created_at'.
+    """
+    last_phone = ''
+    while True:
+        conn = get_db_connection()
+        try:
+            rows = conn.execute("""
+            SELECT phone, reason, source, created_at FROM suppressed_phones
+            WHERE phone > ? ORDER BY phone LIMIT ?
+            """, (last_phone, page_size)).fetchall()
+        except sqlite3.Error as e:
+            print(f"Erro ao ler a lista de supressão: {e}")
+            return
+        finally:
+            conn.close()
+        for row in rows:
+            yield dict(row)
+        if len(rows) < page_size:
+            return
+        last_phone = rows[-1]['phone']
+
+def get_suppression_index(max_age_seconds=SUPPRESSION_REFRESH_SECONDS):
+    """
+    Índice em memória da lista de supressão (suppression_index.SuppressionIndex), atualizado se a
+    última leitura tiver mais de `max_age_seconds` (0 = sempre). A primeira chamada do processo lê a
+    lista inteira; as seguintes, só as alterações posteriores em suppression_changes.
+    Não chame com uma transação aberta na thread: a atualização usa a conexão persistente.
+    """
+    index = _suppression_index
+    if not index.is_stale(max_age_seconds):
+        return index
+    with index.lock:
+        if not index.is_stale(max_age_seconds): # Outra thread acabou de atualizar
+            return index
+        conn = get_db_connection()
+        conn.isolation_level = None # Controle manual da transação
+        cursor = conn.cursor()
+        try:
+            if not index.loaded:
+                cursor.execute("BEGIN") # A lista e o último change_id lidos no mesmo instante
+                last_change_id = cursor.execute("SELECT COALESCE(MAX(change_id), 0) FROM suppression_changes").fetchone()[0]
+                phones = [row[0] for row in cursor.execute("SELECT phone FROM suppressed_phones")]
+                cursor.execute("COMMIT")
+                index.load(phones, last_change_id)
+            else:
+                while True:
+                    changes = cursor.execute("""
+                    SELECT change_id, phone, action FROM suppression_changes
+                    WHERE change_id > ? ORDER BY change_id LIMIT ?
+                    """, (index.last_change_id, SUPPRESSION_CHANGES_PAGE_SIZE)).fetchall()
+                    index.apply_changes(changes)
+                    if len(changes) < SUPPRESSION_CHANGES_PAGE_SIZE:
+                        break
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            print(f"Erro ao atualizar a lista de supressão: {e}")
+        finally:
+            conn.close()
+    return index
+
+def is_phone_suppressed(phone):
+    """True se o telefone está na lista de supressão (consulta o índice em memória)."""
+    return phone in get_suppression_index()
+
+# --- Estado publicado pelos workers de disparo (session_rates/worker_stats) ---
+
+SESSION_RATE_COLUMNS = ('rate', 'effective_rate', 'sends_per_minute', 'warmup_progress', 'connected', 'successes',
+                        'failures', 'decreases')
+
+def save_session_rates(worker_id, snapshots, now=None):
+    """
+    Grava o estado atual do controle de taxa das sessões de `worker_id` (lista de
+    AdaptiveRateController.snapshot()), substituindo a linha anterior de cada sessão.
+    """
+    if not snapshots:
+        return
+    now = now or datetime.datetime.now()
+    conn = get_db_connection()
+    try:
+        conn.executemany(f"""
+        INSERT OR REPLACE INTO session_rates (session_name, worker_id, {', '.join(SESSION_RATE_COLUMNS)}, updated_at)
+        VALUES ({','.join('?' for _ in range(len(SESSION_RATE_COLUMNS) + 3))})
+        """, [[snapshot['session'], worker_id] + [snapshot[column] for column in SESSION_RATE_COLUMNS] + [now]
+              for snapshot in snapshots])
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Erro ao gravar a taxa das sessões de '{worker_id}': {e}")
+    finally:
+        conn.close()
+
+def get_session_rates(max_age_seconds=WORKER_STATS_MAX_AGE_SECONDS, now=None):
+    """
+    Taxa de envios das sessões publicada pelos workers nos últimos `max_age_seconds` (sessões de
+    workers parados ficam de fora). Lista de dicts no formato de AdaptiveRateController.snapshot(),
+    com 'worker_id' e 'updated_at', em ordem de sessão.
+    """
+    oldest = (now or datetime.datetime.now()) - datetime.timedelta(seconds=max_age_seconds)
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(f"""
+        SELECT session_name AS session, worker_id, {', '.join(SESSION_RATE_COLUMNS)}, updated_at FROM session_rates
+        WHERE updated_at >= ? ORDER BY session_name
+        """, (oldest,)).fetchall()
+        return [dict(row, connected=bool(row['connected'])) for row in rows]
+    except sqlite3.Error as e:
+        print(f"Erro ao ler a taxa das sessões: {e}")
+        return []
+    finally:
+        conn.close()
+
+def save_worker_stats(worker_id, client_stats, media_cache_stats, now=None):
+    """
+    Grava as estatísticas do WppClient e do cache de imagens de `worker_id` e apaga as de workers
+    que pararam de publicar há mais de WORKER_STATS_MAX_AGE_SECONDS (cada execução tem um id novo).
+    """
+    now = now or datetime.datetime.now()
+    conn = get_db_connection()
+    try:
+        conn.execute("DELETE FROM worker_stats WHERE updated_at < ?",
+                     (now - datetime.timedelta(seconds=WORKER_STATS_MAX_AGE_SECONDS),))
+        conn.execute("""
+        INSERT OR REPLACE INTO worker_stats (worker_id, client_stats, media_cache_stats, updated_at) VALUES (?, ?, ?, ?)
+        """, (worker_id, json.dumps(client_stats), json.dumps(media_cache_stats), now))
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Erro ao gravar as estatísticas de '{worker_id}': {e}")
+    finally:
+        conn.close()
+
+def get_worker_stats(max_age_seconds=WORKER_STATS_MAX_AGE_SECONDS, now=None):
+    """
+    Estatísticas publicadas pelos workers nos últimos `max_age_seconds`: lista de dicts com
+    'worker_id', 'updated_at', 'client' (WppClient.stats()) e 'media_cache' (MediaPayloadCache.stats()).
+    """
+    oldest = (now or datetime.datetime.now()) - datetime.timedelta(seconds=max_age_seconds)
+    conn = get_db_connection()
+    try:
+        rows = conn.execute("""
+        SELECT worker_id, client_stats, media_cache_stats, updated_at FROM worker_stats
+        WHERE updated_at >= ? ORDER BY worker_id
+        """, (oldest,)).fetchall()
+        return [{
+            'worker_id': row['worker_id'],
+            'updated_at': row['updated_at'],
+            'client': json.loads(row['client_stats']),
+            'media_cache': json.loads(row['media_cache_stats']),
+        } for row in rows]
+    except sqlite3.Error as e:
+        print(f"Erro ao ler as estatísticas dos workers: {e}")
         return []
     finally:
         conn.close()
@@ -176,9 +1730,77 @@ def get_campaigns_with_status(status_list=['PENDING', 'IN_PROGRESS', 'PAUSED']):
         conn.close()
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Manutenção do banco de dados do StoreBot.")
+    parser.add_argument("--rebuild-stats", nargs="?", const="", metavar="CAMPAIGN_ID",
+                        help="Reconstrói os contadores (campaign_stats) a partir do dispatch_log; sem ID, de todas as campanhas.")
+    parser.add_argument("--compact-log", action="store_true",
+                        help="Converte os registros antigos do dispatch_log para o formato compacto (dispatch_log_format).")
+    parser.add_argument("--suppress", nargs="+", metavar="TELEFONE",
+                        help="Inclui telefones na lista de supressão (opt-out).")
+    parser.add_argument("--unsuppress", nargs="+", metavar="TELEFONE",
+                        help="Retira telefones da lista de supressão.")
+    parser.add_argument("--import-suppression", metavar="CSV",
+                        help="Importa para a lista de supressão a coluna 'telefone' de um CSV (',' ou ';').")
+    parser.add_argument("--export-suppression", metavar="CSV",
+                        help="Exporta a lista de supressão para um CSV (telefone, motivo, origem, incluido_em).")
+    parser.add_argument("--reason", default="SAIR", help="Motivo gravado com --suppress/--import-suppression.")
+    args = parser.parse_args()
+
     print("Executando create_tables para garantir que o schema está atualizado...")
     create_tables()
-    print("Schema do banco de dados verificado/atualizado.")
+    print(f"Schema do banco de dados verificado/atualizado (versão {get_schema_version()}).")
+
+    if args.rebuild_stats is not None:
+        fixed = rebuild_campaign_stats(args.rebuild_stats or None)
+        if fixed is None:
+            sys.exit(1)
+        for campaign_id, status, stored_total, actual_total in fixed:
+            print(f"Contador corrigido: campanha '{campaign_id}', {status}: {stored_total} -> {actual_total}")
+        print(f"Contadores reconstruídos. {len(fixed)} divergência(s) corrigida(s).")
+
+    if args.compact_log:
+        compacted = compact_dispatch_log()
+        if compacted is None:
+            sys.exit(1)
+        print(f"{compacted} registro(s) convertido(s) para o formato compacto. "
+              "Para devolver o espaço ao disco: python -m backend.archive_manager --vacuum-only")
+
+    if args.suppress or args.unsuppress or args.import_suppression:
+        from backend import csv_processor, phone_normalizer
+        def normalized(phones):
+            for phone_str in phones:
+                phone, reason = phone_normalizer.normalize_phone(phone_str)
+                if phone:
+                    yield phone
+                else:
+                    print(f"Telefone ignorado ({reason}): {phone_str}")
+        if args.suppress:
+            added = add_suppressed_phones(normalized(args.suppress), reason=args.reason, source="console")
+            print(f"{added} telefone(s) incluído(s) na lista de supressão.")
+        if args.unsuppress:
+            removed = remove_suppressed_phones(normalized(args.unsuppress))
+            print(f"{removed} telefone(s) retirado(s) da lista de supressão.")
+        if args.import_suppression:
+            report = csv_processor.IngestReport(args.import_suppression)
+            added = add_suppressed_phones(csv_processor.iter_phones_from_csv(args.import_suppression, report),
+                                          reason=args.reason, source=os.path.basename(args.import_suppression))
+            print(report.summary())
+            if report.error or added is None:
+                sys.exit(1)
+            print(f"{added} telefone(s) novo(s) na lista de supressão ({report.accepted - added} repetido(s) ou já na lista).")
+        print(f"Lista de supressão: {count_suppressed_phones()} telefone(s).")
+
+    if args.export_suppression:
+        import csv
+        exported = 0
+        with open(args.export_suppression, mode='w', encoding='utf-8', newline='') as export_file:
+            writer = csv.writer(export_file)
+            writer.writerow(['telefone', 'motivo', 'origem', 'incluido_em'])
+            for row in iter_suppressed_phones():
+                writer.writerow([row['phone'], row['reason'] or '', row['source'] or '', row['created_at']])
+                exported += 1
+        print(f"{exported} telefone(s) exportado(s) para '{args.export_suppression}'.")
 
     # Bloco de teste opcional para as novas funções
     # test_campaign_id = "test_campaign_" + datetime.datetime.now().strftime("%Y%m%d%H%M%S")
@@ -0,0 +1,497 @@
+# dispatch_engine.py
+import asyncio
+import datetime
+import json
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from backend import database_manager
+from backend import wpp_connector
+from backend import retry_policy
+from backend.dispatch_log_format import personalize_message
+from backend.dispatch_status_writer import DispatchStatusWriter
+from backend.session_pool import SessionPool
+from backend.config import (
+    DISPATCH_CONCURRENCY,
+    DISPATCH_CLAIM_BATCH_SIZE,
+    DISPATCH_LEASE_SECONDS,
+    RETRY_POLL_SECONDS,
+    WORKER_STATS_PUBLISH_SECONDS,
+)
+
+FINAL_CAMPAIGN_STATUSES = ("COMPLETED", "COMPLETED_WITH_ERRORS", "FAILED")
+
+
+def new_worker_id():
+    """Identificador único do processo/execução usado nas reservas (lease) do dispatch_log."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def publish_worker_stats(worker_id, session_pool):
+    """
+    Grava no BD a taxa atual das sessões do pool (session_rates) e as estatísticas do WppClient e do
+    cache de imagens do processo (worker_stats): a interface web roda em outro processo e não enxerga
+    os controladores de taxa (rate_controller) nem o cliente HTTP dos workers.
+    """
+    database_manager.save_session_rates(worker_id, [session.rate_controller.snapshot() for session in session_pool.sessions])
+    database_manager.save_worker_stats(worker_id, wpp_connector.get_client().stats(), wpp_connector.get_media_cache().stats())
+
+
+def compute_final_status(success_count, failure_count):
+    """Define o status final da campanha a partir dos contadores de envio."""
+    if failure_count > 0 and success_count > 0:
+        return "COMPLETED_WITH_ERRORS"
+    if failure_count > 0 and success_count == 0:
+        return "FAILED" # Todas falharam
+    return "COMPLETED"
+
+
+def _send_and_record(client, session_name, dispatch_row, message_template, image_path, lease_owner=None,
+                     status_writer=None):
+    """
+    Executado em uma thread do pool: envia a mensagem de um contato pela sessão indicada
+    e grava o resultado no BD (só se o contato ainda estiver reservado para `lease_owner`).
+    Com `status_writer`, a gravação é entregue ao DispatchStatusWriter (em lote) e o resultado
+    volta com 'record_future' em vez de 'recorded' (ver _wait_recorded).
+    Se o envio falhar e a sessão não estiver mais conectada, nada é gravado e o resultado
+    volta com 'session_lost': True para que o contato seja redistribuído.
+    O texto personalizado não é gravado (é reconstruído a partir do template) e a resposta da API
+    vai no formato compacto de dispatch_log_format.
+    Um contato que entrou na lista de supressão depois de reservado não é enviado: é gravado como SUPPRESSED.
+    """
+    record = status_writer.submit if status_writer else database_manager.update_dispatch_log
+    log_id = dispatch_row['log_id']
+    contact_phone = dispatch_row['contact_phone']
+    contact_name = dispatch_row['contact_name'] if dispatch_row['contact_name'] else ""
+
+    if database_manager.is_phone_suppressed(contact_phone):
+        result = {'log_id': log_id, 'contact_phone': contact_phone, 'contact_name': contact_name,
+                  'session_name': session_name, 'session_lost': False, 'recorded': False, 'latency': 0.0,
+                  'status_code': None, 'invalid_input': False, 'api_response': None, 'status': "SUPPRESSED"}
+        _store_record(result, record(log_id, result['status'], lease_owner=lease_owner))
+        return result
+
+    personalized_message = personalize_message(message_template, contact_name)
+
+    started = time.perf_counter()
+    if image_path:
+        sent_successfully, api_response_data = wpp_connector.send_whatsapp_image_message(
+            contact_phone, image_path, personalized_message, client=client, session_name=session_name
+        )
+    else:
+        sent_successfully, api_response_data = wpp_connector.send_whatsapp_message(
+            contact_phone, personalized_message, client=client, session_name=session_name
+        )
+    latency = time.perf_counter() - started
+
+    result = {
+        'log_id': log_id,
+        'contact_phone': contact_phone,
+        'contact_name': contact_name,
+        'session_name': session_name,
+        'session_lost': False,
+        'recorded': False, # True quando o resultado foi gravado no BD
+        'latency': latency,
+        'status_code': api_response_data.get('status_code') if not sent_successfully else None,
+        # Falha nos dados do envio (ex: imagem inexistente): nada chegou à sessão
+        'invalid_input': not sent_successfully and api_response_data.get('kind') == wpp_connector.ERROR_KIND_INVALID_INPUT,
+    }
+
+    if not sent_successfully and not result['invalid_input']:
+        connected, session_data = wpp_connector.get_session_status(session_name, client=client)
+        if not connected:
+            result['session_lost'] = True
+            result['api_response'] = json.dumps(session_data, default=str)
+            return result
+
+    result['api_response'] = json.dumps(api_response_data, default=str)
+    if sent_successfully:
+        result['status'] = "SENT_SUCCESS"
+        _store_record(result, record(log_id, result['status'], api_response=api_response_data, lease_owner=lease_owner))
+        return result
+
+    # Falha transitória vira RETRY_SCHEDULED (com backoff); permanente vira SENT_FAILED; esgotada vira DEAD_LETTER
+    status, retry_count, next_attempt_at = retry_policy.plan_failure(api_response_data, dispatch_row['retry_count'] or 0)
+    result['status'] = status
+    result['retry_count'] = retry_count
+    result['next_attempt_at'] = next_attempt_at
+    _store_record(result, record(
+        log_id, status, api_response=api_response_data,
+        retry_count=retry_count, next_attempt_at=next_attempt_at, lease_owner=lease_owner
+    ))
+    return result
+
+
+def _store_record(result, recorded):
+    if isinstance(recorded, Future):
+        result['record_future'] = recorded
+    else:
+        result['recorded'] = recorded
+
+
+async def _wait_recorded(result):
+    """Espera o commit do resultado entregue ao DispatchStatusWriter. Só depois o envio conta como feito."""
+    record_future = result.pop('record_future', None)
+    if record_future is not None:
+        result['recorded'] = await asyncio.wrap_future(record_future)
+    return result['recorded']
+
+
+def _count_result(summary, session, result):
+    """Soma o resultado gravado de um envio aos contadores do resumo da campanha e da sessão."""
+    if result['status'] == "SUPPRESSED": # Nada foi enviado pela sessão
+        summary['processed'] += 1
+        summary['suppressed'] += 1
+        return
+    if result['status'] == "RETRY_SCHEDULED":
+        summary['retries_scheduled'] += 1
+        session.failed += 1
+        return
+    summary['processed'] += 1
+    if result['status'] == "SENT_SUCCESS":
+        summary['success'] += 1
+        session.sent += 1
+        return
+    summary['failed'] += 1
+    session.failed += 1
+    if result['status'] == "DEAD_LETTER":
+        summary['dead_letter'] += 1
+
+
+def finalize_campaign(campaign_id):
+    """
+    Se a campanha não tem mais contatos em aberto, grava o status final calculado com os totais
+    do BD (incluindo envios de outros workers). Retorna o status gravado ou None.
+    """
+    if database_manager.count_open_dispatches(campaign_id) > 0:
+        return None
+    status_counts = database_manager.count_dispatches_by_status(campaign_id)
+    status = compute_final_status(
+        status_counts.get("SENT_SUCCESS", 0), status_counts.get("SENT_FAILED", 0) + status_counts.get("DEAD_LETTER", 0)
+    )
+    database_manager.update_campaign_status(campaign_id, status)
+    return status
+
+
+async def _run_campaign_async(campaign_id, message_template, image_path, session_pool, concurrency,
+                              on_dispatch_start, on_dispatch_done, worker_id, claim_batch_size, lease_seconds):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency * len(session_pool.sessions),
+                                  thread_name_prefix=f"dispatch-{campaign_id}")
+    client = wpp_connector.get_client() # Um único cliente HTTP (pool keep-alive) compartilhado por todos os envios
+    status_writer = DispatchStatusWriter() # Resultados gravados em lote; o envio só conta depois do commit
+
+    try:
+        open_count = await loop.run_in_executor(executor, database_manager.count_open_dispatches, campaign_id)
+        summary = {'campaign_id': campaign_id, 'worker_id': worker_id, 'total': open_count, 'processed': 0,
+                   'success': 0, 'failed': 0, 'dead_letter': 0, 'retries_scheduled': 0, 'suppressed': 0,
+                   'remaining': open_count}
+        if open_count == 0:
+            return summary
+
+        queue = asyncio.Queue()
+        held_log_ids = set() # Contatos reservados por este worker (na fila ou em envio)
+        claim_lock = asyncio.Lock()
+
+        async def claim_more():
+            """Reserva mais um lote no BD (PENDING e reenvios vencidos) e coloca na fila."""
+            claimed = await loop.run_in_executor(
+                executor, database_manager.claim_dispatch_batch, campaign_id, worker_id, claim_batch_size, lease_seconds
+            )
+            for dispatch_row in claimed:
+                if dispatch_row['log_id'] not in held_log_ids:
+                    held_log_ids.add(dispatch_row['log_id'])
+                    queue.put_nowait(dispatch_row)
+
+        async def next_dispatch():
+            if queue.empty():
+                async with claim_lock: # Uma única reserva por vez, mesmo com várias workers sem trabalho
+                    if queue.empty():
+                        await claim_more()
+            try:
+                return queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return None
+
+        async def worker(session):
+            while session.healthy:
+                dispatch_row = await next_dispatch()
+                if dispatch_row is None:
+                    return
+                # Cada sessão tem seu próprio controle de taxa: a vazão cresce com o número de sessões conectadas
+                await session.rate_controller.acquire()
+                if not session.healthy: # Outra worker da mesma sessão detectou a desconexão
+                    queue.put_nowait(dispatch_row)
+                    return
+                if on_dispatch_start:
+                    on_dispatch_start(dispatch_row, summary)
+                result = await loop.run_in_executor(
+                    executor, _send_and_record, client, session.name, dispatch_row, message_template, image_path,
+                    worker_id, status_writer
+                )
+                if result['session_lost']:
+                    queue.put_nowait(dispatch_row) # Devolve o contato para outra sessão
+                    session_pool.mark_lost(session, result['api_response'])
+                    return
+                held_log_ids.discard(dispatch_row['log_id'])
+                if result['status'] != "SUPPRESSED" and not result['invalid_input']: # Só o que chegou ao servidor ajusta a taxa
+                    session.rate_controller.record_result(
+                        result['status'] == "SENT_SUCCESS", result['latency'], result['status_code']
+                    )
+                if not await _wait_recorded(result):
+                    continue # Reserva expirou e o contato passou para outro worker
+                _count_result(summary, session, result)
+                if result['status'] != "RETRY_SCHEDULED":
+                    summary['remaining'] -= 1
+                if on_dispatch_done:
+                    on_dispatch_done(result, summary)
+
+        await loop.run_in_executor(executor, session_pool.refresh_health, client)
+        workers = {}
+        last_renewal = time.monotonic()
+        while True:
+            # Reenvios vencidos e reservas expiradas de outros workers entram na mesma fila dos envios novos
+            if queue.empty():
+                async with claim_lock:
+                    await claim_more()
+            if held_log_ids and time.monotonic() - last_renewal >= lease_seconds / 3:
+                await loop.run_in_executor(
+                    executor, database_manager.renew_dispatch_leases, worker_id, list(held_log_ids), lease_seconds
+                )
+                last_renewal = time.monotonic()
+            running = [task for tasks in workers.values() for task in tasks if not task.done()]
+
+            if queue.empty() and not running:
+                next_claim_at = await loop.run_in_executor(executor, database_manager.get_next_claim_time, campaign_id)
+                if next_claim_at is None:
+                    break # Nada em aberto: nem pendentes, nem reenvios agendados, nem reservas de outros workers
+                seconds_to_next = (next_claim_at - datetime.datetime.now()).total_seconds()
+                await asyncio.sleep(min(RETRY_POLL_SECONDS, max(0.1, seconds_to_next)))
+                continue
+
+            if not queue.empty():
+                for session in session_pool.healthy_sessions():
+                    alive = [task for task in workers.get(session.name, []) if not task.done()]
+                    missing = concurrency - len(alive)
+                    alive.extend(asyncio.create_task(worker(session)) for _ in range(missing))
+                    workers[session.name] = alive
+                running = [task for tasks in workers.values() for task in tasks if not task.done()]
+                if not running:
+                    # Nenhuma sessão conectada: os contatos restantes continuam em aberto para retomada posterior
+                    print(f"Aviso: Nenhuma sessão conectada para continuar a campanha '{campaign_id}'.")
+                    break
+            await asyncio.wait(running, timeout=RETRY_POLL_SECONDS)
+
+        summary['remaining'] = await loop.run_in_executor(executor, database_manager.count_open_dispatches, campaign_id)
+        return summary
+    finally:
+        # Grava os resultados pendentes antes de liberar as reservas (senão a gravação seria recusada)
+        status_writer.close()
+        # Contatos reservados e não enviados voltam a ficar disponíveis imediatamente
+        database_manager.release_dispatch_leases(worker_id, campaign_id)
+        executor.shutdown(wait=True)
+
+
+def run_campaign(campaign_id, message_template, image_path=None, on_dispatch_start=None, on_dispatch_done=None,
+                 concurrency=DISPATCH_CONCURRENCY, session_pool=None, worker_id=None,
+                 claim_batch_size=DISPATCH_CLAIM_BATCH_SIZE, lease_seconds=DISPATCH_LEASE_SECONDS):
+    """
+    Processa os disparos pendentes de uma campanha dividindo-os entre as sessões conectadas
+    do pool. Cada sessão mantém até `concurrency` envios simultâneos, no ritmo definido pelo
+    seu AdaptiveRateController. Contatos de uma sessão que desconecta voltam para a
+    fila e são enviados pelas demais.
+
+    Os contatos são reservados no BD em lotes de `claim_batch_size` (claim_dispatch_batch),
+    com validade de `lease_seconds` renovada enquanto estão na fila. Assim vários processos
+    (ou um clique duplo em "iniciar") podem processar a mesma campanha sem envio duplicado,
+    e as reservas de um processo que caiu são assumidas pelos demais quando expiram.
+
+    Falhas transitórias são reagendadas (RETRY_SCHEDULED, ver retry_policy) e reenviadas
+    pela mesma fila assim que vencem, junto com os envios novos; a campanha só termina
+    quando não restam contatos PENDING, reenvios agendados nem contatos reservados por outros workers.
+
+    Os callbacks são chamados na thread do loop de eventos:
+      - on_dispatch_start(dispatch_row, summary) antes de cada envio;
+      - on_dispatch_done(result, summary) após o envio e o commit do resultado no BD (gravado em lote).
+
+    Ao final atualiza o status da campanha (calculado com os totais do BD, incluindo os
+    envios de outros workers) e retorna o resumo deste worker
+    {'campaign_id', 'worker_id', 'total', 'processed', 'success', 'failed', 'dead_letter', 'retries_scheduled',
+     'suppressed', 'remaining', 'status', 'sessions', 'http'}.
+    Se nenhuma sessão estiver conectada, os contatos restantes ficam em aberto e a campanha PAUSED.
+    """
+    if session_pool is None:
+        session_pool = SessionPool()
+    summary = asyncio.run(_run_campaign_async(
+        campaign_id, message_template, image_path, session_pool, max(1, concurrency),
+        on_dispatch_start, on_dispatch_done, worker_id or new_worker_id(), max(1, claim_batch_size), lease_seconds
+    ))
+    summary['sessions'] = session_pool.snapshot()
+    summary['http'] = wpp_connector.get_client().stats()
+    if summary['remaining'] > 0:
+        summary['status'] = "PAUSED"
+        database_manager.update_campaign_status(campaign_id, summary['status'])
+        return summary
+    if summary['total'] == 0:
+        # Nada pendente: mantém um status final já registrado (ex: retomada de campanha já concluída)
+        campaign = database_manager.get_campaign_details(campaign_id)
+        if campaign and campaign['status'] in FINAL_CAMPAIGN_STATUSES:
+            summary['status'] = campaign['status']
+            return summary
+    summary['status'] = finalize_campaign(campaign_id)
+    return summary
+
+
+async def _run_scheduled_async(session_pool, scheduler, concurrency, worker_id, claim_batch_size, lease_seconds,
+                               poll_seconds, on_dispatch_done):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency * len(session_pool.sessions) + 1,
+                                  thread_name_prefix="dispatch-scheduler")
+    client = wpp_connector.get_client()
+    status_writer = DispatchStatusWriter()
+    held_log_ids = set() # Contatos reservados por este worker (nas filas das campanhas ou em envio)
+    claim_lock = asyncio.Lock()
+
+    async def release_queued(campaign):
+        """Devolve ao BD os contatos reservados que ainda estavam na fila da campanha."""
+        log_ids = [dispatch_row['log_id'] for dispatch_row in campaign.queue]
+        campaign.queue.clear()
+        held_log_ids.difference_update(log_ids)
+        await loop.run_in_executor(executor, database_manager.release_dispatch_leases, worker_id, None, log_ids)
+
+    async def sync_campaigns():
+        campaign_rows = await loop.run_in_executor(executor, database_manager.get_campaigns_with_status, ['IN_PROGRESS'])
+        # Campanhas que saíram de IN_PROGRESS (ex: pausadas) e as que estão fora da janela de envio liberam seus contatos
+        for campaign in scheduler.sync(campaign_rows) + scheduler.outside_window():
+            await release_queued(campaign)
+        # Sessões que caíram voltam a receber envios assim que reconectarem
+        for session in session_pool.sessions:
+            if not session.healthy:
+                await loop.run_in_executor(executor, session_pool.check_session, session, client)
+
+    async def next_dispatch():
+        """Escolhe a campanha do próximo envio (CampaignScheduler) e retorna (campanha, contato) ou (None, None)."""
+        async with claim_lock:
+            while True:
+                campaign = scheduler.pick()
+                if campaign is None:
+                    return None, None
+                if not campaign.queue:
+                    claimed = await loop.run_in_executor(
+                        executor, database_manager.claim_dispatch_batch, campaign.campaign_id, worker_id,
+                        claim_batch_size, lease_seconds
+                    )
+                    if not claimed:
+                        next_claim_at = await loop.run_in_executor(
+                            executor, database_manager.get_next_claim_time, campaign.campaign_id
+                        )
+                        if next_claim_at is None:
+                            await loop.run_in_executor(executor, finalize_campaign, campaign.campaign_id)
+                            next_claim_at = datetime.datetime.now() + datetime.timedelta(seconds=poll_seconds)
+                        scheduler.mark_idle(campaign, next_claim_at)
+                        continue
+                    for dispatch_row in claimed:
+                        held_log_ids.add(dispatch_row['log_id'])
+                        campaign.queue.append(dispatch_row)
+                scheduler.charge(campaign)
+                return campaign, campaign.queue.popleft()
+
+    async def worker(session):
+        while session.healthy:
+            campaign, dispatch_row = await next_dispatch()
+            if campaign is None:
+                return
+            # A taxa da sessão é única: as campanhas dividem os envios dela, não os multiplicam
+            await session.rate_controller.acquire()
+            if not session.healthy or not campaign.in_window(datetime.datetime.now()):
+                campaign.queue.appendleft(dispatch_row)
+                return
+            result = await loop.run_in_executor(
+                executor, _send_and_record, client, session.name, dispatch_row, campaign.message_template,
+                campaign.image_path, worker_id, status_writer
+            )
+            if result['session_lost']:
+                campaign.queue.appendleft(dispatch_row) # Devolve o contato para outra sessão
+                session_pool.mark_lost(session, result['api_response'])
+                return
+            held_log_ids.discard(dispatch_row['log_id'])
+            if result['status'] != "SUPPRESSED" and not result['invalid_input']: # Só o que chegou ao servidor ajusta a taxa
+                session.rate_controller.record_result(
+                    result['status'] == "SENT_SUCCESS", result['latency'], result['status_code']
+                )
+            recorded = await _wait_recorded(result)
+            if not campaign.queue:
+                campaign.idle_until = None # Reavalia a campanha (pode ter terminado ou ter reenvios vencidos)
+            if not recorded:
+                continue
+            _count_result(campaign.summary, session, result)
+            if on_dispatch_done:
+                on_dispatch_done(campaign, result)
+
+    try:
+        await sync_campaigns()
+        await loop.run_in_executor(executor, session_pool.refresh_health, client)
+        workers = {}
+        last_sync = last_renewal = last_publish = time.monotonic()
+        await loop.run_in_executor(executor, publish_worker_stats, worker_id, session_pool)
+        while scheduler.campaigns:
+            if time.monotonic() - last_sync >= poll_seconds:
+                await sync_campaigns()
+                last_sync = time.monotonic()
+            if time.monotonic() - last_publish >= WORKER_STATS_PUBLISH_SECONDS:
+                await loop.run_in_executor(executor, publish_worker_stats, worker_id, session_pool)
+                last_publish = time.monotonic()
+            if held_log_ids and time.monotonic() - last_renewal >= lease_seconds / 3:
+                await loop.run_in_executor(
+                    executor, database_manager.renew_dispatch_leases, worker_id, list(held_log_ids), lease_seconds
+                )
+                last_renewal = time.monotonic()
+            running = [task for tasks in workers.values() for task in tasks if not task.done()]
+
+            if not scheduler.eligible():
+                if not running:
+                    # Tudo parado (fora da janela, reenvios futuros, contatos com outros workers): dorme até a próxima mudança
+                    next_wakeup = scheduler.next_wakeup() or datetime.datetime.now()
+                    seconds_to_wakeup = (next_wakeup - datetime.datetime.now()).total_seconds()
+                    await asyncio.sleep(min(poll_seconds, max(0.1, seconds_to_wakeup)))
+                    continue
+            else:
+                for session in session_pool.healthy_sessions():
+                    alive = [task for task in workers.get(session.name, []) if not task.done()]
+                    alive.extend(asyncio.create_task(worker(session)) for _ in range(concurrency - len(alive)))
+                    workers[session.name] = alive
+                running = [task for tasks in workers.values() for task in tasks if not task.done()]
+                if not running:
+                    print("Aviso: Nenhuma sessão conectada para continuar as campanhas agendadas.")
+                    break
+            await asyncio.wait(running, timeout=poll_seconds)
+        return {campaign_id: dict(campaign.summary) for campaign_id, campaign in scheduler.campaigns.items()}
+    finally:
+        # Contatos reservados e não enviados voltam a ficar disponíveis imediatamente
+        for campaign in scheduler.campaigns.values():
+            campaign.queue.clear()
+        status_writer.close()
+        database_manager.release_dispatch_leases(worker_id)
+        executor.shutdown(wait=True)
+
+
+def run_scheduled_campaigns(session_pool, scheduler, concurrency=DISPATCH_CONCURRENCY, worker_id=None,
+                            claim_batch_size=DISPATCH_CLAIM_BATCH_SIZE, lease_seconds=DISPATCH_LEASE_SECONDS,
+                            poll_seconds=RETRY_POLL_SECONDS, on_dispatch_done=None):
+    """
+    Processa ao mesmo tempo todas as campanhas IN_PROGRESS, dividindo os envios das sessões do
+    pool entre elas pelo CampaignScheduler (peso = prioridade, respeitando as janelas de envio).
+    O conjunto de campanhas, prioridades e janelas é relido do BD a cada `poll_seconds`.
+
+    Campanhas sem mais contatos em aberto são finalizadas (status pelos totais do BD).
+    Retorna quando não houver campanhas IN_PROGRESS ou nenhuma sessão conectada, com o resumo
+    acumulado de cada campanha ainda ativa: {campaign_id: {'processed', 'success', 'failed', ...}}.
+    on_dispatch_done(scheduled_campaign, result) é chamado após cada envio gravado.
+    """
+    return asyncio.run(_run_scheduled_async(
+        session_pool, scheduler, max(1, concurrency), worker_id or new_worker_id(), max(1, claim_batch_size),
+        lease_seconds, poll_seconds, on_dispatch_done
+    ))
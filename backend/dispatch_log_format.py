@@ -0,0 +1,91 @@
+# dispatch_log_format.py
+"""
+Formato compacto dos resultados de envio gravados no dispatch_log.
+
+A resposta do wppconnect tem alguns KB (o objeto da mensagem inteiro), mas só três campos são usados:
+o id da mensagem no WhatsApp, o ack e, nas falhas, o código HTTP. Eles vão para colunas próprias
+(api_message_id, api_ack, api_error_code); o resto da resposta é guardado comprimido
+(api_response_compressed) conforme DISPATCH_API_RESPONSE_STORAGE:
+
+    "compressed" - guarda todas as respostas (zlib)
+    "failures"   - guarda só as respostas de envios que falharam (as de sucesso não têm mais nada útil)
+    "none"       - não guarda a resposta, só as colunas
+
+O texto personalizado também não é mais gravado: ele é sempre o template da campanha com o nome do
+contato (personalize_message) e é reconstruído na leitura. Registros antigos, gravados com
+personalized_message_text/api_response em texto, continuam sendo lidos normalmente.
+"""
+import json
+import zlib
+
+from backend.config import (
+    DISPATCH_API_RESPONSE_STORAGE,
+    DISPATCH_API_RESPONSE_COMPRESSION_LEVEL,
+)
+
+API_RESPONSE_STORAGE_MODES = ("compressed", "failures", "none")
+
+
+def personalize_message(message_template, contact_name):
+    """Substitui {{nome}} no template pelo nome do contato (ou 'cliente' se não houver nome)."""
+    return message_template.replace("{{nome}}", contact_name if contact_name else "cliente").strip()
+
+
+def response_fields(api_response_data):
+    """
+    Extrai (message_id, ack, status_code) de uma resposta do wpp_connector (dict).
+    O envio bem-sucedido traz {"response": [{"id": ..., "ack": ...}]} (ou um objeto só, conforme a
+    versão do servidor); as falhas trazem "status_code" quando houve resposta HTTP.
+    """
+    if not isinstance(api_response_data, dict):
+        return None, None, None
+    message = api_response_data.get('response', api_response_data)
+    if isinstance(message, list):
+        message = message[0] if message else None
+    message_id = ack = None
+    if isinstance(message, dict):
+        message_id = message.get('id')
+        if isinstance(message_id, dict): # Algumas versões devolvem o id como objeto
+            message_id = message_id.get('_serialized')
+        ack = message.get('ack') if isinstance(message.get('ack'), int) else None
+    status_code = api_response_data.get('status_code')
+    return (str(message_id) if message_id else None), ack, (status_code if isinstance(status_code, int) else None)
+
+
+def encode_api_response(api_response, status, storage=DISPATCH_API_RESPONSE_STORAGE):
+    """
+    Converte a resposta da API (dict do wpp_connector ou texto JSON) nas colunas compactas do
+    dispatch_log. Retorna (api_message_id, api_ack, api_error_code, api_response_compressed).
+    """
+    if storage not in API_RESPONSE_STORAGE_MODES:
+        raise ValueError(f"DISPATCH_API_RESPONSE_STORAGE inválido: {storage!r} (use {', '.join(API_RESPONSE_STORAGE_MODES)}).")
+    if api_response is None:
+        return None, None, None, None
+    if isinstance(api_response, str):
+        text = api_response
+        try:
+            api_response_data = json.loads(api_response)
+        except ValueError:
+            api_response_data = None
+    else:
+        text = json.dumps(api_response, default=str, ensure_ascii=False)
+        api_response_data = api_response
+    message_id, ack, status_code = response_fields(api_response_data)
+    error_code = status_code if status != "SENT_SUCCESS" else None
+    keep = storage == "compressed" or (storage == "failures" and status != "SENT_SUCCESS")
+    compressed = zlib.compress(text.encode("utf-8"), DISPATCH_API_RESPONSE_COMPRESSION_LEVEL) if keep else None
+    return message_id, ack, error_code, compressed
+
+
+def api_response_text(api_response, api_response_compressed, api_message_id=None, api_ack=None, api_error_code=None):
+    """
+    Texto da resposta da API de um registro: o texto antigo (api_response), a resposta comprimida ou,
+    se ela não foi guardada, um resumo JSON montado com as colunas. None se não houver nada.
+    """
+    if api_response is not None:
+        return api_response
+    if api_response_compressed is not None:
+        return zlib.decompress(api_response_compressed).decode("utf-8")
+    summary = {key: value for key, value in (('id', api_message_id), ('ack', api_ack), ('status_code', api_error_code))
+               if value is not None}
+    return json.dumps(summary) if summary else None
@@ -0,0 +1,135 @@
+# dispatch_status_writer.py
+import datetime
+import threading
+import time
+from concurrent.futures import Future
+
+from backend import database_manager
+from backend.config import (
+    DISPATCH_STATUS_FLUSH_BATCH_SIZE,
+    DISPATCH_STATUS_FLUSH_INTERVAL_SECONDS,
+    DISPATCH_STATUS_FLUSH_MAX_ATTEMPTS,
+)
+
+
+class DispatchStatusWriter:
+    """
+    Grava os resultados de envio no dispatch_log em lotes ("group commit"), em uma thread própria.
+
+    submit() apenas enfileira o resultado e devolve um Future. Uma thread grava a fila em uma única
+    transação (update_dispatch_logs_batch) quando ela chega a `batch_size` resultados ou quando o
+    mais antigo espera `flush_interval` segundos, trocando um commit por envio por um commit por lote.
+
+    Garantia: o Future só é resolvido depois do COMMIT do lote (True = gravado, False = reserva
+    perdida ou lote descartado após `max_attempts` falhas). Quem só conta o envio como feito
+    (resumo, callbacks, painel) ao receber True nunca relata um envio que não está no BD.
+    close() grava o que restou na fila e consolida o WAL (checkpoint) antes de retornar.
+    Se o processo morrer antes disso, os contatos da fila continuam reservados no BD e voltam a ser
+    enviados quando a reserva expirar (no máximo `flush_interval` segundos de resultados).
+    """
+
+    def __init__(self, batch_size=DISPATCH_STATUS_FLUSH_BATCH_SIZE, flush_interval=DISPATCH_STATUS_FLUSH_INTERVAL_SECONDS,
+                 max_attempts=DISPATCH_STATUS_FLUSH_MAX_ATTEMPTS):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_attempts = max(1, max_attempts)
+        self._pending = [] # [(update, future)] na ordem de chegada
+        self._oldest_at = None # time.monotonic() do resultado mais antigo na fila
+        self._condition = threading.Condition()
+        self._closed = False
+        self._metrics = {'submitted': 0, 'recorded': 0, 'lost_leases': 0, 'dropped': 0, 'flushes': 0, 'flush_errors': 0}
+        self._thread = threading.Thread(target=self._run, name="dispatch-status-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, log_id, status, personalized_message_text=None, api_response=None,
+               retry_count=None, next_attempt_at=None, lease_owner=None):
+        """Enfileira um resultado (mesmos argumentos de update_dispatch_log). Retorna um Future[bool]."""
+        update = {
+            'log_id': log_id, 'status': status, 'personalized_message_text': personalized_message_text,
+            'api_response': api_response, 'retry_count': retry_count, 'next_attempt_at': next_attempt_at,
+            'lease_owner': lease_owner, 'sent_at': datetime.datetime.now(),
+        }
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("DispatchStatusWriter já foi encerrado.")
+            if not self._pending:
+                self._oldest_at = time.monotonic()
+            self._pending.append((update, future))
+            self._metrics['submitted'] += 1
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._condition.notify() # Começa a contar o intervalo, ou o lote já está cheio
+        return future
+
+    def flush(self):
+        """Pede a gravação imediata da fila e espera terminar."""
+        with self._condition:
+            futures = [future for _, future in self._pending]
+            self._oldest_at = 0.0 # Vence o intervalo
+            self._condition.notify()
+        for future in futures:
+            future.result()
+
+    def close(self):
+        """Grava tudo o que estiver na fila, encerra a thread e consolida o WAL. Pode ser chamado mais de uma vez."""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        database_manager.checkpoint_database()
+
+    def metrics(self):
+        with self._condition:
+            return dict(self._metrics, pending=len(self._pending))
+
+    def _next_batch(self):
+        """Espera até ter um lote para gravar (por tamanho, tempo ou encerramento). Retorna [] ao encerrar."""
+        with self._condition:
+            while True:
+                if self._pending:
+                    waited = time.monotonic() - self._oldest_at
+                    if self._closed or len(self._pending) >= self.batch_size or waited >= self.flush_interval:
+                        batch = self._pending[:self.batch_size]
+                        del self._pending[:self.batch_size]
+                        self._oldest_at = time.monotonic() if self._pending else None
+                        return batch
+                    self._condition.wait(self.flush_interval - waited)
+                elif self._closed:
+                    return []
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            self._write(batch)
+
+    def _write(self, batch):
+        updates = [update for update, _ in batch]
+        recorded = None
+        for attempt in range(1, self.max_attempts + 1):
+            recorded = database_manager.update_dispatch_logs_batch(updates)
+            if recorded is not None:
+                break
+            with self._condition:
+                self._metrics['flush_errors'] += 1
+            if attempt < self.max_attempts:
+                time.sleep(min(self.flush_interval * attempt, 5))
+
+        with self._condition:
+            self._metrics['flushes'] += 1
+            if recorded is None:
+                self._metrics['dropped'] += len(batch)
+            else:
+                self._metrics['recorded'] += sum(recorded)
+                self._metrics['lost_leases'] += len(batch) - sum(recorded)
+        if recorded is None:
+            print(f"ERRO: Não foi possível gravar {len(batch)} resultados de envio após {self.max_attempts} tentativas. "
+                  "Os contatos voltarão a ser enviados quando suas reservas expirarem.")
+            recorded = [False] * len(batch)
+        for (_, future), was_recorded in zip(batch, recorded):
+            future.set_result(was_recorded)
@@ -0,0 +1,133 @@
+# dispatch_worker.py
+"""
+Worker de disparos, independente do servidor web.
+
+A interface web apenas marca a campanha como IN_PROGRESS; este processo busca essas
+campanhas no BD e executa os envios, dividindo a taxa das sessões entre as campanhas
+simultâneas por prioridade e respeitando as janelas de horário (campaign_scheduler).
+Cada processo do pool cuida de um subconjunto das sessões WPPConnect (uma sessão nunca é
+usada por dois processos, para não somar as taxas de envio), e os contatos são divididos
+entre os processos pelas reservas (lease) do dispatch_log. Para aumentar a capacidade, adicione sessões e processos ou rode
+outro worker com --sessions diferentes.
+
+Uso:
+    python -m backend.dispatch_worker [--processes N] [--sessions Principal,Secundaria] [--poll 5]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from backend import database_manager
+from backend import dispatch_engine
+from backend.session_pool import SessionPool
+from backend.campaign_scheduler import CampaignScheduler
+from backend.config import (
+    WPPCONNECT_SESSION_NAMES,
+    DISPATCH_WORKER_PROCESSES,
+    DISPATCH_WORKER_POLL_SECONDS,
+    CAMPAIGN_IMAGES_FOLDER,
+)
+
+
+def split_sessions(session_names, processes):
+    """Divide as sessões entre os processos (round-robin). Nunca cria processo sem sessão."""
+    session_names = list(dict.fromkeys(session_names))
+    processes = max(1, min(processes, len(session_names)))
+    return [session_names[index::processes] for index in range(processes)]
+
+
+def resolve_campaign_image(image_filename):
+    """Caminho completo da imagem da campanha, ou None se não houver imagem ou o arquivo não existir."""
+    if not image_filename:
+        return None
+    image_path = os.path.join(CAMPAIGN_IMAGES_FOLDER, image_filename)
+    if not os.path.exists(image_path):
+        print(f"AVISO: Imagem da campanha '{image_filename}' não encontrada em {image_path}. Disparos seguirão sem imagem.")
+        return None
+    return image_path
+
+
+def report_dispatch(worker_id):
+    """Callback de run_scheduled_campaigns: mostra no log do worker cada envio concluído."""
+    def on_dispatch_done(campaign, result):
+        if result['status'] != "SENT_SUCCESS":
+            print(f"[{worker_id}] Campanha {campaign.campaign_id}: {result['status']} para {result['contact_phone']}")
+    return on_dispatch_done
+
+
+def worker_loop(session_names, poll_seconds=DISPATCH_WORKER_POLL_SECONDS):
+    """
+    Loop de um processo do pool: enquanto houver campanhas IN_PROGRESS, envia seus contatos pelas
+    sessões `session_names`. Campanhas simultâneas dividem a taxa das sessões de acordo com a
+    prioridade e só enviam dentro da sua janela de horário (CampaignScheduler).
+    """
+    worker_id = dispatch_engine.new_worker_id()
+    session_pool = SessionPool(session_names)
+    scheduler = CampaignScheduler(resolve_image=resolve_campaign_image)
+    print(f"[{worker_id}] Worker iniciado com as sessões: {', '.join(session_names)}")
+    while True:
+        if database_manager.get_campaigns_with_status(['IN_PROGRESS']):
+            if session_pool.refresh_health():
+                summaries = dispatch_engine.run_scheduled_campaigns(
+                    session_pool, scheduler, worker_id=worker_id, poll_seconds=poll_seconds,
+                    on_dispatch_done=report_dispatch(worker_id)
+                )
+                for summary in summaries.values():
+                    print(f"[{worker_id}] Campanha {summary['campaign_id']}: {summary['success']} sucesso, "
+                          f"{summary['failed']} falhas, {summary['retries_scheduled']} reenvios agendados até agora.")
+            else:
+                print(f"[{worker_id}] Nenhuma sessão conectada. Nova tentativa em {poll_seconds}s.")
+        dispatch_engine.publish_worker_stats(worker_id, session_pool) # Mantém a taxa das sessões visível na interface web
+        time.sleep(poll_seconds)
+
+
+def run_workers(session_names, processes, poll_seconds):
+    """Mantém `processes` processos rodando worker_loop, recriando os que terminarem com erro."""
+    session_groups = split_sessions(session_names, processes)
+    print(f"Iniciando {len(session_groups)} processo(s) de disparo: {session_groups}")
+    while True:
+        with ProcessPoolExecutor(max_workers=len(session_groups)) as executor:
+            futures = {executor.submit(worker_loop, group, poll_seconds): group for group in session_groups}
+            try:
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        group = futures.pop(future)
+                        try:
+                            future.result()
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as e:
+                            print(f"Worker das sessões {group} terminou com erro: {e}. Reiniciando...")
+                        futures[executor.submit(worker_loop, group, poll_seconds)] = group
+            except BrokenProcessPool:
+                print(f"Um processo de disparo foi encerrado inesperadamente. Reiniciando o pool em {poll_seconds}s...")
+        time.sleep(poll_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker de disparos do StoreBot (processa campanhas IN_PROGRESS).")
+    parser.add_argument("--processes", type=int, default=DISPATCH_WORKER_PROCESSES,
+                        help="Quantidade de processos (limitada ao número de sessões).")
+    parser.add_argument("--sessions", default=",".join(WPPCONNECT_SESSION_NAMES),
+                        help="Sessões WPPConnect usadas por este worker, separadas por vírgula.")
+    parser.add_argument("--poll", type=float, default=DISPATCH_WORKER_POLL_SECONDS,
+                        help="Segundos entre as buscas por campanhas IN_PROGRESS.")
+    args = parser.parse_args()
+
+    session_names = [name.strip() for name in args.sessions.split(",") if name.strip()]
+    if not session_names:
+        parser.error("Informe ao menos uma sessão em --sessions.")
+
+    database_manager.create_tables()
+    database_manager.close_db_connections() # Cada processo do pool abre a sua própria conexão
+    try:
+        run_workers(session_names, args.processes, args.poll)
+    except KeyboardInterrupt:
+        print("\nWorker de disparos encerrado. Contatos reservados e não enviados serão liberados quando as reservas expirarem.")
+
+
+if __name__ == '__main__':
+    main()
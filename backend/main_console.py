@@ -1,16 +1,21 @@
 # main_console.py
-import time
+"""
+Console do StoreBot: importa listas, cria e retoma campanhas (os envios ficam com o worker de disparos).
+
+Uso (da raiz do projeto):
+    python -m backend.main_console
+"""
 import datetime
 import uuid # Para gerar IDs de campanha únicos
 import os   # Para basename de arquivos
-import json # Para manipulação de JSON
-import database_manager
-import csv_processor
-import wpp_connector
-import auth_manager # Para garantir que o token está sendo gerenciado
-import session_manager # Importar o módulo que criamos ou onde colocamos as funções de sessão
+import shutil
+from backend import database_manager
+from backend import csv_processor
+from backend import dispatch_worker
+from backend import auth_manager # Para garantir que o token está sendo gerenciado
+from backend import session_manager # Importar o módulo que criamos ou onde colocamos as funções de sessão
 
-from config import DEFAULT_MESSAGE_DELAY_SECONDS
+from backend.config import CAMPAIGN_IMAGES_FOLDER
 
 def initialize_app():
     """Inicializa componentes necessários, como tabelas do BD e token JWT."""
@@ -29,6 +34,79 @@ def initialize_app():
         print("Token JWT já disponível.")
     return True
 
+def import_contact_list(csv_filepath):
+    """
+    Importa o CSV como lista de contatos no BD (lido e normalizado uma única vez). Um arquivo igual
+    a uma lista já importada reaproveita a lista sem reler o arquivo. Retorna o list_id ou None.
+    """
+    content_hash = csv_processor.file_content_hash(csv_filepath)
+    existing_list = database_manager.find_contact_list_by_hash(content_hash)
+    if existing_list:
+        print(f"Arquivo já importado como a lista '{existing_list['name']}' ({existing_list['contact_count']} contatos). Reaproveitando.")
+        return existing_list['list_id']
+
+    print("Lendo e validando o CSV...")
+    report = csv_processor.IngestReport(csv_filepath)
+    contacts = csv_processor.iter_contacts_from_csv( # Lido em streaming direto para o BD
+        csv_filepath, report, with_row_hashes=True,
+        progress=lambda progress: print(f"  ... {progress.rows_read} linhas lidas, {progress.accepted} contatos aceitos")
+    )
+    list_id, imported, _, duplicates = database_manager.import_contact_list(
+        os.path.basename(csv_filepath), contacts, source_filename=os.path.basename(csv_filepath), content_hash=content_hash
+    )
+    print(report.summary())
+    if list_id is not None and (report.error or not imported):
+        database_manager.delete_contact_list(list_id)
+        return None
+    if duplicates:
+        print(f"{duplicates} telefone(s) repetido(s) no arquivo; cada número foi guardado uma única vez.")
+    return list_id
+
+def update_contact_list():
+    """Atualiza uma lista importada com a nova versão do CSV, gravando só as linhas novas, alteradas ou removidas."""
+    print("\n--- Atualizar Lista de Contatos ---")
+    contact_lists = database_manager.get_contact_lists()
+    if not contact_lists:
+        print("Nenhuma lista de contatos importada.")
+        return
+    for contact_list in contact_lists:
+        print(f"{contact_list['list_id']}. {contact_list['name']} ({contact_list['contact_count']} contatos, arquivo atual: {contact_list['source_filename']})")
+    try:
+        contact_list = database_manager.get_contact_list(int(input("Número da lista a atualizar: ").strip()))
+    except ValueError:
+        print("Entrada inválida.")
+        return
+    if contact_list is None:
+        print("Lista não encontrada.")
+        return
+    csv_filepath = input("Caminho da nova versão do CSV: ").strip()
+    if not os.path.exists(csv_filepath):
+        print(f"Erro: Arquivo CSV '{csv_filepath}' não encontrado.")
+        return
+    delete_missing = input("Remover da lista os contatos que não estão no arquivo? (s/n): ").strip().lower() == 's'
+
+    content_hash = csv_processor.file_content_hash(csv_filepath)
+    if content_hash == contact_list['content_hash']:
+        print("O arquivo é igual à versão atual da lista. Nada a atualizar.")
+        return
+    known_row_hashes = database_manager.get_contact_row_hashes(contact_list['list_id'])
+    if known_row_hashes is None:
+        return
+    print("Comparando o CSV com a lista gravada...")
+    report = csv_processor.IngestReport(csv_filepath)
+    changed_contacts = list(csv_processor.iter_contacts_from_csv(csv_filepath, report, known_row_hashes=known_row_hashes))
+    print(report.summary())
+    if report.error or not (report.accepted or report.unchanged):
+        print("Nenhum contato válido no arquivo. A lista não foi alterada.")
+        return
+    summary = database_manager.reimport_contact_list(
+        contact_list['list_id'], changed_contacts, known_row_hashes, source_filename=os.path.basename(csv_filepath),
+        content_hash=content_hash, delete_missing=delete_missing
+    )
+    if summary['import_id'] is not None:
+        print(f"Lista atualizada (importação {summary['import_id']}): {summary['inserted']} novo(s), {summary['updated']} alterado(s), "
+              f"{summary['deleted']} removido(s), {summary['unchanged']} sem alteração.")
+
 def start_new_campaign():
     print("\n--- Iniciando Nova Campanha de Disparos ---")
     csv_filepath = input("Caminho do arquivo CSV de contatos (ex: contacts/lista.csv): ").strip()
@@ -43,118 +121,70 @@ def start_new_campaign():
 
     image_path_input = input("Caminho da imagem para enviar (opcional, deixe em branco se não houver): ").strip()
     image_filename_for_db = None
-    image_full_path_for_send = None
 
     if image_path_input:
         if not os.path.exists(image_path_input):
             print(f"Erro: Arquivo de imagem '{image_path_input}' não encontrado.")
             return
-        image_filename_for_db = os.path.basename(image_path_input)
-        image_full_path_for_send = image_path_input # Usaremos o caminho completo para envio
+        # Copiada para a pasta de imagens das campanhas (a mesma da interface web), onde o worker procura
+        original_filename, file_extension = os.path.splitext(os.path.basename(image_path_input))
+        image_filename_for_db = f"{original_filename}_{uuid.uuid4().hex[:8]}{file_extension}"
+        try:
+            os.makedirs(CAMPAIGN_IMAGES_FOLDER, exist_ok=True)
+            shutil.copyfile(image_path_input, os.path.join(CAMPAIGN_IMAGES_FOLDER, image_filename_for_db))
+        except OSError as e:
+            print(f"Erro ao copiar a imagem para '{CAMPAIGN_IMAGES_FOLDER}': {e}")
+            return
 
     # Gerar ID de campanha
     campaign_id = "camp_" + uuid.uuid4().hex[:12]
     csv_filename_for_db = os.path.basename(csv_filepath)
 
-    # Registrar campanha no BD
-    if not database_manager.add_campaign(campaign_id, csv_filename_for_db, message_template, image_filename_for_db):
-        print(f"Falha ao registrar a campanha '{campaign_id}' no banco de dados.")
-        return
-    
-    print(f"Campanha '{campaign_id}' registrada. Carregando contatos...")
-    contacts = csv_processor.load_contacts_from_csv(csv_filepath)
-
-    if not contacts:
+    list_id = import_contact_list(csv_filepath)
+    if list_id is None:
         print("Nenhum contato válido carregado do CSV. A campanha não pode prosseguir.")
-        database_manager.update_campaign_status(campaign_id, "FAILED_NO_CONTACTS") # Um novo status
         return
 
-    print(f"{len(contacts)} contatos carregados. Adicionando à fila de disparo...")
-    for contact in contacts:
-        database_manager.add_dispatch_contact(campaign_id, contact['telefone'], contact['nome'])
-    
-    print("Contatos adicionados à fila. Iniciando processamento da campanha...")
-    database_manager.update_campaign_status(campaign_id, "IN_PROGRESS")
-    process_campaign_dispatches(campaign_id, message_template, image_full_path_for_send)
-
-
-def process_campaign_dispatches(campaign_id, message_template, image_to_send_path=None):
-    """Processa os disparos pendentes para uma campanha."""
-    print(f"\n--- Processando Disparos para Campanha: {campaign_id} ---")
-    
-    pending_dispatches = database_manager.get_pending_dispatches_for_campaign(campaign_id)
-    if not pending_dispatches:
-        print("Nenhum disparo pendente encontrado para esta campanha.")
-        # Verificar se há falhas para decidir o status final
-        # (implementação mais completa de status pode ser feita depois)
-        database_manager.update_campaign_status(campaign_id, "COMPLETED")
+    # Registrar campanha no BD
+    if not database_manager.add_campaign(campaign_id, csv_filename_for_db, message_template, image_filename_for_db, list_id=list_id):
+        print(f"Falha ao registrar a campanha '{campaign_id}' no banco de dados.")
         return
-
-    total_pending = len(pending_dispatches)
-    print(f"Encontrados {total_pending} disparos pendentes.")
     
-    success_count = 0
-    failure_count = 0
-
-    for i, dispatch_row in enumerate(pending_dispatches):
-        log_id = dispatch_row['log_id']
-        contact_phone = dispatch_row['contact_phone']
-        contact_name = dispatch_row['contact_name'] if dispatch_row['contact_name'] else "" # Garantir que não é None
-
-        print(f"\nProcessando {i+1}/{total_pending}: Contato='{contact_name}', Telefone='{contact_phone}'")
-
-        # Personalizar mensagem
-        personalized_message = message_template.replace("{{nome}}", contact_name if contact_name else "cliente").strip()
-        
-        api_response_data = None
-        sent_successfully = False
-
-        if image_to_send_path:
-            print(f"Enviando mensagem com imagem: '{os.path.basename(image_to_send_path)}'...")
-            sent_successfully, api_response_data = wpp_connector.send_whatsapp_image_message(
-                contact_phone, 
-                image_to_send_path, 
-                personalized_message # Legenda é a própria mensagem personalizada
-            )
-        else:
-            print("Enviando mensagem de texto...")
-            sent_successfully, api_response_data = wpp_connector.send_whatsapp_message(
-                contact_phone, 
-                personalized_message
-            )
+    print(f"Campanha '{campaign_id}' registrada. Adicionando os contatos da lista à fila de disparo...")
+    inserted, rejected, duplicates, suppressed = database_manager.enqueue_contact_list(campaign_id, list_id)
+    if rejected:
+        print(f"Aviso: {rejected} contato(s) não foram adicionados à fila.")
+    if duplicates:
+        print(f"{duplicates} telefone(s) repetido(s) descartado(s); cada número recebe a mensagem uma única vez.")
+    if suppressed:
+        print(f"{suppressed} contato(s) na lista de supressão (opt-out) não foram adicionados à fila.")
+    if not inserted:
+        print("Nenhum contato foi adicionado à fila. A campanha não pode prosseguir.")
+        database_manager.update_campaign_status(campaign_id, "FAILED_NO_CONTACTS")
+        return
 
-        if sent_successfully:
-            success_count += 1
-            print(f"Sucesso! Resposta: {api_response_data}")
-            database_manager.update_dispatch_log(log_id, "SENT_SUCCESS", personalized_message, json.dumps(api_response_data))
-        else:
-            failure_count += 1
-            print(f"Falha! Detalhes: {api_response_data}")
-            database_manager.update_dispatch_log(log_id, "SENT_FAILED", personalized_message, json.dumps(api_response_data)) # Salva a mensagem mesmo em falha
+    print(f"{inserted} contatos adicionados à fila.")
+    queue_campaign(campaign_id)
 
-        # Delay entre mensagens
-        if i < total_pending - 1: # Não aplicar delay após a última mensagem
-            print(f"Aguardando {DEFAULT_MESSAGE_DELAY_SECONDS} segundos antes do próximo envio...")
-            time.sleep(DEFAULT_MESSAGE_DELAY_SECONDS)
 
-    print("\n--- Processamento da Campanha Concluído ---")
-    print(f"Resumo: {success_count} envios com sucesso, {failure_count} falhas.")
-    
-    final_status = "COMPLETED"
-    if failure_count > 0 and success_count > 0:
-        final_status = "COMPLETED_WITH_ERRORS"
-    elif failure_count > 0 and success_count == 0:
-        final_status = "FAILED" # Todas falharam
-    database_manager.update_campaign_status(campaign_id, final_status)
+def queue_campaign(campaign_id):
+    """
+    Coloca a campanha na fila do worker de disparos (status IN_PROGRESS), como faz a interface web.
+    O console não envia nada: o worker (backend/dispatch_worker.py) é o único processo que usa as
+    sessões, respeitando a taxa de cada número, a prioridade e a janela de envio das campanhas.
+    """
+    database_manager.update_campaign_status(campaign_id, "IN_PROGRESS")
+    print(f"Campanha '{campaign_id}' enviada para a fila de disparos.")
+    if not database_manager.get_worker_stats():
+        print("AVISO: Nenhum worker de disparos ativo no momento. Inicie com: python -m backend.dispatch_worker")
 
 def list_and_resume_campaign():
     print("\n--- Retomar Campanha Pendente ---")
-    # Listar campanhas que estão PENDING, IN_PROGRESS ou PAUSED (ou com falhas para retry - mais complexo)
-    # Por simplicidade, vamos listar as que têm status IN_PROGRESS ou PENDING
-    campaigns_to_resume = database_manager.get_campaigns_with_status(['IN_PROGRESS', 'PENDING'])
+    # Campanhas IN_PROGRESS já estão na fila do worker de disparos
+    campaigns_to_resume = database_manager.get_campaigns_with_status(['PENDING', 'PAUSED'])
     
     if not campaigns_to_resume:
-        print("Nenhuma campanha pendente ou em progresso para retomar.")
+        print("Nenhuma campanha pendente ou pausada para retomar.")
         return
 
     print("Campanhas disponíveis para retomar:")
@@ -172,26 +202,9 @@ def list_and_resume_campaign():
         
         selected_campaign_row = campaigns_to_resume[choice_idx]
         campaign_id_to_resume = selected_campaign_row['campaign_id']
-        
-        # Precisamos dos detalhes da campanha para a mensagem e imagem
-        # A função get_campaign_details poderia ser usada, mas já temos a linha.
-        message_template = selected_campaign_row['message_template']
-        image_filename = selected_campaign_row['image_filename']
-        image_full_path_for_send = None
-        if image_filename:
-            # Assumindo que as imagens das campanhas ficam na pasta 'images_to_send/'
-            # Ou poderíamos pedir o caminho da imagem novamente, ou armazenar o caminho completo no BD (menos portatil)
-            # Por agora, vamos assumir que a imagem precisa estar na pasta padrão.
-            potential_image_path = os.path.join("images_to_send", image_filename)
-            if os.path.exists(potential_image_path):
-                image_full_path_for_send = potential_image_path
-            else:
-                print(f"Aviso: Arquivo de imagem '{image_filename}' da campanha não encontrado em 'images_to_send/'. A campanha será retomada sem imagem.")
-
         print(f"Retomando campanha '{campaign_id_to_resume}'...")
-        if selected_campaign_row['status'] == 'PENDING': # Se estava pendente, marcar como em progresso
-             database_manager.update_campaign_status(campaign_id_to_resume, "IN_PROGRESS")
-        process_campaign_dispatches(campaign_id_to_resume, message_template, image_full_path_for_send)
+        dispatch_worker.resolve_campaign_image(selected_campaign_row['image_filename']) # Avisa se a imagem sumiu da pasta do worker
+        queue_campaign(campaign_id_to_resume)
 
     except ValueError:
         print("Entrada inválida.")
@@ -220,7 +233,8 @@ def main_menu():
         print("1. Iniciar Nova Campanha de Disparos")
         print("2. Retomar Campanha Pendente")
         print("3. Gerenciar Conexão WhatsApp") # Usaria funções do session_manager
-        print("4. Sair")
+        print("4. Atualizar Lista de Contatos")
+        print("5. Sair")
         choice = input("Escolha uma opção: ").strip()
 
         if choice == '1':
@@ -232,6 +246,8 @@ def main_menu():
             # Exemplo de submenu para session_manager:
             session_manager.manage_whatsapp_connection_menu() # Supondo que criamos essa função no session_manager
         elif choice == '4':
+            update_contact_list()
+        elif choice == '5':
             print("Saindo do StoreBot...")
             break
         else:
@@ -0,0 +1,123 @@
+# phone_normalizer.py
+"""
+Normalização e validação de telefones para envio pelo WhatsApp.
+
+Converte o que vem das listas ("(62) 99999-0001", "+55 62 9999-0001", "062999990001"...) para o
+formato E.164 sem o '+', que é o que o wppconnect espera (ex: "5562999990001"), e rejeita com um
+motivo os números que certamente falhariam no envio, gastando uma vaga do limite de taxa:
+
+    sem_telefone        - nenhum dígito
+    tamanho_invalido    - quantidade de dígitos que não forma um número do país (nem internacional com '+'/00)
+    ddd_invalido        - DDD que não existe no plano de numeração brasileiro
+    telefone_fixo       - número fixo (8 dígitos começando com 2-5), se PHONE_ACCEPT_LANDLINES for False
+    nono_digito_ausente - celular com 8 dígitos, se PHONE_ADD_MISSING_NINTH_DIGIT for False
+    numero_invalido     - número local que não é celular nem fixo
+
+Celulares antigos com 8 dígitos recebem o nono dígito e voltam com a observação 'nono_digito_adicionado'.
+Números com '+' ou 00 de outro país são aceitos só com a checagem de tamanho do E.164.
+
+As funções trabalham em lote (normalize_phones) para o csv_processor: a extração de dígitos usa
+uma tabela de tradução pré-calculada (bytes.translate, em C) em vez de uma regex por linha.
+"""
+from backend.config import (
+    PHONE_DEFAULT_COUNTRY_CODE,
+    PHONE_ADD_MISSING_NINTH_DIGIT,
+    PHONE_ACCEPT_LANDLINES,
+)
+
+# DDDs válidos (Anatel)
+BRAZIL_DDDS = frozenset({
+    11, 12, 13, 14, 15, 16, 17, 18, 19,
+    21, 22, 24, 27, 28,
+    31, 32, 33, 34, 35, 37, 38,
+    41, 42, 43, 44, 45, 46, 47, 48, 49,
+    51, 53, 54, 55,
+    61, 62, 63, 64, 65, 66, 67, 68, 69,
+    71, 73, 74, 75, 77, 79,
+    81, 82, 83, 84, 85, 86, 87, 88, 89,
+    91, 92, 93, 94, 95, 96, 97, 98, 99,
+})
+BRAZIL_COUNTRY_CODE = "55"
+E164_MIN_DIGITS = 8
+E164_MAX_DIGITS = 15
+
+_NON_DIGITS = bytes(byte for byte in range(256) if not 0x30 <= byte <= 0x39) # Tudo que não é '0'-'9'
+_VALID_DDDS = frozenset(str(ddd) for ddd in BRAZIL_DDDS)
+
+
+def phone_digits(phone_str):
+    """Só os dígitos ASCII de `phone_str` (tabela de tradução; outros caracteres são descartados)."""
+    return phone_str.encode("ascii", "ignore").translate(None, _NON_DIGITS).decode("ascii")
+
+
+def _brazilian_number(national, add_ninth_digit, accept_landlines):
+    """Valida DDD + número local (10 ou 11 dígitos). Retorna (número nacional, observação) ou (None, motivo)."""
+    if national[:2] not in _VALID_DDDS:
+        return None, 'ddd_invalido'
+    first_digit = national[2]
+    if len(national) == 11:
+        return (national, None) if first_digit == "9" else (None, 'numero_invalido')
+    if first_digit in "6789": # Celular no formato antigo, sem o nono dígito
+        if not add_ninth_digit:
+            return None, 'nono_digito_ausente'
+        return national[:2] + "9" + national[2:], 'nono_digito_adicionado'
+    if first_digit in "2345":
+        return (national, None) if accept_landlines else (None, 'telefone_fixo')
+    return None, 'numero_invalido'
+
+
+def normalize_phones(phones, default_country=PHONE_DEFAULT_COUNTRY_CODE, add_ninth_digit=PHONE_ADD_MISSING_NINTH_DIGIT,
+                     accept_landlines=PHONE_ACCEPT_LANDLINES):
+    """
+    Normaliza um lote de telefones (strings, None é aceito). Retorna uma lista, na mesma ordem, de
+    (telefone normalizado, observação): (None, motivo da rejeição) quando o número é rejeitado;
+    a observação é None quando o número já estava correto.
+    """
+    brazilian = default_country == BRAZIL_COUNTRY_CODE
+    country_length = len(default_country)
+    non_digits = _NON_DIGITS
+    results = []
+    append = results.append
+    for phone_str in phones:
+        if not phone_str:
+            append((None, 'sem_telefone'))
+            continue
+        digits = phone_str.encode("ascii", "ignore").translate(None, non_digits).decode("ascii")
+        if not digits:
+            append((None, 'sem_telefone'))
+            continue
+        international = phone_str.lstrip()[:1] == "+"
+        if digits[:2] == "00": # Prefixo de discagem internacional
+            digits = digits[2:]
+            international = True
+        elif digits[0] == "0": # Prefixo nacional (0 + DDD), com ou sem código de operadora (0 + XX + DDD)
+            digits = digits[1:]
+            if len(digits) in (12, 13):
+                digits = digits[2:]
+
+        if international:
+            if digits[:country_length] != default_country:
+                length_ok = E164_MIN_DIGITS <= len(digits) <= E164_MAX_DIGITS
+                append((digits, None) if length_ok else (None, 'tamanho_invalido'))
+                continue
+            national = digits[country_length:]
+        elif brazilian and len(digits) in (12, 13) and digits[:2] == BRAZIL_COUNTRY_CODE:
+            national = digits[2:]
+        else:
+            national = digits
+
+        if not brazilian:
+            length_ok = E164_MIN_DIGITS <= country_length + len(national) <= E164_MAX_DIGITS
+            append((default_country + national, None) if length_ok else (None, 'tamanho_invalido'))
+            continue
+        if len(national) not in (10, 11):
+            append((None, 'tamanho_invalido'))
+            continue
+        national, note = _brazilian_number(national, add_ninth_digit, accept_landlines)
+        append((BRAZIL_COUNTRY_CODE + national, note) if national else (None, note))
+    return results
+
+
+def normalize_phone(phone_str, **options):
+    """normalize_phones para um único número. Retorna (telefone normalizado, observação)."""
+    return normalize_phones([phone_str], **options)[0]
@@ -0,0 +1,182 @@
+# rate_controller.py
+import asyncio
+import random
+import threading
+import time
+
+from backend.config import (
+    RATE_INITIAL_SENDS_PER_SECOND,
+    RATE_MIN_SENDS_PER_SECOND,
+    RATE_MAX_SENDS_PER_SECOND,
+    RATE_BURST,
+    RATE_ADDITIVE_INCREASE,
+    RATE_MULTIPLICATIVE_DECREASE,
+    RATE_LATENCY_TARGET_SECONDS,
+    RATE_DECREASE_COOLDOWN_SECONDS,
+    RATE_WARMUP_SECONDS,
+    RATE_JITTER_FRACTION,
+)
+
+
+def is_congestion_signal(status_code):
+    """
+    Indica se a falha de envio sugere sobrecarga do servidor/sessão:
+    erro de conexão/timeout (sem status HTTP), 429 ou 5xx.
+    Falhas como número inválido (4xx) não devem reduzir a taxa.
+    """
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+class AdaptiveRateController:
+    """
+    Controle de taxa de envios de uma sessão WPPConnect.
+
+    - Token bucket: os envios consomem fichas repostas na taxa atual (capacidade `burst`).
+    - Aquecimento: uma sessão recém-conectada começa em `min_rate` e sobe linearmente
+      até a taxa atual ao longo de `warmup_seconds`.
+    - AIMD: cada envio rápido e bem-sucedido soma `additive_increase` envios/s por segundo
+      de envio saudável; falhas de sobrecarga (timeout, 429, 5xx) ou latência acima do alvo
+      multiplicam a taxa por `decrease_factor` (no máximo uma vez por `cooldown_seconds`).
+    - Jitter: cada espera ganha um atraso aleatório de até `jitter_fraction` do intervalo,
+      para que os envios não tenham um ritmo perfeitamente regular.
+
+    O estado é protegido por um threading.Lock (não depende de um loop asyncio específico),
+    então o mesmo controlador pode ser reaproveitado entre campanhas do processo.
+    """
+
+    def __init__(self, name, initial_rate=RATE_INITIAL_SENDS_PER_SECOND, min_rate=RATE_MIN_SENDS_PER_SECOND,
+                 max_rate=RATE_MAX_SENDS_PER_SECOND, burst=RATE_BURST, additive_increase=RATE_ADDITIVE_INCREASE,
+                 decrease_factor=RATE_MULTIPLICATIVE_DECREASE, latency_target=RATE_LATENCY_TARGET_SECONDS,
+                 cooldown_seconds=RATE_DECREASE_COOLDOWN_SECONDS, warmup_seconds=RATE_WARMUP_SECONDS,
+                 jitter_fraction=RATE_JITTER_FRACTION):
+        self.name = name
+        self.min_rate = min_rate
+        self.max_rate = max(min_rate, max_rate)
+        self.rate = min(self.max_rate, max(min_rate, initial_rate))
+        self.burst = max(1, burst)
+        self.additive_increase = additive_increase
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.cooldown_seconds = cooldown_seconds
+        self.warmup_seconds = warmup_seconds
+        self.jitter_fraction = jitter_fraction
+
+        self._lock = threading.Lock()
+        now = time.monotonic()
+        self._tokens = 1.0
+        self._last_refill = now
+        self._connected_at = now
+        self._connected = True
+        self._last_decrease = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.decreases = 0
+
+    # --- Taxa efetiva ---
+
+    def _effective_rate(self, now):
+        if self.warmup_seconds <= 0:
+            return self.rate
+        progress = min(1.0, (now - self._connected_at) / self.warmup_seconds)
+        return self.min_rate + (self.rate - self.min_rate) * progress
+
+    def effective_rate(self):
+        with self._lock:
+            return self._effective_rate(time.monotonic())
+
+    # --- Token bucket ---
+
+    def reserve(self):
+        """
+        Reserva uma ficha e retorna quantos segundos esperar antes de enviar.
+        As fichas podem ficar negativas: cada chamada "agenda" seu envio depois das anteriores.
+        """
+        with self._lock:
+            now = time.monotonic()
+            rate = self._effective_rate(now)
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * rate)
+            self._last_refill = now
+            self._tokens -= 1.0
+            wait = -self._tokens / rate if self._tokens < 0 else 0.0
+            if self.jitter_fraction > 0:
+                wait += random.uniform(0, self.jitter_fraction / rate)
+            return wait
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    # --- AIMD ---
+
+    def record_result(self, success, latency_seconds, status_code=None):
+        """Ajusta a taxa com base no resultado de um envio (chamado após cada envio)."""
+        with self._lock:
+            now = time.monotonic()
+            if success:
+                self.successes += 1
+            else:
+                self.failures += 1
+
+            congested = (not success and is_congestion_signal(status_code)) or latency_seconds > self.latency_target
+            if congested:
+                if now - self._last_decrease >= self.cooldown_seconds:
+                    self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+                    self._last_decrease = now
+                    self.decreases += 1
+            elif success:
+                # +additive_increase envios/s a cada segundo de envios saudáveis (1/rate segundos por envio)
+                self.rate = min(self.max_rate, self.rate + self.additive_increase / self.rate)
+
+    # --- Conexão da sessão ---
+
+    def mark_connected(self):
+        """Sessão (re)conectada: reinicia o aquecimento se ela estava desconectada."""
+        with self._lock:
+            if not self._connected:
+                self._connected = True
+                self._connected_at = time.monotonic()
+                self._tokens = min(self._tokens, 1.0)
+
+    def mark_disconnected(self):
+        with self._lock:
+            self._connected = False
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            warmup_progress = 1.0 if self.warmup_seconds <= 0 else min(1.0, (now - self._connected_at) / self.warmup_seconds)
+            return {
+                'session': self.name,
+                'rate': round(self.rate, 4),
+                'effective_rate': round(self._effective_rate(now), 4),
+                'sends_per_minute': round(self._effective_rate(now) * 60, 1),
+                'warmup_progress': round(warmup_progress, 2),
+                'connected': self._connected,
+                'successes': self.successes,
+                'failures': self.failures,
+                'decreases': self.decreases,
+            }
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+def get_rate_controller(session_name):
+    """Controlador da sessão, compartilhado por todas as campanhas do processo."""
+    with _controllers_lock:
+        controller = _controllers.get(session_name)
+        if controller is None:
+            controller = AdaptiveRateController(session_name)
+            _controllers[session_name] = controller
+        return controller
+
+def get_rate_snapshots():
+    """Taxa atual de cada sessão conhecida pelo processo (para exibição na interface)."""
+    with _controllers_lock:
+        controllers = list(_controllers.values())
+    return [controller.snapshot() for controller in controllers]
+
+def get_total_sends_per_minute():
+    """Soma das taxas efetivas das sessões conectadas, em envios por minuto."""
+    return round(sum(snapshot['sends_per_minute'] for snapshot in get_rate_snapshots() if snapshot['connected']), 1)
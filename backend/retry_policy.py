@@ -0,0 +1,55 @@
+# retry_policy.py
+import datetime
+import random
+
+from backend.config import RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS
+from backend.wpp_connector import ERROR_KIND_INVALID_INPUT
+
+TRANSIENT = "TRANSIENT" # Vale tentar de novo mais tarde (timeout, 5xx, erro de conexão...)
+PERMANENT = "PERMANENT" # Reenviar não adianta (ex: número inválido)
+
+# Status HTTP que indicam um problema momentâneo do servidor/sessão, não do contato
+TRANSIENT_STATUS_CODES = {401, 408, 425, 429}
+
+
+def classify_failure(api_response_data):
+    """
+    Classifica a resposta de erro do wpp_connector.
+    Erros nos dados do envio ('kind' = ERROR_KIND_INVALID_INPUT: telefone/mensagem ausentes, imagem
+    inexistente, vazia ou ilegível) são permanentes. Fora isso, sem 'status_code' significa que a
+    requisição nem chegou a ter resposta (timeout, conexão recusada, token indisponível) e é tratada
+    como transitória.
+    """
+    if not isinstance(api_response_data, dict):
+        return TRANSIENT
+    if api_response_data.get('kind') == ERROR_KIND_INVALID_INPUT:
+        return PERMANENT
+    status_code = api_response_data.get('status_code')
+    if status_code is None:
+        return TRANSIENT
+    if status_code >= 500 or status_code in TRANSIENT_STATUS_CODES:
+        return TRANSIENT
+    return PERMANENT
+
+
+def backoff_seconds(retry_count):
+    """Espera antes da tentativa `retry_count` (1, 2, 3...): exponencial com jitter de ±20%."""
+    delay = min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * (2 ** max(0, retry_count - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def plan_failure(api_response_data, retry_count, now=None):
+    """
+    Decide o destino de um envio que falhou, dado quantas falhas transitórias ele já teve.
+    Retorna (status, novo_retry_count, next_attempt_at):
+      - RETRY_SCHEDULED com next_attempt_at, para falhas transitórias com tentativas restantes;
+      - DEAD_LETTER, quando as tentativas se esgotaram;
+      - SENT_FAILED, para falhas permanentes.
+    """
+    if classify_failure(api_response_data) == PERMANENT:
+        return "SENT_FAILED", retry_count, None
+    new_retry_count = retry_count + 1
+    if new_retry_count > RETRY_MAX_ATTEMPTS:
+        return "DEAD_LETTER", retry_count, None
+    now = now or datetime.datetime.now()
+    return "RETRY_SCHEDULED", new_retry_count, now + datetime.timedelta(seconds=backoff_seconds(new_retry_count))
@@ -3,9 +3,8 @@ import requests
 import time
 import os
 import base64
-from config import WPPCONNECT_SERVER_URL, WPPCONNECT_SESSION_NAME
-# Certifique-se que auth_manager.py está no mesmo diretório ou no PYTHONPATH
-import auth_manager # Usaremos para obter o token JWT
+from backend.config import WPPCONNECT_SERVER_URL, WPPCONNECT_SESSION_NAME
+from backend import auth_manager # Usaremos para obter o token JWT
 
 # Tente instalar: pip install qrcode[pil]
 try:
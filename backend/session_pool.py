@@ -0,0 +1,69 @@
+# session_pool.py
+from backend import wpp_connector
+from backend.rate_controller import get_rate_controller
+from backend.config import WPPCONNECT_SESSION_NAMES
+
+
+class PooledSession:
+    """Estado de uma sessão WPPConnect (um número de WhatsApp) dentro do pool."""
+
+    def __init__(self, name):
+        self.name = name
+        self.healthy = False
+        self.last_status = None # Última resposta do /status-session
+        self.sent = 0
+        self.failed = 0
+        self.rate_controller = get_rate_controller(name) # Orçamento de envios próprio da sessão
+
+    def snapshot(self):
+        return {
+            'name': self.name,
+            'healthy': self.healthy,
+            'sent': self.sent,
+            'failed': self.failed,
+            'rate': self.rate_controller.snapshot(),
+        }
+
+
+class SessionPool:
+    """
+    Conjunto de sessões configuradas em WPPCONNECT_SESSION_NAMES.
+    Cada sessão tem seu próprio token JWT (auth_manager) e seu próprio controle de taxa (rate_controller);
+    apenas as sessões conectadas recebem disparos.
+    """
+
+    def __init__(self, session_names=None):
+        names = session_names or WPPCONNECT_SESSION_NAMES
+        # dict.fromkeys remove nomes repetidos mantendo a ordem da configuração
+        self.sessions = [PooledSession(name) for name in dict.fromkeys(names)]
+
+    def check_session(self, session, client=None):
+        """Consulta o status da sessão no servidor e atualiza `healthy`. Retorna o novo estado."""
+        connected, session_data = wpp_connector.get_session_status(session.name, client=client)
+        session.healthy = connected
+        session.last_status = session_data
+        if connected:
+            session.rate_controller.mark_connected()
+        else:
+            session.rate_controller.mark_disconnected()
+        return connected
+
+    def refresh_health(self, client=None):
+        """Verifica todas as sessões do pool. Retorna a lista das que estão conectadas."""
+        for session in self.sessions:
+            self.check_session(session, client=client)
+        return self.healthy_sessions()
+
+    def healthy_sessions(self):
+        return [session for session in self.sessions if session.healthy]
+
+    def mark_lost(self, session, reason=None):
+        """Retira a sessão da distribuição de envios (ex: desconectou no meio da campanha)."""
+        session.healthy = False
+        session.rate_controller.mark_disconnected()
+        if reason is not None:
+            session.last_status = reason
+        print(f"Aviso: Sessão '{session.name}' indisponível. Disparos redistribuídos entre as demais sessões.")
+
+    def snapshot(self):
+        return [session.snapshot() for session in self.sessions]
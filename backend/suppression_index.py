@@ -0,0 +1,72 @@
+# suppression_index.py
+"""
+Índice em memória da lista de supressão (clientes que responderam "SAIR" ou pediram para não
+receber mensagens), usado para filtrar contatos ao enfileirar e antes de cada envio sem ir ao banco.
+
+Os telefones ficam em um set de inteiros (consulta O(1), ~70 bytes por número). O banco
+(database_manager) grava cada inclusão/remoção em suppression_changes; o índice guarda o último
+change_id aplicado e, a cada atualização, lê só as alterações posteriores. Assim uma lista de
+centenas de milhares de números é carregada uma vez por processo e depois custa uma consulta
+vazia pelo índice da chave primária enquanto nada muda.
+"""
+import threading
+import time
+
+
+def phone_key(phone):
+    """
+    Chave do telefone no índice: o número como inteiro (ocupa menos que a string e a conversão direta
+    é o caminho mais rápido para os números normalizados, só dígitos). Outros textos ficam como estão.
+    """
+    try:
+        return int(phone)
+    except ValueError:
+        return phone
+
+
+class SuppressionIndex:
+    """Conjunto de telefones suprimidos, atualizado incrementalmente a partir de suppression_changes."""
+    __slots__ = ('_phones', 'last_change_id', 'loaded', 'refreshed_at', 'lock')
+
+    def __init__(self):
+        self._phones = set()
+        self.last_change_id = 0 # Última alteração de suppression_changes já aplicada
+        self.loaded = False # Carga inicial feita (a partir de suppressed_phones)
+        self.refreshed_at = None # time.monotonic() da última atualização
+        self.lock = threading.Lock() # Uma atualização por vez (o índice é compartilhado pelas threads do processo)
+
+    def __len__(self):
+        return len(self._phones)
+
+    def __contains__(self, phone):
+        return bool(phone) and phone_key(phone) in self._phones
+
+    def is_stale(self, max_age_seconds):
+        return self.refreshed_at is None or time.monotonic() - self.refreshed_at >= max_age_seconds
+
+    def invalidate(self):
+        """Força a próxima consulta a ler as alterações (ex: depois de alterar a lista neste processo)."""
+        self.refreshed_at = None
+
+    def load(self, phones, last_change_id):
+        """Carga completa: substitui o conteúdo pelos `phones` lidos no mesmo instante de `last_change_id`."""
+        self._phones = {phone_key(phone) for phone in phones}
+        self.last_change_id = last_change_id
+        self.loaded = True
+        self.refreshed_at = time.monotonic()
+
+    def apply_changes(self, changes):
+        """Aplica alterações (change_id, telefone, 'ADD'/'REMOVE') em ordem de change_id."""
+        phones = self._phones
+        for change_id, phone, action in changes:
+            if action == 'ADD':
+                phones.add(phone_key(phone))
+            else:
+                phones.discard(phone_key(phone))
+            self.last_change_id = change_id
+        self.refreshed_at = time.monotonic()
+
+    def suppressed_in(self, phones):
+        """Quais dos `phones` estão suprimidos (lista, na ordem recebida)."""
+        suppressed = self._phones
+        return [phone for phone in phones if phone and phone_key(phone) in suppressed]
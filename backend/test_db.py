@@ -1,9 +1,36 @@
 # test_db.py
-import database_manager as dbm # Nosso módulo do banco de dados
+"""
+Testes do banco de dados e dos módulos do backend. Apaga e recria o storebot.db do diretório
+atual: rode em um diretório de testes, com a raiz do projeto no PYTHONPATH.
+
+Uso:
+    PYTHONPATH=/caminho/do/storebot python -m backend.test_db
+"""
+from backend import database_manager as dbm # Nosso módulo do banco de dados
 import datetime
 import uuid # Para gerar IDs únicos para teste
 import os
 import json # Para simular a resposta da API
+import threading
+import shutil
+import requests
+from backend import archive_manager
+from backend import dispatch_log_format
+from backend import csv_processor
+from backend import campaign_scheduler
+from backend import phone_normalizer
+from backend import retry_policy
+from backend import wpp_connector
+from backend import dispatch_engine
+from backend.session_pool import SessionPool
+from backend.config import (
+    RETRY_MAX_ATTEMPTS,
+    PHONE_ADD_MISSING_NINTH_DIGIT,
+    PHONE_ACCEPT_LANDLINES,
+    RATE_INITIAL_SENDS_PER_SECOND,
+    WPPCONNECT_SESSION_NAMES,
+)
+from backend.contact_deduplicator import ContactDeduplicator
 
 # Tenta obter o nome do arquivo do banco de dados do módulo database_manager
 # ou define um padrão se não estiver acessível diretamente.
@@ -18,10 +45,16 @@ def run_all_db_tests():
         print(f"Removendo banco de dados existente '{DB_FILE_NAME}' para um teste limpo...")
         try:
             os.remove(DB_FILE_NAME)
+            for wal_file in (DB_FILE_NAME + "-wal", DB_FILE_NAME + "-shm"): # Arquivos do modo WAL
+                if os.path.exists(wal_file):
+                    os.remove(wal_file)
         except PermissionError:
             print(f"AVISO: Não foi possível remover '{DB_FILE_NAME}'. O arquivo pode estar em uso.")
             print("Os testes continuarão, mas podem usar dados preexistentes se a remoção falhar.")
 
+    if os.path.isdir(archive_manager.archive_folder()):
+        shutil.rmtree(archive_manager.archive_folder()) # Bancos de arquivo de execuções anteriores
+
     # 1. Testar criação de tabelas
     print("\n[TESTE 1] Criando tabelas...")
     dbm.create_tables()
@@ -104,10 +137,494 @@ def run_all_db_tests():
     assert updated_log_1_details is not None, f"Não foi possível recuperar o log ID {log_id_1} atualizado"
     assert updated_log_1_details['status'] == "SENT_SUCCESS"
     assert updated_log_1_details['personalized_message_text'] == msg_sent_to_contact1
-    assert updated_log_1_details['api_response'] == api_resp_contact1
+    assert updated_log_1_details['api_response'] is None, "Resposta deve ir para o formato compacto"
+    assert updated_log_1_details['api_message_id'] == 'msg123'
     assert updated_log_1_details['sent_at'] is not None # Deve ter sido preenchido
     print(f"Detalhes verificados do log ID {log_id_1} (status SENT_SUCCESS): {dict(updated_log_1_details)}")
 
+    # 4. Testar Reenvios Agendados
+    print("\n[TESTE 4] Reenvios agendados (RETRY_SCHEDULED)...")
+    assert dbm.count_open_dispatches(campaign_id_1) == 1, "Esperado 1 disparo em aberto (o contato 2 PENDING)"
+    retry_at = datetime.datetime.now() - datetime.timedelta(seconds=1) # Já vencido
+    assert dbm.update_dispatch_log(log_id_2, "RETRY_SCHEDULED", "Msg", json.dumps({'error': 'timeout'}),
+                                   retry_count=1, next_attempt_at=retry_at) == True, "Falha ao agendar reenvio"
+    assert dbm.get_pending_dispatches_for_campaign(campaign_id_1) == [], "Reenvio agendado não deveria aparecer como PENDING"
+    assert dbm.count_open_dispatches(campaign_id_1) == 1, "Reenvio agendado deveria contar como disparo em aberto"
+    due_retries = dbm.get_due_retries_for_campaign(campaign_id_1)
+    assert [d['log_id'] for d in due_retries] == [log_id_2], "Reenvio vencido não encontrado"
+    assert due_retries[0]['retry_count'] == 1
+    assert dbm.get_next_retry_time(campaign_id_1) == retry_at, "Horário do próximo reenvio incorreto"
+    assert dbm.get_due_retries_for_campaign(campaign_id_1, now=retry_at - datetime.timedelta(minutes=1)) == [], "Reenvio ainda não vencido foi retornado"
+
+    assert dbm.update_dispatch_log(log_id_2, "DEAD_LETTER", "Msg", json.dumps({'error': 'timeout'}), retry_count=3) == True
+    assert dbm.count_open_dispatches(campaign_id_1) == 0, "DEAD_LETTER não deveria contar como disparo em aberto"
+    assert dbm.get_next_retry_time(campaign_id_1) is None
+    print("Reenvios agendados e DEAD_LETTER verificados.")
+
+    # 5. Testar Reservas (lease) de disparos
+    print("\n[TESTE 5] Reserva de disparos por worker (lease)...")
+    campaign_id_2 = "test_campaign_lease"
+    assert dbm.add_campaign(campaign_id_2, "lease.csv", "Oi {{nome}}") == True
+    lease_log_ids = [dbm.add_dispatch_contact(campaign_id_2, f"55119000000{i}", f"Lease {i}") for i in range(5)]
+    batch_a = dbm.claim_dispatch_batch(campaign_id_2, "worker-a", 3, lease_seconds=60)
+    batch_b = dbm.claim_dispatch_batch(campaign_id_2, "worker-b", 3, lease_seconds=60)
+    assert [d['log_id'] for d in batch_a] == lease_log_ids[:3], "Worker A deveria reservar os 3 primeiros contatos"
+    assert [d['log_id'] for d in batch_b] == lease_log_ids[3:], "Worker B deveria reservar apenas os contatos restantes"
+    assert all(d['lease_owner'] == "worker-a" for d in batch_a)
+    assert dbm.claim_dispatch_batch(campaign_id_2, "worker-c", 3, lease_seconds=60) == [], "Contatos reservados não podem ser reservados de novo"
+
+    # Reserva expirada (worker caiu) pode ser assumida por outro worker
+    later = datetime.datetime.now() + datetime.timedelta(seconds=61)
+    assert dbm.get_next_claim_time(campaign_id_2) > datetime.datetime.now(), "Próxima reserva deveria ser após a expiração"
+    assert dbm.renew_dispatch_leases("worker-b", [d['log_id'] for d in batch_b], lease_seconds=600) == 2
+    batch_c = dbm.claim_dispatch_batch(campaign_id_2, "worker-c", 10, lease_seconds=60, now=later)
+    assert [d['log_id'] for d in batch_c] == lease_log_ids[:3], "Somente as reservas expiradas (worker A) deveriam ser assumidas"
+
+    # Worker A perdeu a reserva: não pode mais gravar o resultado
+    assert dbm.update_dispatch_log(lease_log_ids[0], "SENT_SUCCESS", "Oi", "{}", lease_owner="worker-a") == False
+    assert dbm.update_dispatch_log(lease_log_ids[0], "SENT_SUCCESS", "Oi", "{}", lease_owner="worker-c") == True
+    assert dbm.release_dispatch_leases("worker-c", campaign_id_2) == 2, "Esperado liberar os 2 contatos ainda reservados por C"
+    assert [d['log_id'] for d in dbm.claim_dispatch_batch(campaign_id_2, "worker-d", 10, lease_seconds=60)] == lease_log_ids[1:3]
+    assert dbm.count_dispatches_by_status(campaign_id_2) == {'SENT_SUCCESS': 1, 'PENDING': 4}
+    print("Reservas, expiração, renovação e liberação verificadas.")
+
+    # 6. Testar Prioridade e Janela de Envio da campanha
+    print("\n[TESTE 6] Prioridade e janela de envio...")
+    campaign_id_3 = "test_campaign_schedule"
+    assert dbm.add_campaign(campaign_id_3, "agenda.csv", "Oi", priority=3, send_window_start="08:00", send_window_end="20:00") == True
+    scheduled_campaign = dbm.get_campaign_details(campaign_id_3)
+    assert scheduled_campaign['priority'] == 3
+    assert (scheduled_campaign['send_window_start'], scheduled_campaign['send_window_end']) == ("08:00", "20:00")
+    assert dbm.get_campaign_details(campaign_id_1)['priority'] == 1, "Prioridade padrão deveria ser 1"
+    assert dbm.update_campaign_schedule(campaign_id_3, 5) == True
+    scheduled_campaign = dbm.get_campaign_details(campaign_id_3)
+    assert scheduled_campaign['priority'] == 5 and scheduled_campaign['send_window_start'] is None
+    print("Prioridade e janela de envio verificadas.")
+
+    # Atualizações para o painel: página terminando no meio de registros com o mesmo sent_at (lote do DispatchStatusWriter)
+    campaign_id_updates = "test_campaign_updates"
+    assert dbm.add_campaign(campaign_id_updates, "painel.csv", "Oi") == True
+    dbm.add_dispatch_contacts_bulk(campaign_id_updates, [{'telefone': f"55629888{i:05d}", 'nome': f"P{i}"} for i in range(5)])
+    batch_sent_at = datetime.datetime.now()
+    update_log_ids = [record.log_id for record in dbm.iter_pending_dispatches(campaign_id_updates)]
+    assert dbm.update_dispatch_logs_batch([{'log_id': log_id, 'status': "SENT_SUCCESS", 'sent_at': batch_sent_at}
+                                           for log_id in update_log_ids]) == [True] * 5
+    seen_log_ids = []
+    cursor_position = (batch_sent_at - datetime.timedelta(seconds=1), 0)
+    while True:
+        updates_page = dbm.get_dispatch_updates_since(campaign_id_updates, *cursor_position, limit=2)
+        if not updates_page:
+            break
+        seen_log_ids += [update['log_id'] for update in updates_page]
+        cursor_position = (updates_page[-1]['sent_at'], updates_page[-1]['log_id'])
+    assert seen_log_ids == update_log_ids, "Nenhum registro com o mesmo sent_at pode ser pulado entre as páginas"
+
+    # 7. Testar Enfileiramento em lote
+    print("\n[TESTE 7] Enfileiramento de contatos em lote...")
+    campaign_id_4 = "test_campaign_bulk"
+    assert dbm.add_campaign(campaign_id_4, "lote.csv", "Oi {{nome}}") == True
+    bulk_contacts = [{'telefone': f"5562{i:08d}", 'nome': f"Lote {i}"} for i in range(2500)]
+    bulk_contacts += [{'telefone': '', 'nome': "Sem telefone"}, {'telefone': None, 'nome': "Nulo"}]
+    assert dbm.add_dispatch_contacts_bulk(campaign_id_4, iter(bulk_contacts), chunk_size=1000) == (2500, 2, 0, 0)
+    assert dbm.count_open_dispatches(campaign_id_4) == 2500
+    assert dbm.add_dispatch_contacts_bulk(campaign_id_4, []) == (0, 0, 0, 0)
+    print("Enfileiramento em lote verificado.")
+
+    # 8. Testar Conexão persistente
+    print("\n[TESTE 8] Conexão persistente por thread...")
+    conn_a = dbm.get_db_connection()
+    conn_a.close() # Não fecha: apenas encerra a transação
+    assert dbm.get_db_connection() is conn_a, "A mesma thread deveria reaproveitar a conexão"
+    assert conn_a.execute("PRAGMA journal_mode").fetchone()[0] == "wal", "Esperado journal_mode WAL"
+    other_thread_conn = []
+    worker_thread = threading.Thread(target=lambda: other_thread_conn.append(dbm.get_db_connection()))
+    worker_thread.start()
+    worker_thread.join()
+    assert other_thread_conn[0] is not conn_a, "Cada thread deveria ter sua própria conexão"
+    conn_a.execute("UPDATE campaigns SET status = 'DESCARTADO' WHERE campaign_id = ?", (campaign_id_4,))
+    conn_a.close()
+    assert dbm.get_campaign_details(campaign_id_4)['status'] == 'PENDING', "close() deveria desfazer o que não foi confirmado"
+    dbm.close_db_connections()
+    assert dbm.get_db_connection() is not conn_a, "Após close_db_connections() uma nova conexão deveria ser aberta"
+    print("Conexão persistente verificada.")
+
+    # 9. Testar Migrações do schema
+    print("\n[TESTE 9] Versão do schema e índices...")
+    assert dbm.get_schema_version() == dbm.SCHEMA_VERSION, "Banco deveria estar na versão atual do schema"
+    assert dbm.migrate_database() == dbm.SCHEMA_VERSION, "Migrar de novo não deveria alterar a versão"
+    conn_check = dbm.get_db_connection()
+    index_names = {row['name'] for row in conn_check.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    query_plan = " ".join(row['detail'] for row in conn_check.execute(
+        "EXPLAIN QUERY PLAN SELECT COUNT(*) FROM dispatch_log WHERE campaign_id = ? AND status = 'PENDING'", (campaign_id_4,)
+    ))
+    conn_check.close()
+    assert {'idx_dispatch_log_campaign_status', 'idx_dispatch_log_phone_campaign', 'idx_campaigns_status_created_at'} <= index_names
+    assert 'idx_dispatch_log_campaign_status' in query_plan, f"Consulta de pendentes não usa o índice: {query_plan}"
+    print("Migrações e índices verificados.")
+
+    # 10. Testar Gravação em lote dos resultados (write-behind)
+    print("\n[TESTE 10] Gravação em lote dos resultados de envio...")
+    from backend.dispatch_status_writer import DispatchStatusWriter
+    claimed_bulk = dbm.claim_dispatch_batch(campaign_id_4, "worker-lote", 250, lease_seconds=60)
+    status_writer = DispatchStatusWriter(batch_size=100, flush_interval=0.2)
+    futures = [status_writer.submit(d['log_id'], "SENT_SUCCESS", "Oi", "{}", lease_owner="worker-lote") for d in claimed_bulk]
+    lost_future = status_writer.submit(claimed_bulk[0]['log_id'], "SENT_FAILED", "Oi", "{}", lease_owner="worker-outro")
+    status_writer.close()
+    assert all(future.done() for future in futures + [lost_future]), "close() deveria gravar tudo o que estava na fila"
+    assert all(future.result() for future in futures)
+    assert lost_future.result() == False, "Resultado de worker sem a reserva não pode ser gravado"
+    assert dbm.count_dispatches_by_status(campaign_id_4).get('SENT_SUCCESS') == 250
+    writer_metrics = status_writer.metrics()
+    assert writer_metrics['recorded'] == 250 and writer_metrics['lost_leases'] == 1 and writer_metrics['flushes'] >= 3
+    print(f"Gravação em lote verificada: {writer_metrics}")
+
+    # 11. Testar Iteração paginada dos pendentes
+    print("\n[TESTE 11] Iteração paginada (keyset) dos disparos pendentes...")
+    campaign_id_5 = "test_campaign_pages"
+    assert dbm.add_campaign(campaign_id_5, "paginas.csv", "Oi") == True
+    assert dbm.add_dispatch_contacts_bulk(campaign_id_5, [{'telefone': f"5511{i:08d}", 'nome': f"P{i}"} for i in range(23)]) == (23, 0, 0, 0)
+    paged_records = list(dbm.iter_pending_dispatches(campaign_id_5, page_size=5))
+    assert [r.contact_phone for r in paged_records] == [f"5511{i:08d}" for i in range(23)], "Páginas fora de ordem ou incompletas"
+    assert dbm.count_pending_dispatches(campaign_id_5) == 23
+    assert paged_records[0]['contact_name'] == "P0" and dict(paged_records[0])['status'] == 'PENDING'
+    assert not hasattr(paged_records[0], '__dict__'), "DispatchRecord deveria usar __slots__"
+    assert list(dbm.iter_pending_dispatches(campaign_id_5, page_size=5, status='SENT_SUCCESS')) == []
+    print("Iteração paginada verificada.")
+
+    # 12. Testar Contadores por campanha (campaign_stats)
+    print("\n[TESTE 12] Contadores por campanha mantidos pelos triggers...")
+    assert dbm.get_campaign_stats(campaign_id_4) == {'SENT_SUCCESS': 250, 'PENDING': 2250}
+    assert dbm.get_campaign_stats(campaign_id_1) == {'DEAD_LETTER': 1, 'SENT_SUCCESS': 1}
+    assert dbm.get_all_campaign_stats()[campaign_id_5] == {'PENDING': 23}
+    assert dbm.count_open_dispatches(campaign_id_5) == 23
+    stats_log_id = next(dbm.iter_pending_dispatches(campaign_id_5)).log_id
+    assert dbm.update_dispatch_log(stats_log_id, "RETRY_SCHEDULED", "Oi", "{}", retry_count=1,
+                                   next_attempt_at=datetime.datetime.now()) == True
+    assert dbm.get_campaign_stats(campaign_id_5) == {'PENDING': 22, 'RETRY_SCHEDULED': 1}
+    assert dbm.count_open_dispatches(campaign_id_5) == 23, "Reenvio agendado continua em aberto"
+    assert dbm.rebuild_campaign_stats() == [], "Contadores mantidos pelos triggers não deveriam divergir"
+    conn_check = dbm.get_db_connection()
+    conn_check.execute("UPDATE campaign_stats SET total = 99 WHERE campaign_id = ? AND status = 'PENDING'", (campaign_id_5,))
+    conn_check.commit()
+    conn_check.close()
+    assert dbm.rebuild_campaign_stats(campaign_id_5) == [(campaign_id_5, 'PENDING', 99, 22)]
+    assert dbm.get_campaign_stats(campaign_id_5) == {'PENDING': 22, 'RETRY_SCHEDULED': 1}
+    print("Contadores por campanha verificados.")
+
+    # 13. Testar Paginação do log de disparos (detalhes da campanha)
+    print("\n[TESTE 13] Paginação keyset do log de disparos...")
+    first_page, has_more = dbm.get_dispatch_log_page(campaign_id_5, limit=10)
+    assert len(first_page) == 10 and has_more
+    second_page, has_more = dbm.get_dispatch_log_page(campaign_id_5, after_log_id=first_page[-1]['log_id'], limit=10)
+    last_page, has_more_last = dbm.get_dispatch_log_page(campaign_id_5, after_log_id=second_page[-1]['log_id'], limit=10)
+    assert len(last_page) == 3 and not has_more_last, "Última página deveria ter os 3 registros restantes"
+    back_page, has_more_back = dbm.get_dispatch_log_page(campaign_id_5, before_log_id=second_page[0]['log_id'], limit=10)
+    assert back_page == first_page and not has_more_back, "Voltar uma página deveria trazer a primeira página, em ordem"
+    retry_page, _ = dbm.get_dispatch_log_page(campaign_id_5, status='RETRY_SCHEDULED')
+    assert [d['log_id'] for d in retry_page] == [stats_log_id]
+    phone_page, _ = dbm.get_dispatch_log_page(campaign_id_5, contact_phone="551100000007")
+    assert [d['contact_name'] for d in phone_page] == ["P7"]
+    print("Paginação do log de disparos verificada.")
+
+    # 14. Arquivamento de campanhas finalizadas
+    print("\n[TESTE 14] Arquivamento de campanhas finalizadas...")
+    assert archive_manager.archive_campaign(campaign_id_5) is None, "Campanha não finalizada não deve ser arquivada"
+    assert dbm.update_campaign_status(campaign_id_5, "COMPLETED") == True
+    assert campaign_id_5 not in [c['campaign_id'] for c in archive_manager.get_archivable_campaigns(older_than_days=1)]
+    future = datetime.datetime.now() + datetime.timedelta(days=2)
+    assert campaign_id_5 in [c['campaign_id'] for c in archive_manager.get_archivable_campaigns(older_than_days=1, now=future)]
+    assert dbm.update_dispatch_log(stats_log_id, "SENT_FAILED", "Oi P0", '{"error": "timeout"}') == True
+    stats_before = dbm.get_campaign_stats(campaign_id_5)
+    full_page_before, _ = dbm.get_dispatch_log_page(campaign_id_5, limit=100)
+    assert archive_manager.archive_campaign(campaign_id_5, batch_size=7) == 23
+    conn_check = dbm.get_db_connection()
+    remaining = conn_check.execute("SELECT COUNT(*) FROM dispatch_log WHERE campaign_id = ?", (campaign_id_5,)).fetchone()[0]
+    conn_check.close()
+    assert remaining == 0, "Registros arquivados devem sair do banco principal"
+    assert dbm.get_campaign_details(campaign_id_5)['archive_file'].startswith("storebot_archive_")
+    assert dbm.get_campaign_stats(campaign_id_5) == stats_before, "Contadores da campanha arquivada devem ser mantidos"
+    assert dbm.rebuild_campaign_stats(campaign_id_5) == [], "Reconstrução não deve zerar campanhas arquivadas"
+    full_page_after, _ = dbm.get_dispatch_log_page(campaign_id_5, limit=100)
+    assert full_page_after == full_page_before, "Log arquivado deve ser lido pela mesma API, com os mesmos dados"
+    failed_page, _ = dbm.get_dispatch_log_page(campaign_id_5, status='SENT_FAILED')
+    assert [(d['log_id'], d['api_response']) for d in failed_page] == [(stats_log_id, '{"error": "timeout"}')]
+    archived_first, has_more = dbm.get_dispatch_log_page(campaign_id_5, limit=10)
+    assert archived_first == full_page_before[:10] and has_more
+    assert archive_manager.archive_campaign(campaign_id_5) == 0, "Rodar de novo não deve fazer nada"
+    archive_manager.incremental_vacuum()
+    print("Arquivamento verificado.")
+
+    # 15. Formato compacto dos resultados de envio
+    print("\n[TESTE 15] Formato compacto dos resultados de envio...")
+    wpp_response = {'status': 'success', 'response': [{'id': 'true_5511@c.us_3EB0AA', 'ack': 1, 'body': 'Oi P1' * 50}]}
+    message_id, ack, error_code, compressed = dispatch_log_format.encode_api_response(wpp_response, "SENT_SUCCESS", storage="compressed")
+    assert (message_id, ack, error_code) == ('true_5511@c.us_3EB0AA', 1, None)
+    assert json.loads(dispatch_log_format.api_response_text(None, compressed)) == wpp_response
+    assert dispatch_log_format.encode_api_response(wpp_response, "SENT_SUCCESS", storage="failures")[3] is None
+    failure = {'status_code': 500, 'error': 'boom'}
+    assert dispatch_log_format.encode_api_response(failure, "RETRY_SCHEDULED", storage="none") == (None, None, 500, None)
+    assert dispatch_log_format.api_response_text(None, None, api_error_code=500) == '{"status_code": 500}'
+
+    campaign_id_6 = "test_campaign_compact"
+    assert dbm.add_campaign(campaign_id_6, "compacto.csv", "Olá {{nome}}, oferta!") == True
+    assert dbm.add_dispatch_contacts_bulk(campaign_id_6, [{'telefone': "5562000000001", 'nome': "Ana"},
+                                                         {'telefone': "5562000000002", 'nome': ""}]) == (2, 0, 0, 0)
+    compact_ids = [record.log_id for record in dbm.iter_pending_dispatches(campaign_id_6)]
+    assert dbm.update_dispatch_log(compact_ids[0], "SENT_SUCCESS", api_response=wpp_response) == True
+    compact_page, _ = dbm.get_dispatch_log_page(campaign_id_6)
+    assert compact_page[0]['personalized_message_text'] == "Olá Ana, oferta!", "Texto deve ser reconstruído do template"
+    assert compact_page[1]['personalized_message_text'] == "Olá cliente, oferta!"
+    assert compact_page[0]['api_message_id'] == 'true_5511@c.us_3EB0AA' and compact_page[0]['api_ack'] == 1
+
+    conn_check = dbm.get_db_connection() # Registro no formato antigo
+    conn_check.execute("UPDATE dispatch_log SET status = 'SENT_FAILED', personalized_message_text = ?, api_response = ? WHERE log_id = ?",
+                       ("Olá cliente, oferta!", json.dumps(failure), compact_ids[1]))
+    conn_check.commit()
+    conn_check.close()
+    assert dbm.compact_dispatch_log() >= 1
+    conn_check = dbm.get_db_connection()
+    legacy_row = conn_check.execute("SELECT * FROM dispatch_log WHERE log_id = ?", (compact_ids[1],)).fetchone()
+    conn_check.close()
+    assert legacy_row['api_response'] is None and legacy_row['personalized_message_text'] is None
+    assert legacy_row['api_error_code'] == 500
+    compact_page, _ = dbm.get_dispatch_log_page(campaign_id_6, status='SENT_FAILED')
+    assert json.loads(compact_page[0]['api_response']) == failure, "Resposta de falha deve ser mantida comprimida"
+    assert compact_page[0]['personalized_message_text'] == "Olá cliente, oferta!"
+    print("Formato compacto verificado.")
+
+    # 16. Testar Deduplicação de contatos
+    print("\n[TESTE 16] Deduplicação de contatos ao enfileirar...")
+    campaign_id_7 = "test_campaign_dedup"
+    assert dbm.add_campaign(campaign_id_7, "repetidos.csv", "Oi {{nome}}") == True
+    dedup_contacts = [{'telefone': f"5562{i % 300:09d}", 'nome': f"R{i}"} for i in range(1000)]
+    assert dbm.add_dispatch_contacts_bulk(campaign_id_7, dedup_contacts, chunk_size=128) == (300, 0, 700, 0)
+    second_list = [{'telefone': f"5562{i:09d}", 'nome': f"S{i}"} for i in range(250, 400)] # 50 já estão na campanha
+    assert dbm.add_dispatch_contacts_bulk(campaign_id_7, second_list) == (100, 0, 50, 0), "Repetidos entre listas da mesma campanha"
+    assert dbm.count_open_dispatches(campaign_id_7) == 400
+    assert dbm.add_dispatch_contacts_bulk(campaign_id_7, dedup_contacts[:10], deduplicate=False) == (10, 0, 0, 0)
+
+    stored_phones = set() # Modo filtro de Bloom + consulta (limite de memória baixo), com "banco" simulado
+    bloom_dedup = ContactDeduplicator(db_check=stored_phones.__contains__, memory_limit=50, bloom_capacity=1000)
+    accepted = []
+    for i in range(600):
+        phone = f"5511{(i * 7) % 400:09d}"
+        if bloom_dedup.add(phone):
+            accepted.append(phone)
+        if i % 64 == 63: # Lote gravado
+            stored_phones.update(accepted)
+            bloom_dedup.mark_flushed()
+    assert bloom_dedup.uses_bloom_filter
+    assert len(accepted) == len(set(accepted)) == 400 and bloom_dedup.duplicates == 200, "Nenhum único pode ser descartado"
+    print("Deduplicação verificada.")
+
+    # 17. Testar Lista de supressão (opt-out)
+    print("\n[TESTE 17] Lista de supressão (opt-out)...")
+    assert dbm.add_suppressed_phones(["5562999990001", "5562999990002", "5562999990001", ""], reason="SAIR") == 2
+    assert dbm.add_suppressed_phones(["5562999990002"]) == 0, "Número já suprimido não deve ser incluído de novo"
+    assert dbm.count_suppressed_phones() == 2
+    assert dbm.is_phone_suppressed("5562999990001") and not dbm.is_phone_suppressed("5562999990003")
+
+    campaign_id_8 = "test_campaign_optout"
+    assert dbm.add_campaign(campaign_id_8, "optout.csv", "Oi {{nome}}") == True
+    optout_contacts = [{'telefone': f"556299999{i:04d}", 'nome': f"O{i}"} for i in range(1, 6)]
+    assert dbm.add_dispatch_contacts_bulk(campaign_id_8, optout_contacts) == (3, 0, 0, 2), "Suprimidos não entram na fila"
+
+    assert dbm.add_suppressed_phones(["5562999990003"], reason="SAIR") == 1 # Pediu para sair depois de enfileirado
+    claimed = dbm.claim_dispatch_batch(campaign_id_8, "worker-optout", 10, 60)
+    assert [record.contact_phone for record in claimed] == ["5562999990004", "5562999990005"]
+    assert dbm.get_campaign_stats(campaign_id_8).get('SUPPRESSED') == 1
+
+    conn_check = dbm.get_db_connection() # Alteração feita por outro processo: chega pela releitura incremental
+    conn_check.execute("INSERT INTO suppressed_phones (phone, reason) VALUES ('5562999990009', 'SAIR')")
+    conn_check.commit()
+    conn_check.close()
+    assert "5562999990009" not in dbm.get_suppression_index(), "Índice só relê depois de SUPPRESSION_REFRESH_SECONDS"
+    assert "5562999990009" in dbm.get_suppression_index(max_age_seconds=0)
+    assert dbm.remove_suppressed_phones(["5562999990001"]) == 1
+    suppression_index = dbm.get_suppression_index()
+    assert "5562999990001" not in suppression_index and "5562999990003" in suppression_index and len(suppression_index) == 3
+    assert [row['phone'] for row in dbm.iter_suppressed_phones(page_size=1)] == ["5562999990002", "5562999990003", "5562999990009"]
+    print("Lista de supressão verificada.")
+
+    # 18. Testar Listas de contatos no banco
+    print("\n[TESTE 18] Listas de contatos importadas (contact_lists/contacts)...")
+    list_contacts = [{'telefone': f"5511988{i:06d}", 'nome': f"L{i}"} for i in range(50)]
+    list_contacts += [{'telefone': "5511988000003", 'nome': "Repetido"}, {'telefone': '', 'nome': "Sem telefone"},
+                      {'telefone': "5562999990002", 'nome': "Suprimido"}]
+    list_id, imported, rejected, duplicates = dbm.import_contact_list("clientes.csv", iter(list_contacts), "clientes.csv", "abc123", chunk_size=16)
+    assert (imported, rejected, duplicates) == (51, 1, 1)
+    assert dbm.find_contact_list_by_hash("abc123")['list_id'] == list_id and dbm.find_contact_list_by_hash("outro") is None
+    assert dbm.get_contact_list(list_id)['contact_count'] == 51
+    assert [row['list_id'] for row in dbm.get_contact_lists()] == [list_id]
+
+    campaign_id_9 = "test_campaign_list"
+    assert dbm.add_campaign(campaign_id_9, "clientes.csv", "Oi {{nome}}", list_id=list_id) == True
+    assert dbm.get_campaign_details(campaign_id_9)['list_id'] == list_id
+    assert dbm.enqueue_contact_list(campaign_id_9, list_id) == (50, 0, 0, 1), "Suprimido fica de fora"
+    queued = list(dbm.iter_pending_dispatches(campaign_id_9))
+    assert [record.contact_phone for record in queued] == [f"5511988{i:06d}" for i in range(50)], "Ordem do arquivo"
+    assert queued[3].contact_name == "L3"
+    assert dbm.enqueue_contact_list(campaign_id_9, list_id) == (0, 0, 50, 1), "Já enfileirados na campanha"
+    assert dbm.delete_contact_list(list_id) == True and dbm.get_contact_list(list_id) is None
+    assert dbm.count_open_dispatches(campaign_id_9) == 50, "Campanha não é afetada pela exclusão da lista"
+    print("Listas de contatos verificadas.")
+
+    # 19. Testar Atualização incremental de uma lista (hash por linha)
+    print("\n[TESTE 19] Atualização incremental de lista de contatos...")
+    week_1_csv, week_2_csv = "test_lista_semana1.csv", "test_lista_semana2.csv"
+    with open(week_1_csv, 'w', encoding='utf-8') as csv_file:
+        csv_file.write("telefone;nome\n" + "".join(f"(11) 97700-{i:04d};Cliente {i}\n" for i in range(20)))
+    with open(week_2_csv, 'w', encoding='utf-8') as csv_file:
+        csv_file.write("telefone;nome\n"
+                       + "".join(f"(11) 97700-{i:04d};Cliente {i}\n" for i in range(2, 20) if i not in (5, 6)) # 0, 1 e 5 saíram
+                       + "11 97700-0003;Cliente 3\n" # Mesmo contato em outro formato
+                       + "(11) 97700-0006;Cliente Seis\n" # Nome alterado
+                       + "(11) 97700-0021;Novo 21\n(11) 97700-0022;Novo 22\n(11) 97700-0021;Novo 21 de novo\n")
+    list_id, imported, _, _ = dbm.import_contact_list(
+        "semanal", csv_processor.iter_contacts_from_csv(week_1_csv, with_row_hashes=True), week_1_csv, "semana1")
+    assert imported == 20
+    first_import_id = dbm.get_contact_list_imports(list_id)[0]['import_id']
+
+    known_row_hashes = dbm.get_contact_row_hashes(list_id)
+    report = csv_processor.IngestReport(week_2_csv)
+    changed_contacts = list(csv_processor.iter_contacts_from_csv(week_2_csv, report, known_row_hashes=known_row_hashes))
+    assert report.unchanged == 16 and len(changed_contacts) == 5, "Só as linhas alteradas são normalizadas"
+    summary = dbm.reimport_contact_list(list_id, changed_contacts, known_row_hashes, week_2_csv, "semana2")
+    assert (summary['inserted'], summary['updated'], summary['deleted'], summary['duplicates']) == (2, 1, 3, 2)
+    assert summary['unchanged'] == 16, "Linha duplicada do 3 fica de fora; o 6 foi alterado"
+    assert dbm.get_contact_list(list_id)['contact_count'] == 19 and dbm.get_contact_list(list_id)['content_hash'] == "semana2"
+    assert [row['import_id'] for row in dbm.get_contact_list_imports(list_id)] == [summary['import_id'], first_import_id]
+
+    campaign_id_10 = "test_campaign_new_contacts"
+    assert dbm.add_campaign(campaign_id_10, "semanal", "Oi {{nome}}", list_id=list_id) == True
+    assert dbm.enqueue_contact_list(campaign_id_10, list_id, since_import_id=first_import_id) == (2, 0, 0, 0)
+    assert [(record.contact_phone, record.contact_name) for record in dbm.iter_pending_dispatches(campaign_id_10)] == [
+        ("5511977000021", "Novo 21"), ("5511977000022", "Novo 22")], "Só os contatos novos"
+    assert dbm.enqueue_contact_list(campaign_id_10, list_id)[0] == 17, "Campanha completa (sem repetir os novos)"
+
+    known_row_hashes = dbm.get_contact_row_hashes(list_id) # A mesma versão de novo: só as linhas repetidas voltam
+    assert [contact['nome'] for contact in csv_processor.iter_contacts_from_csv(week_2_csv, known_row_hashes=known_row_hashes)] == [
+        "Cliente 3", "Novo 21 de novo"]
+    summary = dbm.reimport_contact_list(list_id, [], known_row_hashes)
+    assert (summary['inserted'], summary['updated'], summary['deleted'], summary['unchanged']) == (0, 0, 0, 19)
+    os.remove(week_1_csv)
+    os.remove(week_2_csv)
+    print("Atualização incremental de lista verificada.")
+
+    # 20. Testar Classificação das falhas de envio (retry_policy)
+    print("\n[TESTE 20] Classificação das falhas de envio (retry_policy)...")
+    empty_image = "test_imagem_vazia.png"
+    open(empty_image, 'wb').close()
+    local_failures = [ # Respostas reais do wpp_connector para erros nos dados do envio (nada é enviado ao servidor)
+        wpp_connector.send_whatsapp_message("", "Oi")[1],
+        wpp_connector.send_whatsapp_image_message("5562999990001", "")[1],
+        wpp_connector.send_whatsapp_image_message("5562999990001", "test_imagem_inexistente.png")[1],
+        wpp_connector.send_whatsapp_image_message("5562999990001", empty_image)[1],
+        wpp_connector.send_whatsapp_image_message("5562999990001", os.getcwd())[1], # Diretório: erro ao ler a imagem
+    ]
+    os.remove(empty_image)
+    for api_response_data in local_failures:
+        assert api_response_data['kind'] == wpp_connector.ERROR_KIND_INVALID_INPUT, api_response_data
+        assert retry_policy.classify_failure(api_response_data) == retry_policy.PERMANENT, api_response_data
+        assert retry_policy.plan_failure(api_response_data, 1) == ("SENT_FAILED", 1, None), "Falha local não é reenviada"
+    class NonJsonSuccessClient: # Servidor que confirma o envio (2xx) com um corpo que não é JSON
+        def auth_headers(self, session_name):
+            return {"Authorization": "Bearer teste"}
+        def post(self, session_name, action, **kwargs):
+            response = requests.Response()
+            response.status_code, response._content, response.encoding = 201, b"OK", "utf-8"
+            return response
+    test_image = "test_imagem_envio.png"
+    with open(test_image, 'wb') as image_file:
+        image_file.write(b"\x89PNG\r\n\x1a\nteste")
+    for sent, api_response_data in [
+            wpp_connector.send_whatsapp_message("5562999990001", "Oi", client=NonJsonSuccessClient()),
+            wpp_connector.send_whatsapp_image_message("5562999990001", test_image, client=NonJsonSuccessClient())]:
+        assert sent and api_response_data == {"status_code": 201, "raw_response": "OK"}, "Envio confirmado não é reenviado"
+    os.remove(test_image)
+    for api_response_data in [{"error": "Read timed out."}, {"error": "Falha ao obter/gerar token JWT para autenticação."},
+                              {"status_code": 500}, {"status_code": 429}, {"status_code": 401}, None]:
+        assert retry_policy.classify_failure(api_response_data) == retry_policy.TRANSIENT, api_response_data
+    assert retry_policy.classify_failure({"status_code": 400, "error": "número inválido"}) == retry_policy.PERMANENT
+    assert retry_policy.plan_failure({"status_code": 404}, 0) == ("SENT_FAILED", 0, None)
+
+    now = datetime.datetime.now()
+    status, retry_count, next_attempt_at = retry_policy.plan_failure({"error": "Read timed out."}, 0, now=now)
+    assert (status, retry_count) == ("RETRY_SCHEDULED", 1) and next_attempt_at > now
+    assert retry_policy.plan_failure({"status_code": 503}, RETRY_MAX_ATTEMPTS - 1, now=now)[:2] == ("RETRY_SCHEDULED", RETRY_MAX_ATTEMPTS)
+    assert retry_policy.plan_failure({"status_code": 503}, RETRY_MAX_ATTEMPTS, now=now) == ("DEAD_LETTER", RETRY_MAX_ATTEMPTS, None)
+    print("Classificação das falhas de envio verificada.")
+
+    # 21. Testar Normalização de telefones (phone_normalizer)
+    print("\n[TESTE 21] Normalização de telefones (phone_normalizer)...")
+    expected_results = {
+        "(62) 99999-0001": ("5562999990001", None),
+        "(20) 99999-0001": (None, 'ddd_invalido'), # DDD 20 não existe
+        "(62) 19999-0001": (None, 'numero_invalido'), # 11 dígitos sem o 9
+        "062999990001": ("5562999990001", None), # Prefixo nacional 0
+        "0 41 62 99999-0001": ("5562999990001", None), # 0 + código de operadora + DDD
+        "+55 62 99999-0001": ("5562999990001", None),
+        "0055 62 99999-0001": ("5562999990001", None),
+        "55 62 99999-0001": ("5562999990001", None), # Código do país sem '+'
+        "+1 (415) 555-0100": ("14155550100", None), # Outro país: só a checagem de tamanho do E.164
+        "001 415 555 0100": ("14155550100", None),
+        "+1 555": (None, 'tamanho_invalido'),
+        "+1 415 555 0100 1234 5": (None, 'tamanho_invalido'), # 16 dígitos
+        "9999-0001": (None, 'tamanho_invalido'), # Sem DDD
+        "62 99999-0001 12": (None, 'tamanho_invalido'),
+        "+55 62 99999-0001 1": (None, 'tamanho_invalido'),
+        None: (None, 'sem_telefone'),
+        "": (None, 'sem_telefone'),
+        "sem número": (None, 'sem_telefone'),
+    }
+    options = {'add_ninth_digit': True, 'accept_landlines': False}
+    phones = list(expected_results)
+    assert phone_normalizer.normalize_phones(phones, **options) == [expected_results[phone] for phone in phones]
+
+    old_mobile = "(62) 9999-0001" # Celular com 8 dígitos
+    assert phone_normalizer.normalize_phone(old_mobile, add_ninth_digit=True) == ("5562999990001", 'nono_digito_adicionado')
+    assert phone_normalizer.normalize_phone(old_mobile, add_ninth_digit=False) == (None, 'nono_digito_ausente')
+    assert phone_normalizer.normalize_phone("+55 62 8999-0001", add_ninth_digit=True) == ("5562989990001", 'nono_digito_adicionado')
+    landline = "(62) 3212-0001"
+    assert phone_normalizer.normalize_phone(landline, accept_landlines=False) == (None, 'telefone_fixo')
+    assert phone_normalizer.normalize_phone(landline, accept_landlines=True) == ("556232120001", None)
+    assert phone_normalizer.normalize_phone("(62) 1212-0001", accept_landlines=True) == (None, 'numero_invalido')
+    assert phone_normalizer.normalize_phone("(62) 99999-0001", default_country="351") == ("35162999990001", None) # Outro país padrão: só a checagem de tamanho
+    # Sem opções, valem PHONE_ADD_MISSING_NINTH_DIGIT e PHONE_ACCEPT_LANDLINES do config
+    assert phone_normalizer.normalize_phone(old_mobile) == phone_normalizer.normalize_phone(old_mobile, add_ninth_digit=PHONE_ADD_MISSING_NINTH_DIGIT)
+    assert phone_normalizer.normalize_phone(landline) == phone_normalizer.normalize_phone(landline, accept_landlines=PHONE_ACCEPT_LANDLINES)
+    assert phone_normalizer.phone_digits("+55 (62) 9999-0001") == "556299990001"
+    print("Normalização de telefones verificada.")
+
+    # 22. Testar Estado publicado pelos workers (session_rates/worker_stats)
+    print("\n[TESTE 22] Estado publicado pelos workers (session_rates/worker_stats)...")
+    session_pool = SessionPool(["test_sessao_a", "test_sessao_b"])
+    session_pool.sessions[1].rate_controller.mark_disconnected()
+    session_pool.sessions[0].rate_controller.record_result(False, 0.1, 503) # Sobrecarga: reduz a taxa
+    dispatch_engine.publish_worker_stats("test_worker_1", session_pool) # Outro processo lê pelo BD
+    session_rates = dbm.get_session_rates()
+    assert [rate['session'] for rate in session_rates] == ["test_sessao_a", "test_sessao_b"]
+    for rate, session in zip(session_rates, session_pool.sessions):
+        snapshot = session.rate_controller.snapshot()
+        assert rate['worker_id'] == "test_worker_1" and rate['connected'] == snapshot['connected']
+        assert (rate['rate'], rate['failures'], rate['decreases']) == (snapshot['rate'], snapshot['failures'], snapshot['decreases'])
+    assert session_rates[0]['decreases'] == 1 and session_rates[1]['connected'] == False
+    assert campaign_scheduler.current_send_budget() == session_rates[0]['rate'], "Orçamento: sessões conectadas"
+    stale_time = datetime.datetime.now() + datetime.timedelta(hours=1)
+    assert campaign_scheduler.current_send_budget(stale_time) == RATE_INITIAL_SENDS_PER_SECOND * len(WPPCONNECT_SESSION_NAMES)
+
+    later = datetime.datetime.now() + datetime.timedelta(seconds=120)
+    dbm.save_session_rates("test_worker_2", [SessionPool(["test_sessao_b"]).sessions[0].rate_controller.snapshot()], now=later)
+    assert [(rate['session'], rate['worker_id']) for rate in dbm.get_session_rates(max_age_seconds=60, now=later)] == [
+        ("test_sessao_b", "test_worker_2")], "Sessão de um worker parado sai da lista; a outra é substituída"
+    stats_by_worker = {worker['worker_id']: worker for worker in dbm.get_worker_stats()}
+    assert stats_by_worker['test_worker_1']['client'] == json.loads(json.dumps(wpp_connector.get_client().stats()))
+    assert stats_by_worker['test_worker_1']['media_cache'] == wpp_connector.get_media_cache().stats()
+    dbm.save_worker_stats("test_worker_2", {'requests': 7}, {'entries': 1}, now=later) # Apaga as de workers parados
+    assert [(worker['worker_id'], worker['client']['requests']) for worker in dbm.get_worker_stats(now=later)] == [("test_worker_2", 7)]
+    assert [worker['worker_id'] for worker in dbm.get_worker_stats(max_age_seconds=3600)] == ["test_worker_2"], "test_worker_1 foi removido"
+    print("Taxa das sessões e estatísticas dos workers verificadas.")
+
     print("\n--- Testes do Banco de Dados Concluídos ---")
     print(f"Se todos os 'asserts' passaram, as funções básicas estão operando como esperado.")
     print(f"Recomendação final: Abra o arquivo '{DB_FILE_NAME}' com um visualizador de SQLite (como DB Browser for SQLite) para inspecionar os dados e a estrutura das tabelas.")
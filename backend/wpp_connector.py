@@ -4,44 +4,304 @@ import json
 import base64
 import os
 import mimetypes # ### NOVA LINHA ### Importar mimetypes
+import threading
+import time
+from collections import OrderedDict
 import sys
 sys.path.insert(0, 'C:\\Users\\Gestão MX\\Documents\\StoreBot') # Ajuste o caminho conforme necessário
 
+from requests.adapters import HTTPAdapter
+
 from backend.config import (
     WPPCONNECT_SERVER_URL,
-    WPPCONNECT_API_ENDPOINT_SEND_IMAGE,
-    WPPCONNECT_API_ENDPOINT_SEND_TEXT,
-    # WPPCONNECT_SESSION_NAME # Removido se não usado diretamente aqui, já está em config
+    WPPCONNECT_SESSION_NAME,
+    WPPCONNECT_HTTP_POOL_CONNECTIONS,
+    WPPCONNECT_HTTP_POOL_MAXSIZE,
+    WPPCONNECT_CONNECT_TIMEOUT,
+    WPPCONNECT_ENDPOINT_TIMEOUTS,
+    WPPCONNECT_DEFAULT_READ_TIMEOUT,
+    MEDIA_CACHE_MAX_ENTRIES,
+    MEDIA_CACHE_MAX_BYTES,
 )
 
-from backend.auth_manager import generate_jwt_token, get_current_jwt_token # Ajuste conforme necessário
+from backend.auth_manager import token_manager, get_current_jwt_token # Ajuste conforme necessário
 #import backend.auth_manager # auth_manager em vez de from auth_manager import ... para clareza
 
-# ... (função send_whatsapp_message permanece a mesma) ...
+# 'kind' das falhas detectadas antes de chamar o servidor por causa dos dados do envio (telefone ou mensagem
+# ausentes, imagem inexistente, vazia ou ilegível): reenviar não adianta (retry_policy as trata como permanentes)
+ERROR_KIND_INVALID_INPUT = "invalid_input"
+
+def session_api_url(session_name, action):
+    """Monta a URL de um endpoint da API para uma sessão específica (ex: 'send-message')."""
+    return f"{WPPCONNECT_SERVER_URL}/api/{session_name}/{action}"
+
+class WppClient:
+    """
+    Cliente HTTP de longa duração para o wppconnect-server.
+    Mantém conexões keep-alive em um pool (reaproveitadas entre envios e threads),
+    reutiliza os headers de autenticação enquanto o token da sessão não muda e
+    aplica timeouts por endpoint. `stats()` mostra reuso de conexões e latência.
+    Uma resposta 401 renova o token da sessão (auth_manager.token_manager) e a
+    requisição é repetida uma única vez com o token novo.
+    """
+
+    def __init__(self, pool_connections=WPPCONNECT_HTTP_POOL_CONNECTIONS, pool_maxsize=WPPCONNECT_HTTP_POOL_MAXSIZE,
+                 connect_timeout=WPPCONNECT_CONNECT_TIMEOUT, endpoint_timeouts=None):
+        self.http = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=max(1, pool_maxsize))
+        self.http.mount("http://", self.adapter)
+        self.http.mount("https://", self.adapter)
+        self.connect_timeout = connect_timeout
+        self.endpoint_timeouts = dict(WPPCONNECT_ENDPOINT_TIMEOUTS, **(endpoint_timeouts or {}))
+        self._headers_by_session = {} # session_name -> (token, headers)
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._replays = 0 # Requisições repetidas após um 401
+        self._latency_by_endpoint = {} # action -> [quantidade, soma_segundos, max_segundos]
+
+    def timeout_for(self, action):
+        return (self.connect_timeout, self.endpoint_timeouts.get(action, WPPCONNECT_DEFAULT_READ_TIMEOUT))
+
+    def auth_headers(self, session_name):
+        """Headers com o token JWT da sessão (gerado ou renovado se necessário). Retorna None se não houver token."""
+        jwt_token = get_current_jwt_token(session_name)
+        if not jwt_token:
+            return None
+        cached = self._headers_by_session.get(session_name)
+        if cached and cached[0] == jwt_token:
+            return cached[1]
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {jwt_token}"
+        }
+        self._headers_by_session[session_name] = (jwt_token, headers)
+        return headers
+
+    def request(self, method, session_name, action, headers=None, **kwargs):
+        """
+        Executa uma chamada ao endpoint `action` da sessão, registrando a latência.
+        Se a resposta for 401 e os headers tiverem um token Bearer, renova o token e repete a chamada uma vez.
+        """
+        kwargs.setdefault("timeout", self.timeout_for(action))
+        response = self._timed_request(method, session_name, action, headers, kwargs)
+        rejected_token = _bearer_token(headers)
+        if response.status_code != 401 or rejected_token is None:
+            return response
+        if not token_manager.handle_unauthorized(session_name, rejected_token):
+            return response # Não foi possível renovar: o chamador recebe o 401 original
+        new_headers = dict(headers)
+        new_headers.update(self.auth_headers(session_name) or {})
+        with self._lock:
+            self._replays += 1
+        return self._timed_request(method, session_name, action, new_headers, kwargs)
+
+    def _timed_request(self, method, session_name, action, headers, kwargs):
+        started = time.perf_counter()
+        try:
+            return self.http.request(method, session_api_url(session_name, action), headers=headers, **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._requests += 1
+                entry = self._latency_by_endpoint.setdefault(action, [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] = max(entry[2], elapsed)
+
+    def post(self, session_name, action, headers=None, **kwargs):
+        return self.request("POST", session_name, action, headers=headers, **kwargs)
+
+    def get(self, session_name, action, headers=None, **kwargs):
+        return self.request("GET", session_name, action, headers=headers, **kwargs)
+
+    def _connections_opened(self):
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in list(pools.keys()))
+
+    def stats(self):
+        """Resumo de uso: requisições, conexões TCP abertas x reaproveitadas e latência por endpoint."""
+        with self._lock:
+            total_requests = self._requests
+            errors = self._errors
+            replays = self._replays
+            latency = {
+                action: {
+                    'requests': count,
+                    'avg_ms': round(total / count * 1000, 1) if count else 0.0,
+                    'max_ms': round(maximum * 1000, 1),
+                }
+                for action, (count, total, maximum) in self._latency_by_endpoint.items()
+            }
+        connections_opened = self._connections_opened()
+        return {
+            'requests': total_requests,
+            'errors': errors,
+            'connections_opened': connections_opened,
+            'connections_reused': max(0, total_requests - connections_opened),
+            'replays_after_401': replays,
+            'latency_by_endpoint': latency,
+            'auth': token_manager.metrics(),
+        }
+
+    def close(self):
+        self.http.close()
+
+
+def _bearer_token(headers):
+    authorization = (headers or {}).get("Authorization", "")
+    return authorization[len("Bearer "):] if authorization.startswith("Bearer ") else None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Retorna o WppClient compartilhado do processo (criado na primeira chamada)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = WppClient()
+    return _client
+
+class EmptyMediaError(ValueError):
+    """O arquivo de mídia existe, mas está vazio."""
+
+
+def guess_image_mime_type(image_path):
+    """Determina o MIME type da imagem (mimetypes e, se falhar, a extensão do arquivo)."""
+    mime_type, _ = mimetypes.guess_type(image_path)
+    if mime_type:
+        return mime_type
+    extension = os.path.splitext(image_path)[1].lower()
+    if extension == ".png":
+        return "image/png"
+    if extension in [".jpg", ".jpeg"]:
+        return "image/jpeg"
+    if extension == ".gif":
+        return "image/gif"
+    if extension == ".webp":
+        return "image/webp"
+    print(f"Debug (Imagem): AVISO - Não foi possível determinar o tipo MIME para {image_path}. Usando 'image/jpeg' como padrão.")
+    return "image/jpeg" # Um padrão comum, mas pode não ser o ideal.
+
+
+class MediaPayload:
+    """
+    Imagem já codificada como data URL, com a parte fixa do JSON do /send-image
+    pré-serializada. Só o telefone e a legenda mudam de um envio para outro.
+    """
+    __slots__ = ("filename", "mime_type", "data_url_length", "size_bytes", "_body_suffix")
+
+    def __init__(self, image_path, image_bytes):
+        self.filename = os.path.basename(image_path)
+        self.mime_type = guess_image_mime_type(image_path)
+        data_url = f"data:{self.mime_type};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+        self.data_url_length = len(data_url)
+        self._body_suffix = (
+            ',"base64":' + json.dumps(data_url)
+            + ',"filename":' + json.dumps(self.filename)
+            + ',"isGroup":false}'
+        ).encode('utf-8')
+        self.size_bytes = len(self._body_suffix)
+
+    def build_body(self, phone_number, caption):
+        """Monta o corpo JSON (bytes) do /send-image para um destinatário."""
+        return b''.join((
+            b'{"phone":', json.dumps(phone_number).encode('utf-8'),
+            b',"caption":', json.dumps(caption or "").encode('utf-8'),
+            self._body_suffix,
+        ))
+
+
+class MediaPayloadCache:
+    """
+    Cache LRU de MediaPayload chaveado por (caminho, tamanho, mtime): se o arquivo
+    mudar no disco a entrada antiga deixa de ser usada e é descartada pela LRU.
+    """
+
+    def __init__(self, max_entries=MEDIA_CACHE_MAX_ENTRIES, max_bytes=MEDIA_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_path):
+        """Retorna o MediaPayload da imagem. Levanta FileNotFoundError ou EmptyMediaError."""
+        stat_result = os.stat(image_path)
+        if stat_result.st_size == 0:
+            raise EmptyMediaError(image_path)
+        key = (os.path.abspath(image_path), stat_result.st_size, stat_result.st_mtime_ns)
+        with self._lock: # Também evita que envios simultâneos codifiquem a mesma imagem em paralelo
+            media_payload = self._entries.get(key)
+            if media_payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return media_payload
+            self.misses += 1
+            with open(image_path, "rb") as image_file:
+                media_payload = MediaPayload(image_path, image_file.read())
+            self._entries[key] = media_payload
+            self._total_bytes += media_payload.size_bytes
+            while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+                if len(self._entries) == 1: # Mantém ao menos a imagem atual, mesmo que maior que o limite
+                    break
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted.size_bytes
+            return media_payload
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._total_bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+_media_cache = MediaPayloadCache()
+
+def get_media_cache():
+    return _media_cache
+
+def get_session_status(session_name=WPPCONNECT_SESSION_NAME, client=None):
+    """
+    Consulta o /status-session de uma sessão.
+    Retorna (True, dados) se a sessão estiver CONNECTED, (False, dados/erro) caso contrário.
+    """
+    client = client or get_client()
+    headers = client.auth_headers(session_name)
+    if not headers:
+        return False, {"error": f"Token JWT indisponível para a sessão '{session_name}'."}
+
+    try:
+        response = client.get(session_name, "status-session", headers=headers)
+        session_data = response.json()
+        return session_data.get('status') == 'CONNECTED', session_data
+    except requests.exceptions.RequestException as e:
+        return False, {"error": str(e)}
+    except ValueError: # Resposta não era JSON
+        return False, {"status_code": response.status_code, "error": response.text}
 
-def send_whatsapp_message(phone_number, message):
+def send_whatsapp_message(phone_number, message, client=None, session_name=WPPCONNECT_SESSION_NAME):
     """
     Envia uma mensagem de texto simples para um número do WhatsApp.
+    Usa o WppClient compartilhado (ou `client`, se informado); `session_name` escolhe
+    a sessão (número de WhatsApp) que fará o envio.
     """
     if not phone_number or not message:
         print("Erro (Texto): Número de telefone e mensagem são obrigatórios.")
-        return False, {"error": "Número de telefone e mensagem são obrigatórios."}
-
-    jwt_token = get_current_jwt_token()
-    if not jwt_token:
-        print("Erro (Texto): Falha ao obter token JWT. Tentando gerar um novo...")
-        if not generate_jwt_token():
-            print("Erro Crítico (Texto): Falha ao obter/gerar token JWT para autenticação.")
-            return False, {"error": "Falha ao obter/gerar token JWT para autenticação."}
-        jwt_token = get_current_jwt_token()
-        if not jwt_token:
-            print("Erro Crítico (Texto): Token JWT ainda indisponível após tentativa de geração.")
-            return False, {"error": "Token JWT ainda indisponível após tentativa de geração."}
+        return False, {"error": "Número de telefone e mensagem são obrigatórios.", "kind": ERROR_KIND_INVALID_INPUT}
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {jwt_token}"
-    }
+    client = client or get_client()
+    headers = client.auth_headers(session_name)
+    if not headers:
+        print("Erro Crítico (Texto): Falha ao obter/gerar token JWT para autenticação.")
+        return False, {"error": "Falha ao obter/gerar token JWT para autenticação."}
 
     payload = {
         "phone": phone_number,
@@ -51,14 +311,12 @@ def send_whatsapp_message(phone_number, message):
         # "isLid": False, # Opcional, pode remover se não usar
     }
 
-    # WPPCONNECT_API_ENDPOINT_SEND_TEXT deve estar definido em config.py
-    # Ex: WPPCONNECT_API_ENDPOINT_SEND_TEXT = f"/api/{WPPCONNECT_SESSION_NAME}/send-message"
-    full_api_url = f"{WPPCONNECT_SERVER_URL}{WPPCONNECT_API_ENDPOINT_SEND_TEXT}"
+    full_api_url = session_api_url(session_name, "send-message")
 
     print(f"Debug (Texto): Enviando para {full_api_url} com payload: {json.dumps(payload, indent=2)}")
 
     try:
-        response = requests.post(full_api_url, headers=headers, json=payload, timeout=30) # Timeout de 30s
+        response = client.post(session_name, "send-message", headers=headers, json=payload)
 
         if 200 <= response.status_code < 300:
             print(f"Mensagem de texto enviada com sucesso para {phone_number}. Status: {response.status_code}")
@@ -83,99 +341,46 @@ def send_whatsapp_message(phone_number, message):
         print(f"Erro inesperado em send_whatsapp_message: {e}")
         return False, {"error": str(e)}
 
-def send_whatsapp_image_message(phone_number, image_path, caption=""):
+def send_whatsapp_image_message(phone_number, image_path, caption="", client=None, session_name=WPPCONNECT_SESSION_NAME):
+    """
+    Envia uma imagem (com legenda) para um número do WhatsApp.
+    A imagem é lida e codificada uma única vez por versão do arquivo (MediaPayloadCache);
+    a cada envio só o telefone e a legenda são serializados.
+    """
     if not phone_number or not image_path:
-        return False, {"error": "Número de telefone e caminho da imagem são obrigatórios."}
+        return False, {"error": "Número de telefone e caminho da imagem são obrigatórios.", "kind": ERROR_KIND_INVALID_INPUT}
 
-    print(f"Debug (Imagem): Tentando acessar imagem em: {os.path.abspath(image_path)}")
-    if not os.path.exists(image_path):
+    try:
+        media_payload = get_media_cache().get(image_path)
+    except FileNotFoundError:
         print(f"Debug (Imagem): ERRO - Arquivo de imagem NÃO ENCONTRADO em: {os.path.abspath(image_path)}")
-        return False, {"error": f"Arquivo de imagem não encontrado em: {image_path}"}
-    if os.path.getsize(image_path) == 0:
+        return False, {"error": f"Arquivo de imagem não encontrado em: {image_path}", "kind": ERROR_KIND_INVALID_INPUT}
+    except EmptyMediaError:
         print(f"Debug (Imagem): ERRO - Arquivo de imagem está VAZIO: {os.path.abspath(image_path)}")
-        return False, {"error": f"Arquivo de imagem está vazio: {image_path}"}
-
-    jwt_token = get_current_jwt_token()
-    if not jwt_token:
-        print("Debug (Imagem): Falha ao obter token JWT. Tentando gerar um novo...")
-        if not generate_jwt_token():
-             return False, {"error": "Falha ao obter/gerar token JWT para autenticação."}
-        jwt_token = get_current_jwt_token()
-        if not jwt_token:
-            return False, {"error": "Token JWT ainda indisponível após tentativa de geração."}
-
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {jwt_token}"
-    }
-
-    image_base64_pure = None
-    try:
-        with open(image_path, "rb") as image_file:
-            image_bytes = image_file.read()
-            image_base64_pure = base64.b64encode(image_bytes).decode('utf-8')
+        return False, {"error": f"Arquivo de imagem está vazio: {image_path}", "kind": ERROR_KIND_INVALID_INPUT}
     except Exception as e:
-        print(f"Debug (Imagem): ERRO ao ler e converter imagem para base64 pura: {e}")
-        return False, {"error": f"Erro ao processar imagem: {str(e)}"}
-
-    if not image_base64_pure:
-        print("Debug (Imagem): ERRO CRÍTICO - String base64 pura da imagem ficou vazia APÓS a conversão.")
-        return False, {"error": "Falha interna: string base64 pura da imagem ficou vazia."}
-    
-    # ### ALTERAÇÃO: Determinar MIME type e adicionar prefixo Data URL ###
-    mime_type, _ = mimetypes.guess_type(image_path)
-    if not mime_type:
-        # Tenta inferir pelo nome do arquivo se o guess_type falhar
-        extension = os.path.splitext(image_path)[1].lower()
-        if extension == ".png":
-            mime_type = "image/png"
-        elif extension in [".jpg", ".jpeg"]:
-            mime_type = "image/jpeg"
-        elif extension == ".gif":
-            mime_type = "image/gif"
-        elif extension == ".webp":
-            mime_type = "image/webp"
-        else:
-            print(f"Debug (Imagem): AVISO - Não foi possível determinar o tipo MIME para {image_path}. Usando 'image/jpeg' como padrão.")
-            mime_type = "image/jpeg" # Um padrão comum, mas pode não ser o ideal.
+        print(f"Debug (Imagem): ERRO ao ler e converter imagem para base64: {e}")
+        return False, {"error": f"Erro ao processar imagem: {str(e)}", "kind": ERROR_KIND_INVALID_INPUT}
 
-    image_base64_with_prefix = f"data:{mime_type};base64,{image_base64_pure}"
-    # ### FIM DA ALTERAÇÃO ###
-
-    print(f"Debug (Imagem): String base64 PURA (início): {image_base64_pure[:80]}...")
-    print(f"Debug (Imagem): String base64 COM PREFIXO (início): {image_base64_with_prefix[:120]}...") # Log da string com prefixo
-
-
-    filename = os.path.basename(image_path)
-
-    payload = {
-        "phone": phone_number,
-        "base64": image_base64_with_prefix, # ### ALTERAÇÃO: Usar a string com prefixo ###
-        "filename": filename,
-        "caption": caption,
-        "isGroup": False
-    }
-
-    payload_to_log = payload.copy()
-    if len(payload_to_log.get("base64", "")) > 200:
-        payload_to_log["base64"] = payload_to_log["base64"][:80] + f"... (total {len(payload_to_log.get('base64',''))} chars)"
-    print(f"Debug (Imagem): Payload JSON a ser enviado (base64 com prefixo, truncada para log):\n{json.dumps(payload_to_log, indent=2)}")
-
-    # A URL da API é construída usando WPPCONNECT_API_ENDPOINT_SEND_IMAGE do config.py
-    # Ex: full_api_url = f"{config.WPPCONNECT_SERVER_URL}{config.WPPCONNECT_API_ENDPOINT_SEND_IMAGE}"
-    # Certifique-se que WPPCONNECT_API_ENDPOINT_SEND_IMAGE em config.py é:
-    # f"/api/{WPPCONNECT_SESSION_NAME}/send-image"
-    
-    # Corrigindo a obtenção da URL da API (assumindo que está em config.py)
-    full_api_url = f"{WPPCONNECT_SERVER_URL}{WPPCONNECT_API_ENDPOINT_SEND_IMAGE}"
+    client = client or get_client()
+    headers = client.auth_headers(session_name)
+    if not headers:
+        print("Debug (Imagem): Falha ao obter/gerar token JWT para autenticação.")
+        return False, {"error": "Falha ao obter/gerar token JWT para autenticação."}
 
+    body = media_payload.build_body(phone_number, caption)
+    print(f"Debug (Imagem): Enviando '{media_payload.filename}' ({media_payload.mime_type}, base64 com {media_payload.data_url_length} chars) para {phone_number}")
 
     try:
-        response = requests.post(full_api_url, headers=headers, json=payload, timeout=60)
+        response = client.post(session_name, "send-image", headers=headers, data=body)
 
         if 200 <= response.status_code < 300:
             print(f"Imagem enviada com sucesso para {phone_number}. Status: {response.status_code}")
-            return True, response.json()
+            try:
+                return True, response.json()
+            except ValueError: # requests.exceptions.JSONDecodeError (subclasse de RequestException: não pode cair no except abaixo)
+                print(f"Sucesso no envio, mas resposta não era JSON: {response.text}")
+                return True, {"status_code": response.status_code, "raw_response": response.text}
         else:
             print(f"Falha ao enviar imagem para {phone_number}. Status: {response.status_code}, Resposta: {response.text}")
             response_json_content = None
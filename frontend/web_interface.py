@@ -5,20 +5,23 @@ import os
 # Se 'frontend' e 'backend' são pastas irmãs dentro de 'storebot':
 sys.path.insert(0, 'C:\\Users\\Gestão MX\\Documents\\StoreBot')
 
-from flask import Flask, render_template, request, redirect, url_for, flash, current_app
+from flask import Flask, render_template, request, redirect, url_for, flash, current_app, jsonify
 from flask_socketio import SocketIO, emit
 import uuid
-import time
-from threading import Thread
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 
 # Importar módulos do backend
 from backend import database_manager
 from backend import csv_processor
-from backend import wpp_connector
-from backend import auth_manager
-from backend.config import DEFAULT_MESSAGE_DELAY_SECONDS
+from backend import campaign_scheduler
+from backend.config import (
+    WEB_PROGRESS_POLL_SECONDS,
+    CAMPAIGN_DEFAULT_PRIORITY,
+    CAMPAIGN_MAX_PRIORITY,
+    DISPATCH_LOG_PAGE_SIZE,
+    DISPATCH_LOG_MAX_PAGE_SIZE,
+)
 
 # Configuração do Flask
 app = Flask(__name__)
@@ -29,6 +32,7 @@ UPLOAD_FOLDER_CSV = 'uploaded_csvs'
 UPLOAD_FOLDER_IMAGES = 'uploaded_campaign_images'
 ALLOWED_EXTENSIONS_CSV = {'csv'}
 ALLOWED_EXTENSIONS_IMAGES = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+DISPATCH_LOG_STATUSES = ['PENDING', 'SENT_SUCCESS', 'SENT_FAILED', 'RETRY_SCHEDULED', 'DEAD_LETTER', 'SUPPRESSED']
 
 app.config['UPLOAD_FOLDER_CSV'] = UPLOAD_FOLDER_CSV
 app.config['UPLOAD_FOLDER_IMAGES'] = UPLOAD_FOLDER_IMAGES
@@ -48,141 +52,168 @@ def allowed_file(filename, allowed_extensions):
 def inject_now():
     return {'now': datetime.now()}
 
-# --- Função de Disparo em Background ---
-def process_campaign_dispatches_web(flask_app_context, socketio_instance, campaign_id):
-    with flask_app_context: # Essencial para acesso ao current_app e configurações em threads
+def describe_schedule(estimate):
+    """Texto curto com a previsão de início/término de uma campanha (campaign_scheduler.estimate_schedule)."""
+    if not estimate:
+        return ''
+    if estimate['finish_at'] is None:
+        return 'Término previsto: indefinido (fila muito longa)'
+    finish_text = f"Término previsto: {estimate['finish_at'].strftime('%d/%m %H:%M')}"
+    if not estimate['in_window'] and estimate['start_at'] is not None:
+        return f"Fora da janela de envio. Retoma em {estimate['start_at'].strftime('%d/%m %H:%M')}. {finish_text}"
+    return finish_text
+
+def campaign_totals(status_counts):
+    """
+    Resume os contadores por status (campaign_stats) em total, sucesso, falha e processados.
+    Contatos retirados por estarem na lista de supressão não contam no total (nada será enviado a eles).
+    """
+    success = status_counts.get("SENT_SUCCESS", 0)
+    failed = status_counts.get("SENT_FAILED", 0) + status_counts.get("DEAD_LETTER", 0)
+    suppressed = status_counts.get("SUPPRESSED", 0)
+    return {'total': sum(status_counts.values()) - suppressed, 'success': success, 'failed': failed,
+            'processed': success + failed, 'suppressed': suppressed}
+
+def describe_ingest_rejections(report):
+    """Mensagem curta com as linhas rejeitadas na leitura de um CSV (csv_processor.IngestReport), por motivo."""
+    reasons = ", ".join(f"{reason.replace('_', ' ')}: {count}" for reason, count in sorted(report.rejected.items()))
+    example = next(iter(report.samples.get(next(iter(sorted(report.rejected))), [])), None)
+    example_text = f" Ex: linha {example[0]}." if example else ""
+    return f"{report.rejected_total} linha(s) do CSV '{report.filepath}' ignorada(s) ({reasons}).{example_text}"
+
+def import_csv_as_list(filepath_abs, filename):
+    """
+    Importa um CSV da pasta de uploads como lista de contatos (contact_lists): o arquivo é lido e
+    normalizado uma única vez e depois removido. Um arquivo com o mesmo conteúdo de uma lista já
+    importada reaproveita a lista. Informa o resultado via flash e retorna o list_id (ou None).
+    """
+    content_hash = csv_processor.file_content_hash(filepath_abs)
+    existing_list = database_manager.find_contact_list_by_hash(content_hash)
+    if existing_list:
+        flash(f"O arquivo '{filename}' já foi importado como a lista '{existing_list['name']}' "
+              f"({existing_list['contact_count']} contatos).", 'info')
+        os.remove(filepath_abs)
+        return existing_list['list_id']
+
+    report = csv_processor.IngestReport(filename)
+    list_id, contacts_imported, _, contacts_duplicated = database_manager.import_contact_list(
+        filename, csv_processor.iter_contacts_from_csv(filepath_abs, report, with_row_hashes=True),
+        source_filename=filename, content_hash=content_hash
+    )
+    if list_id is None: # Erro no BD: o arquivo fica na pasta para nova tentativa
+        flash(f"Erro ao gravar a lista '{filename}' no banco de dados.", 'danger')
+        return None
+    if report.error or not contacts_imported:
+        database_manager.delete_contact_list(list_id)
+        os.remove(filepath_abs)
+        if report.error:
+            flash(f"Erro ao ler o arquivo '{filename}'. Verifique o formato.", 'danger')
+        else:
+            flash(f"Arquivo '{filename}' sem nenhum contato válido. Nada foi importado.", 'warning')
+        return None
+
+    os.remove(filepath_abs) # A lista passa a existir só no banco
+    flash(f"Lista '{filename}' importada com sucesso! ({contacts_imported} contatos)", 'success')
+    if contacts_duplicated:
+        flash(f"{contacts_duplicated} telefone(s) repetido(s) no arquivo; cada número foi guardado uma única vez.", 'info')
+    if report.rejected_total:
+        flash(describe_ingest_rejections(report), 'warning')
+    return list_id
+
+def reimport_csv_into_list(filepath_abs, filename, contact_list, delete_missing=True):
+    """
+    Atualiza uma lista já importada com uma nova versão do arquivo (reimport_contact_list): só as linhas
+    novas ou alteradas são normalizadas e gravadas. Com `delete_missing`, os contatos que não estão no
+    arquivo saem da lista. O arquivo é removido no fim. Informa o resultado via flash e retorna o
+    resumo da importação (ou None).
+    """
+    try:
+        content_hash = csv_processor.file_content_hash(filepath_abs)
+        if content_hash == contact_list['content_hash']:
+            flash(f"O arquivo '{filename}' é igual à versão atual da lista '{contact_list['name']}'. Nada a atualizar.", 'info')
+            return None
+        known_row_hashes = database_manager.get_contact_row_hashes(contact_list['list_id'])
+        if known_row_hashes is None:
+            flash(f"Erro ao ler a lista '{contact_list['name']}' no banco de dados.", 'danger')
+            return None
+        report = csv_processor.IngestReport(filename)
+        changed_contacts = list(csv_processor.iter_contacts_from_csv(filepath_abs, report, known_row_hashes=known_row_hashes))
+        if report.error or not (report.accepted or report.unchanged):
+            # Sem isso um arquivo ilegível apagaria a lista inteira (nenhuma linha encontrada)
+            flash(f"Erro ao ler o arquivo '{filename}' ou nenhum contato válido. A lista não foi alterada.", 'danger')
+            return None
+        summary = database_manager.reimport_contact_list(
+            contact_list['list_id'], changed_contacts, known_row_hashes, source_filename=filename,
+            content_hash=content_hash, delete_missing=delete_missing
+        )
+    finally:
+        os.remove(filepath_abs)
+    if summary['import_id'] is None:
+        flash(f"Erro ao gravar a atualização da lista '{contact_list['name']}' no banco de dados.", 'danger')
+        return None
+    flash(f"Lista '{contact_list['name']}' atualizada com '{filename}': {summary['inserted']} novo(s), "
+          f"{summary['updated']} alterado(s), {summary['deleted']} removido(s), {summary['unchanged']} sem alteração.", 'success')
+    if report.rejected_total:
+        flash(describe_ingest_rejections(report), 'warning')
+    return summary
+
+def list_imports_by_list(contact_lists):
+    """Importações anteriores à última de cada lista (para "só os contatos novos desde..." ao criar campanha)."""
+    return {contact_list['list_id']: database_manager.get_contact_list_imports(contact_list['list_id'])[1:]
+            for contact_list in contact_lists if contact_list['import_count'] > 1}
+
+# --- Acompanhamento das campanhas em Background ---
+# Os disparos são executados pelo worker separado (python -m backend.dispatch_worker);
+# aqui apenas lemos o progresso no BD e repassamos aos navegadores via Socket.IO.
+def campaign_progress_monitor(socketio_instance):
+    tracked_campaigns = {} # campaign_id -> (sent_at, log_id) do último registro já repassado
+    while True:
+        socketio_instance.sleep(WEB_PROGRESS_POLL_SECONDS)
         try:
-            current_app.logger.info(f"THREAD: Iniciando processamento para campaign_id: {campaign_id}")
-            campaign_details = database_manager.get_campaign_details(campaign_id)
-
-            if not campaign_details:
-                current_app.logger.error(f"THREAD: Campanha {campaign_id} não encontrada.")
-                socketio_instance.emit('campaign_error', {'campaign_id': campaign_id, 'message': 'Campanha não encontrada.'})
-                return
-
-            message_template = campaign_details['message_template']
-            image_filename_from_db = campaign_details['image_filename']
-            image_full_path_for_send = None
-
-            if image_filename_from_db:
-                # Caminho construído a partir da raiz da aplicação Flask (pasta 'frontend')
-                # e da pasta de upload de imagens configurada.
-                image_path_relative_to_frontend = os.path.join(current_app.config['UPLOAD_FOLDER_IMAGES'], image_filename_from_db)
-                image_full_path_for_send = os.path.join(current_app.root_path, image_path_relative_to_frontend)
-
-                if not os.path.exists(image_full_path_for_send):
-                    current_app.logger.warning(f"THREAD: Imagem {image_filename_from_db} não encontrada em {image_full_path_for_send}. Enviando sem imagem.")
-                    socketio_instance.emit('campaign_log', {
-                        'campaign_id': campaign_id,
-                        'message': f"AVISO: Imagem da campanha '{image_filename_from_db}' não encontrada. Disparos seguirão sem imagem."
-                    })
-                    image_full_path_for_send = None
-
-            pending_dispatches = database_manager.get_pending_dispatches_for_campaign(campaign_id)
-            if not pending_dispatches:
-                current_app.logger.info(f"THREAD: Nenhum disparo pendente para {campaign_id}.")
-                # Se não há contatos desde o início, pode ser um status diferente.
-                # Assumindo que se chegou aqui e não há pendentes, é porque já foram processados ou não havia contatos.
-                # O status da campanha já deve ter sido atualizado ao final do processamento anterior.
-                # Se esta é a primeira vez e não há contatos, a criação da campanha deve lidar com isso.
-                # Vamos emitir 'campaign_finished' apenas para garantir que o frontend saiba.
-                final_status_check = database_manager.get_campaign_details(campaign_id)['status']
-                if final_status_check not in ["COMPLETED", "COMPLETED_WITH_ERRORS", "FAILED"]:
-                     database_manager.update_campaign_status(campaign_id, "COMPLETED") # Default se não houver pendentes.
-                     final_status_check = "COMPLETED"
-
-                socketio_instance.emit('campaign_finished', {
-                    'campaign_id': campaign_id,
-                    'status': final_status_check,
-                    'message': 'Nenhum contato pendente encontrado ou campanha já finalizada.'
-                })
-                return
-
-            total_pending = len(pending_dispatches)
-            success_count = 0
-            failure_count = 0
-
-            socketio_instance.emit('campaign_progress', {
-                'campaign_id': campaign_id, 'processed': 0, 'total': total_pending,
-                'success': 0, 'failed': 0,
-                'status_text': f"Iniciando disparos para {total_pending} contatos..."
-            })
-
-            for i, dispatch_row in enumerate(pending_dispatches):
-                log_id = dispatch_row['log_id']
-                contact_phone = dispatch_row['contact_phone']
-                contact_name = dispatch_row['contact_name'] if dispatch_row['contact_name'] else ""
-
-                current_app.logger.info(f"THREAD: Processando {i+1}/{total_pending} para Campanha {campaign_id}: Contato='{contact_name}', Telefone='{contact_phone}'")
-                socketio_instance.emit('dispatch_update', {
-                    'campaign_id': campaign_id, 'log_id': log_id, 'contact_phone': contact_phone,
-                    'contact_name': contact_name, 'status': 'PROCESSING',
-                    'message': f"Processando {contact_name} ({contact_phone})..."
-                })
-
-                personalized_message = message_template.replace("{{nome}}", contact_name if contact_name else "cliente").strip()
-                api_response_data_str = "{}"
-                sent_successfully = False
-
-                if not auth_manager.get_current_jwt_token(): # Garante token JWT
-                    auth_manager.generate_jwt_token()
-
-                if image_full_path_for_send:
-                    current_app.logger.info(f"THREAD: Enviando imagem '{os.path.basename(image_full_path_for_send)}' para {contact_phone}")
-                    sent_successfully, api_response_data = wpp_connector.send_whatsapp_image_message(
-                        contact_phone, image_full_path_for_send, personalized_message
-                    )
-                else:
-                    current_app.logger.info(f"THREAD: Enviando texto para {contact_phone}")
-                    sent_successfully, api_response_data = wpp_connector.send_whatsapp_message(
-                        contact_phone, personalized_message
-                    )
-                api_response_data_str = str(api_response_data)
-
-                if sent_successfully:
-                    success_count += 1
-                    database_manager.update_dispatch_log(log_id, "SENT_SUCCESS", personalized_message, api_response_data_str)
+            in_progress_ids = {c['campaign_id'] for c in database_manager.get_campaigns_with_status(['IN_PROGRESS'])}
+            for campaign_id in in_progress_ids - set(tracked_campaigns):
+                tracked_campaigns[campaign_id] = (datetime.now(), 0)
+
+            schedule_estimates = campaign_scheduler.get_schedule_estimates() if in_progress_ids else {}
+            for campaign_id in list(tracked_campaigns):
+                for dispatch_row in database_manager.get_dispatch_updates_since(campaign_id, *tracked_campaigns[campaign_id]):
+                    tracked_campaigns[campaign_id] = (dispatch_row['sent_at'], dispatch_row['log_id'])
+                    result_label = {
+                        "SENT_SUCCESS": "Sucesso",
+                        "RETRY_SCHEDULED": f"Falha temporária, reenvio {dispatch_row['retry_count']} agendado",
+                        "DEAD_LETTER": "Falha após esgotar os reenvios",
+                        "SUPPRESSED": "Não enviado (lista de supressão)",
+                    }.get(dispatch_row['status'], "Falha")
                     socketio_instance.emit('dispatch_update', {
-                        'campaign_id': campaign_id, 'log_id': log_id, 'contact_phone': contact_phone,
-                        'status': 'SENT_SUCCESS', 'api_response': api_response_data_str,
-                        'message': f"Sucesso: {contact_name} ({contact_phone})"
+                        'campaign_id': campaign_id, 'log_id': dispatch_row['log_id'], 'contact_phone': dispatch_row['contact_phone'],
+                        'status': dispatch_row['status'], 'api_response': dispatch_row['api_response'],
+                        'message': f"{result_label}: {dispatch_row['contact_name'] or ''} ({dispatch_row['contact_phone']})"
                     })
-                else:
-                    failure_count += 1
-                    database_manager.update_dispatch_log(log_id, "SENT_FAILED", personalized_message, api_response_data_str)
-                    socketio_instance.emit('dispatch_update', {
-                        'campaign_id': campaign_id, 'log_id': log_id, 'contact_phone': contact_phone,
-                        'status': 'SENT_FAILED', 'api_response': api_response_data_str,
-                        'message': f"Falha: {contact_name} ({contact_phone})"
+
+                totals = campaign_totals(database_manager.get_campaign_stats(campaign_id))
+                total, success, failed = totals['total'], totals['success'], totals['failed']
+
+                if campaign_id in in_progress_ids:
+                    one_minute_ago = datetime.now() - timedelta(minutes=1)
+                    sent_last_minute = database_manager.count_dispatches_by_status(campaign_id, sent_since=one_minute_ago)
+                    socketio_instance.emit('campaign_progress', {
+                        'campaign_id': campaign_id, 'processed': success + failed, 'total': total,
+                        'success': success, 'failed': failed,
+                        'send_rate': sent_last_minute.get("SENT_SUCCESS", 0),
+                        'schedule_text': describe_schedule(schedule_estimates.get(campaign_id)),
+                        'status_text': f"Processado {success + failed} de {total}..."
                     })
+                    continue
 
-                socketio_instance.emit('campaign_progress', {
-                    'campaign_id': campaign_id, 'processed': i + 1, 'total': total_pending,
-                    'success': success_count, 'failed': failure_count,
-                    'status_text': f"Processado {i+1} de {total_pending}..."
+                # Saiu de IN_PROGRESS: o worker finalizou (ou pausou) a campanha
+                del tracked_campaigns[campaign_id]
+                campaign = database_manager.get_campaign_details(campaign_id)
+                socketio_instance.emit('campaign_finished', {
+                    'campaign_id': campaign_id, 'status': campaign['status'] if campaign else None,
+                    'success_count': success, 'failure_count': failed, 'total_dispatches': total
                 })
-
-                if i < total_pending - 1: # Não aplicar delay após a última mensagem
-                    current_app.logger.info(f"THREAD: Aguardando {DEFAULT_MESSAGE_DELAY_SECONDS} segundos...")
-                    time.sleep(DEFAULT_MESSAGE_DELAY_SECONDS)
-
-            final_status = "COMPLETED"
-            if failure_count > 0 and success_count > 0:
-                final_status = "COMPLETED_WITH_ERRORS"
-            elif failure_count > 0 and success_count == 0:
-                final_status = "FAILED"
-            
-            database_manager.update_campaign_status(campaign_id, final_status)
-            current_app.logger.info(f"THREAD: Processamento da campanha {campaign_id} concluído. Status: {final_status}")
-            socketio_instance.emit('campaign_finished', {
-                'campaign_id': campaign_id, 'status': final_status,
-                'success_count': success_count, 'failure_count': failure_count,
-                'total_dispatches': total_pending
-            })
         except Exception as e:
-            current_app.logger.error(f"THREAD: Erro catastrófico processando campanha {campaign_id}: {e}", exc_info=True)
-            database_manager.update_campaign_status(campaign_id, "FAILED")
-            socketio_instance.emit('campaign_error', {'campaign_id': campaign_id, 'message': f'Erro interno no servidor: {str(e)}'})
+            app.logger.error(f"MONITOR: Erro ao ler o progresso das campanhas: {e}", exc_info=True)
 
 
 # --- Rotas Flask ---
@@ -212,15 +243,7 @@ def manage_lists():
             
             try:
                 file.save(filepath_abs)
-                contacts = csv_processor.load_contacts_from_csv(filepath_abs)
-                num_contacts = len(contacts) if contacts else 0
-                if num_contacts > 0:
-                    flash(f"Arquivo '{filename_to_save}' carregado com sucesso! ({num_contacts} contatos)", 'success')
-                elif contacts is None:
-                     flash(f"Erro ao ler o arquivo '{filename_to_save}'. Verifique o formato.", 'danger')
-                     if os.path.exists(filepath_abs): os.remove(filepath_abs)
-                else:
-                    flash(f"Arquivo '{filename_to_save}' carregado, mas nenhum contato válido encontrado.", 'warning')
+                import_csv_as_list(filepath_abs, filename_to_save)
             except Exception as e:
                 flash(f"Erro crítico ao salvar/processar '{filename_to_save}': {str(e)}", 'danger')
             return redirect(url_for('manage_lists'))
@@ -228,6 +251,7 @@ def manage_lists():
             flash('Tipo de arquivo CSV inválido! Apenas .csv são permitidos.', 'danger')
             return redirect(request.url)
 
+    # Arquivos deixados na pasta antes das listas no banco (ou cuja importação falhou): podem ser importados
     uploaded_files = []
     if os.path.exists(csv_upload_folder_abs):
         try:
@@ -240,14 +264,13 @@ def manage_lists():
             
     return render_template('manage_lists.html', 
                            title="Gerenciar Listas", 
+                           contact_lists=database_manager.get_contact_lists(),
                            uploaded_files=uploaded_files,
                            csv_upload_folder=app.config['UPLOAD_FOLDER_CSV'])
 
 
 @app.route('/campaigns/new', methods=['GET', 'POST'])
 def create_campaign():
-    # Pasta de upload de CSVs (relativa ao 'frontend')
-    csv_upload_folder_abs = os.path.join(app.root_path, app.config['UPLOAD_FOLDER_CSV'])
     # Pasta de upload de imagens da campanha (relativa ao 'frontend')
     campaign_images_folder_abs = os.path.join(app.root_path, app.config['UPLOAD_FOLDER_IMAGES'])
     os.makedirs(campaign_images_folder_abs, exist_ok=True)
@@ -255,20 +278,36 @@ def create_campaign():
 
     if request.method == 'POST':
         campaign_name_form = request.form.get('campaign_name')
-        selected_csv_filename = request.form.get('csv_file')
+        selected_list_id = request.form.get('list_id', type=int)
+        since_import_id = request.form.get('since_import_id', type=int)
         message_template = request.form.get('message_template')
         campaign_image_file = request.files.get('campaign_image')
+        priority = campaign_scheduler.normalize_priority(request.form.get('priority', CAMPAIGN_DEFAULT_PRIORITY))
+        send_window_start = request.form.get('send_window_start', '').strip() or None
+        send_window_end = request.form.get('send_window_end', '').strip() or None
 
-        if not campaign_name_form or not selected_csv_filename or not message_template:
-            flash('Nome da campanha, lista CSV e template da mensagem são obrigatórios!', 'danger')
-            available_csvs = []
-            if os.path.exists(csv_upload_folder_abs):
-                available_csvs = [f for f in os.listdir(csv_upload_folder_abs) if allowed_file(f, ALLOWED_EXTENSIONS_CSV)]
-            return render_template('create_campaign.html', title="Criar Campanha", available_csv_files=available_csvs, csv_upload_folder=app.config['UPLOAD_FOLDER_CSV']), 400
+        if not campaign_name_form or not selected_list_id or not message_template:
+            flash('Nome da campanha, lista de contatos e template da mensagem são obrigatórios!', 'danger')
+            contact_lists = database_manager.get_contact_lists()
+            return render_template('create_campaign.html', title="Criar Campanha", contact_lists=contact_lists,
+                                   list_imports=list_imports_by_list(contact_lists),
+                                   default_priority=CAMPAIGN_DEFAULT_PRIORITY, max_priority=CAMPAIGN_MAX_PRIORITY), 400
 
-        csv_filepath_abs = os.path.join(csv_upload_folder_abs, selected_csv_filename)
-        if not os.path.exists(csv_filepath_abs):
-            flash(f"Arquivo CSV '{selected_csv_filename}' não encontrado!", 'danger')
+        try:
+            if (campaign_scheduler.parse_time_of_day(send_window_start) is None) != (campaign_scheduler.parse_time_of_day(send_window_end) is None):
+                flash('Informe o início e o fim da janela de envio (ou deixe os dois em branco).', 'danger')
+                return redirect(url_for('create_campaign'))
+        except ValueError:
+            flash('Horário da janela de envio inválido. Use o formato HH:MM.', 'danger')
+            return redirect(url_for('create_campaign'))
+
+        contact_list = database_manager.get_contact_list(selected_list_id)
+        if contact_list is None:
+            flash(f"Lista de contatos {selected_list_id} não encontrada!", 'danger')
+            return redirect(url_for('create_campaign'))
+        if since_import_id is not None and since_import_id not in {
+                list_import['import_id'] for list_import in database_manager.get_contact_list_imports(selected_list_id)}:
+            flash("A importação escolhida para \"só os contatos novos\" não é da lista selecionada.", 'danger')
             return redirect(url_for('create_campaign'))
 
         image_filename_for_db = None
@@ -290,25 +329,24 @@ def create_campaign():
         campaign_id = "camp_web_" + uuid.uuid4().hex[:10]
         
         if not database_manager.add_campaign(
-            campaign_id, selected_csv_filename, message_template, image_filename_for_db
+            campaign_id, contact_list['name'], message_template, image_filename_for_db,
+            priority=priority, send_window_start=send_window_start, send_window_end=send_window_end,
+            list_id=selected_list_id
         ):
             flash(f"Falha ao registrar a campanha '{campaign_id}' no BD.", 'danger')
             return redirect(url_for('create_campaign'))
 
-        contacts = csv_processor.load_contacts_from_csv(csv_filepath_abs)
-        if not contacts:
-            flash(f"Nenhum contato válido no CSV '{selected_csv_filename}'. Campanha '{campaign_id}' criada, mas sem contatos.", 'warning')
-            database_manager.update_campaign_status(campaign_id, "FAILED_NO_CONTACTS")
-            return redirect(url_for('list_campaigns'))
-
-        contacts_added_to_log = 0
-        for contact_data in contacts:
-            phone = contact_data.get('telefone')
-            name = contact_data.get('nome', '')
-            if phone:
-                log_id = database_manager.add_dispatch_contact(campaign_id, phone, name, status='PENDING')
-                if log_id: contacts_added_to_log +=1
-        
+        # Um único INSERT ... SELECT a partir da lista já importada: não depende do tamanho do CSV
+        contacts_added_to_log, contacts_rejected, contacts_duplicated, contacts_suppressed = database_manager.enqueue_contact_list(
+            campaign_id, selected_list_id, since_import_id=since_import_id
+        )
+        if contacts_rejected:
+            flash(f"{contacts_rejected} contato(s) não foram adicionados à fila da campanha '{campaign_id}'.", 'warning')
+        if contacts_duplicated:
+            flash(f"{contacts_duplicated} telefone(s) repetido(s) na lista foram enfileirados uma única vez.", 'info')
+        if contacts_suppressed:
+            flash(f"{contacts_suppressed} contato(s) na lista de supressão (opt-out) foram retirados da campanha.", 'info')
+
         if contacts_added_to_log == 0 :
              flash(f"Campanha '{campaign_name_form}' (ID: {campaign_id}) criada, mas NENHUM contato foi adicionado à fila.", 'warning')
              database_manager.update_campaign_status(campaign_id, "FAILED_NO_CONTACTS")
@@ -317,17 +355,13 @@ def create_campaign():
         
         return redirect(url_for('list_campaigns'))
 
-    available_csvs = []
-    if os.path.exists(csv_upload_folder_abs):
-        try:
-            available_csvs = sorted([f for f in os.listdir(csv_upload_folder_abs) if allowed_file(f, ALLOWED_EXTENSIONS_CSV)])
-        except Exception as e:
-            flash(f"Erro ao listar CSVs: {str(e)}", "danger")
-            
+    contact_lists = database_manager.get_contact_lists()
     return render_template('create_campaign.html', 
                            title="Criar Nova Campanha", 
-                           available_csv_files=available_csvs,
-                           csv_upload_folder=app.config['UPLOAD_FOLDER_CSV'])
+                           contact_lists=contact_lists,
+                           list_imports=list_imports_by_list(contact_lists),
+                           default_priority=CAMPAIGN_DEFAULT_PRIORITY,
+                           max_priority=CAMPAIGN_MAX_PRIORITY)
 
 
 @app.route('/campaigns')
@@ -337,23 +371,93 @@ def list_campaigns():
         'COMPLETED_WITH_ERRORS', 'FAILED_NO_CONTACTS', 'PAUSED', 'FAILED' 
     ])
     campaigns_for_template = [dict(campaign) for campaign in all_campaigns_rows] if all_campaigns_rows else []
+    all_stats = database_manager.get_all_campaign_stats() # Contadores mantidos no BD: uma consulta para a lista toda
+    for campaign in campaigns_for_template:
+        campaign.update(campaign_totals(all_stats.get(campaign['campaign_id'], {})))
+    if any(campaign['status'] == 'IN_PROGRESS' for campaign in campaigns_for_template):
+        schedule_estimates = campaign_scheduler.get_schedule_estimates()
+        for campaign in campaigns_for_template:
+            campaign['schedule_text'] = describe_schedule(schedule_estimates.get(campaign['campaign_id']))
     return render_template('list_campaigns.html', 
                            title="Minhas Campanhas", 
                            campaigns=campaigns_for_template)
 
+def dispatch_log_query_args(args):
+    """
+    Lê filtros e cursores da página de detalhes (status, phone, after, before, limit) da query string.
+    Retorna (filtros, erro); filtros inválidos geram a mensagem de erro.
+    """
+    status = (args.get('status') or '').strip().upper() or None
+    if status and status not in DISPATCH_LOG_STATUSES:
+        return None, f"Status inválido: {status}."
+    phone = csv_processor.clean_phone_number(args.get('phone') or '') or None
+    try:
+        after_log_id = int(args['after']) if args.get('after') else None
+        before_log_id = int(args['before']) if args.get('before') else None
+        limit = int(args.get('limit') or DISPATCH_LOG_PAGE_SIZE)
+    except ValueError:
+        return None, "Parâmetros de paginação inválidos."
+    limit = max(1, min(DISPATCH_LOG_MAX_PAGE_SIZE, limit))
+    return {'status': status, 'contact_phone': phone, 'after_log_id': after_log_id,
+            'before_log_id': before_log_id, 'limit': limit}, None
+
+def load_dispatch_log_page(campaign_id, filters):
+    """Página do log de disparos e cursores (next_after/prev_before) para a tela e a API de detalhes."""
+    dispatches, has_more = database_manager.get_dispatch_log_page(campaign_id, **filters)
+    page = {'dispatches': dispatches, 'next_after': None, 'prev_before': None}
+    if not dispatches:
+        return page
+    if filters['before_log_id'] is not None:
+        # Voltando: a página seguinte sempre existe; a anterior, se has_more
+        page['next_after'] = dispatches[-1]['log_id']
+        page['prev_before'] = dispatches[0]['log_id'] if has_more else None
+    else:
+        page['next_after'] = dispatches[-1]['log_id'] if has_more else None
+        page['prev_before'] = dispatches[0]['log_id'] if filters['after_log_id'] else None
+    return page
+
 @app.route('/campaigns/<campaign_id>/details')
 def campaign_details_page(campaign_id):
     campaign = database_manager.get_campaign_details(campaign_id)
     if not campaign:
         flash(f"Campanha {campaign_id} não encontrada.", "danger")
         return redirect(url_for('list_campaigns'))
-    
-    # Futuramente, buscar logs de 'dispatch_log' para esta campanha
-    # logs = database_manager.get_dispatches_for_campaign(campaign_id) # Exemplo
-    flash(f"Página de detalhes para campanha {campaign_id} (Em desenvolvimento - logs e mais infos aqui).", "info")
-    # Por enquanto, redireciona, mas idealmente teria seu próprio template.
-    # return render_template('campaign_details.html', campaign=dict(campaign), logs=logs)
-    return redirect(url_for('list_campaigns'))
+
+    filters, error = dispatch_log_query_args(request.args)
+    if error:
+        flash(error, "warning")
+        return redirect(url_for('campaign_details_page', campaign_id=campaign_id))
+
+    status_counts = database_manager.get_campaign_stats(campaign_id)
+    page = load_dispatch_log_page(campaign_id, filters)
+    return render_template('campaign_details.html',
+                           title=f"Campanha {campaign_id}",
+                           campaign=dict(campaign),
+                           status_counts=status_counts,
+                           totals=campaign_totals(status_counts),
+                           statuses=DISPATCH_LOG_STATUSES,
+                           filters=filters,
+                           **page)
+
+@app.route('/api/campaigns/<campaign_id>/dispatches')
+def campaign_dispatches_api(campaign_id):
+    """
+    Log de disparos da campanha em JSON, com paginação keyset: ?after=<log_id> (próxima página) ou
+    ?before=<log_id> (anterior), filtros ?status= e ?phone= e ?limit= (até DISPATCH_LOG_MAX_PAGE_SIZE).
+    """
+    campaign = database_manager.get_campaign_details(campaign_id)
+    if not campaign:
+        return jsonify({'error': f"Campanha {campaign_id} não encontrada."}), 404
+    filters, error = dispatch_log_query_args(request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    status_counts = database_manager.get_campaign_stats(campaign_id)
+    return jsonify(dict(
+        load_dispatch_log_page(campaign_id, filters),
+        campaign_id=campaign_id,
+        status=campaign['status'],
+        summary=dict(campaign_totals(status_counts), by_status=status_counts),
+    ))
 
 
 @app.route('/campaigns/<campaign_id>/start', methods=['POST'])
@@ -369,22 +473,81 @@ def start_campaign_processing_route(campaign_id):
         flash(f"Campanha {campaign_id} não pode ser iniciada (status atual: {campaign['status']}).", 'warning')
         return redirect(url_for('list_campaigns'))
 
+    if campaign['archived_at']:
+        flash(f"Campanha {campaign_id} está arquivada e não pode ser reiniciada.", 'warning')
+        return redirect(url_for('list_campaigns'))
+
+    # Apenas enfileira: o worker de disparos (backend/dispatch_worker.py) pega campanhas IN_PROGRESS no BD
     database_manager.update_campaign_status(campaign_id, "IN_PROGRESS")
-    flash(f"Iniciando disparos para a campanha '{campaign['csv_filename']}' (ID: {campaign_id}).", 'info')
+    flash(f"Campanha '{campaign['csv_filename']}' (ID: {campaign_id}) enviada para a fila de disparos.", 'info')
 
     socketio.emit('campaign_status_update', {
         'campaign_id': campaign_id,
         'status': 'IN_PROGRESS',
-        'message': 'Processamento da campanha iniciado...'
+        'message': 'Campanha na fila do worker de disparos...'
     })
 
-    thread = Thread(target=process_campaign_dispatches_web, args=(current_app.app_context(), socketio, campaign_id))
-    thread.daemon = True
-    thread.start()
-    
     return redirect(url_for('list_campaigns'))
 
 
+@app.route('/api/wpp/stats')
+def wpp_client_stats():
+    """
+    Estatísticas do cliente HTTP do wppconnect (reuso de conexões, latência por endpoint,
+    renovações de token e respostas 401) e do cache de imagens, somadas entre os workers de disparo
+    ativos (publicadas por eles em worker_stats). 'workers' traz os números de cada processo.
+    """
+    workers = database_manager.get_worker_stats()
+    totals = {
+        key: sum(worker['client'][key] for worker in workers)
+        for key in ('requests', 'errors', 'connections_opened', 'connections_reused', 'replays_after_401')
+    }
+    latency = {}
+    for worker in workers:
+        for action, endpoint in worker['client']['latency_by_endpoint'].items():
+            combined = latency.setdefault(action, {'requests': 0, 'avg_ms': 0.0, 'max_ms': 0.0})
+            requests_before = combined['requests']
+            combined['requests'] += endpoint['requests']
+            if combined['requests']: # Média ponderada pela quantidade de requisições de cada worker
+                combined['avg_ms'] = round((combined['avg_ms'] * requests_before + endpoint['avg_ms'] * endpoint['requests'])
+                                           / combined['requests'], 1)
+            combined['max_ms'] = max(combined['max_ms'], endpoint['max_ms'])
+    totals['latency_by_endpoint'] = latency
+    totals['media_cache'] = {
+        key: sum(worker['media_cache'][key] for worker in workers) for key in ('entries', 'bytes', 'hits', 'misses')
+    }
+    totals['workers'] = workers
+    return jsonify(totals)
+
+
+@app.route('/api/schedule')
+def campaign_schedule_status():
+    """Previsão de início/término das campanhas IN_PROGRESS, com a divisão dos envios por prioridade."""
+    estimates = campaign_scheduler.get_schedule_estimates()
+    return jsonify({
+        'sends_per_second': campaign_scheduler.current_send_budget(),
+        'campaigns': {
+            campaign_id: dict(estimate,
+                              start_at=estimate['start_at'].isoformat() if estimate['start_at'] else None,
+                              finish_at=estimate['finish_at'].isoformat() if estimate['finish_at'] else None)
+            for campaign_id, estimate in estimates.items()
+        },
+    })
+
+
+@app.route('/api/rate')
+def send_rate_status():
+    """
+    Taxa de envios atual de cada sessão (controle adaptativo) e o total em envios/min. Os controladores
+    de taxa vivem nos processos do worker de disparos, que publicam o estado deles em session_rates.
+    """
+    sessions = database_manager.get_session_rates()
+    return jsonify({
+        'sends_per_minute': round(sum(session['sends_per_minute'] for session in sessions if session['connected']), 1),
+        'sessions': sessions,
+    })
+
+
 # --- Handlers Socket.IO ---
 @socketio.on('connect')
 def handle_connect():
@@ -400,6 +563,59 @@ def handle_my_custom_event(json_data):
     current_app.logger.info(f'Recebido my_event de {request.sid}: {str(json_data)}')
     emit('my_response', json_data, broadcast=False, to=request.sid) # Envia de volta para o emissor
 
+@app.route('/lists/import/<path:filename>', methods=['POST'])
+def import_list_file(filename):
+    """Importa para o banco um CSV que ficou na pasta de uploads (ex: carregado antes das listas no banco)."""
+    csv_upload_folder_abs = os.path.join(app.root_path, app.config['UPLOAD_FOLDER_CSV'])
+    filepath_to_import = os.path.join(csv_upload_folder_abs, filename)
+    if not os.path.normpath(filepath_to_import).startswith(os.path.normpath(csv_upload_folder_abs)):
+        flash('Tentativa de importação de arquivo inválida.', 'danger')
+        return redirect(url_for('manage_lists'))
+    if not os.path.exists(filepath_to_import):
+        flash(f"Arquivo '{filename}' não encontrado para importação.", 'warning')
+        return redirect(url_for('manage_lists'))
+    try:
+        import_csv_as_list(filepath_to_import, filename)
+    except Exception as e:
+        flash(f"Erro crítico ao importar '{filename}': {str(e)}", 'danger')
+    return redirect(url_for('manage_lists'))
+
+@app.route('/lists/<int:list_id>/update', methods=['POST'])
+def update_list(list_id):
+    """Atualiza uma lista com a nova versão do arquivo (ex: a base de clientes exportada de novo), gravando só as alterações."""
+    contact_list = database_manager.get_contact_list(list_id)
+    if contact_list is None:
+        flash(f"Lista {list_id} não encontrada para atualização.", 'warning')
+        return redirect(url_for('manage_lists'))
+    file = request.files.get('csv_file')
+    if not file or file.filename == '':
+        flash('Nenhum arquivo selecionado para atualizar a lista!', 'danger')
+        return redirect(url_for('manage_lists'))
+    if not allowed_file(file.filename, ALLOWED_EXTENSIONS_CSV):
+        flash('Tipo de arquivo CSV inválido! Apenas .csv são permitidos.', 'danger')
+        return redirect(url_for('manage_lists'))
+    csv_upload_folder_abs = os.path.join(app.root_path, app.config['UPLOAD_FOLDER_CSV'])
+    os.makedirs(csv_upload_folder_abs, exist_ok=True)
+    # Nome temporário: o arquivo não deve aparecer entre os "ainda não importados" se algo falhar no meio
+    filepath_abs = os.path.join(csv_upload_folder_abs, f".update_{list_id}_{uuid.uuid4().hex[:8]}.csv")
+    try:
+        file.save(filepath_abs)
+        reimport_csv_into_list(filepath_abs, file.filename, contact_list, delete_missing='delete_missing' in request.form)
+    except Exception as e:
+        flash(f"Erro crítico ao atualizar a lista '{contact_list['name']}' com '{file.filename}': {str(e)}", 'danger')
+    return redirect(url_for('manage_lists'))
+
+@app.route('/lists/<int:list_id>/delete', methods=['POST'])
+def delete_list(list_id):
+    contact_list = database_manager.get_contact_list(list_id)
+    if contact_list is None:
+        flash(f"Lista {list_id} não encontrada para exclusão.", 'warning')
+    elif database_manager.delete_contact_list(list_id):
+        flash(f"Lista '{contact_list['name']}' excluída com sucesso. Campanhas já criadas com ela não são afetadas.", 'success')
+    else:
+        flash(f"Erro ao excluir a lista '{contact_list['name']}'.", 'danger')
+    return redirect(url_for('manage_lists'))
+
 @app.route('/lists/delete/<path:filename>', methods=['POST'])
 def delete_list_file(filename):
     # Caminho absoluto para a pasta de upload de CSVs
@@ -436,6 +652,8 @@ if __name__ == '__main__':
     # Use app.logger em vez de current_app.logger aqui
     app.logger.info("StoreBot: Tabelas do banco de dados verificadas/criadas.")
     app.logger.info("StoreBot: Iniciando servidor Flask com SocketIO na porta 5001...")
+    app.logger.info("StoreBot: Os disparos são feitos pelo worker: python -m backend.dispatch_worker")
+    socketio.start_background_task(campaign_progress_monitor, socketio)
     
     # O uso de use_reloader=True com eventlet/gevent pode às vezes ser problemático
     # Se você tiver problemas com threads duplicadas ou inicialização estranha,